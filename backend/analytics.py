@@ -0,0 +1,172 @@
+"""Owner analytics computed with pandas/NumPy.
+
+The API process pulls narrow projections from Mongo (a few fields per
+document, pre-grouped where Mongo can do it) and hands the records to
+build_owner_report. That function runs in a worker process, builds
+DataFrames and computes every report with vectorized operations. Its
+output is plain JSON-friendly Python so it can be pickled back and cached.
+
+Reports:
+  retention_cohorts  members grouped by start month; share of each cohort
+                     with at least one visit N months after joining
+  churn_by_plan      expired members per plan, overall and in the window
+  visit_frequency    distribution of visits per active member in the window
+  workout_adherence  completed vs scheduled workouts in the window
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+VISIT_BINS = [0, 1, 2, 5, 9, 13, np.inf]
+VISIT_BIN_LABELS = ["0", "1", "2-4", "5-8", "9-12", "13+"]
+ADHERENCE_BINS = [0, 0.25, 0.5, 0.75, 1.0000001]
+ADHERENCE_BIN_LABELS = ["0-25%", "25-50%", "50-75%", "75-100%"]
+
+def month_index(values) -> np.ndarray:
+    """Months since year 0 for datetimes, so month arithmetic is integer subtraction"""
+    values = pd.to_datetime(pd.Series(values))
+    return (values.dt.year * 12 + values.dt.month - 1).to_numpy()
+
+def month_label(index: int) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def retention_cohorts(members: pd.DataFrame, buckets: pd.DataFrame, as_of: datetime, months: int) -> List[dict]:
+    if members.empty:
+        return []
+    current = int(month_index([as_of])[0])
+    members = members.assign(cohort=month_index(members["start_date"]))
+    members = members[members["cohort"] > current - months]
+    if members.empty:
+        return []
+
+    sizes = members.groupby("cohort").size()
+    retained = pd.DataFrame(0, index=sizes.index, columns=range(months))
+    if not buckets.empty:
+        months_text = buckets["month"].astype(str)
+        visits = buckets.assign(visit_month=months_text.str[:4].astype(int) * 12 + months_text.str[5:7].astype(int) - 1)
+        visits = visits.merge(members[["id", "cohort"]], left_on="member_id", right_on="id")
+        visits["offset"] = visits["visit_month"] - visits["cohort"]
+        visits = visits[(visits["offset"] >= 0) & (visits["offset"] < months)]
+        counts = visits.drop_duplicates(["member_id", "offset"]).groupby(["cohort", "offset"]).size().unstack(fill_value=0)
+        retained = retained.add(counts, fill_value=0)
+    rates = retained.div(sizes, axis=0)
+
+    return [
+        {
+            "cohort": month_label(int(cohort)),
+            "members": int(sizes[cohort]),
+            # Only months that have started count; later offsets are still in the future
+            "retention": [round(float(rate), 4) for rate in rates.loc[cohort].to_numpy()[:current - int(cohort) + 1]],
+        }
+        for cohort in sizes.index
+    ]
+
+def churn_by_plan(members: pd.DataFrame, plan_names: Dict[str, str], as_of: datetime, window_days: int) -> List[dict]:
+    if members.empty:
+        return []
+    expired = members["membership_status"].to_numpy() == "expired"
+    recent = expired & (pd.to_datetime(members["end_date"]).to_numpy() >= np.datetime64(as_of - timedelta(days=window_days)))
+    frame = pd.DataFrame({
+        "plan_id": members["plan_id"].to_numpy(),
+        "members": 1,
+        "active": members["membership_status"].to_numpy() == "active",
+        "churned": expired,
+        "churned_recently": recent,
+    }).groupby("plan_id").sum()
+    frame["churn_rate"] = frame["churned"] / frame["members"]
+    frame = frame.sort_values("churn_rate", ascending=False)
+
+    return [
+        {
+            "plan_id": plan_id,
+            "plan_name": plan_names.get(plan_id, "Unknown Plan"),
+            "members": int(row.members),
+            "active": int(row.active),
+            "churned": int(row.churned),
+            "churned_recently": int(row.churned_recently),
+            "churn_rate": round(float(row.churn_rate), 4),
+        }
+        for plan_id, row in frame.iterrows()
+    ]
+
+def visit_frequency(active_member_ids: np.ndarray, visit_counts: pd.DataFrame) -> dict:
+    counts = pd.Series(0, index=pd.Index(active_member_ids, name="member_id"), dtype="int64")
+    if not visit_counts.empty:
+        counts = counts.add(visit_counts.set_index("member_id")["visits"], fill_value=0).reindex(counts.index)
+    values = counts.to_numpy(dtype=float)
+    histogram, _ = np.histogram(values, bins=VISIT_BINS)
+    return {
+        "members": int(values.size),
+        "mean": round(float(values.mean()), 2) if values.size else 0.0,
+        "median": float(np.median(values)) if values.size else 0.0,
+        "p90": float(np.percentile(values, 90)) if values.size else 0.0,
+        "inactive_share": round(float((values == 0).mean()), 4) if values.size else 0.0,
+        "distribution": dict(zip(VISIT_BIN_LABELS, (int(count) for count in histogram))),
+    }
+
+def workout_adherence(progress: pd.DataFrame, as_of: datetime) -> dict:
+    if progress.empty:
+        return {"scheduled": 0, "completed": 0, "skipped": 0, "missed": 0, "adherence": 0.0,
+                "member_distribution": dict.fromkeys(ADHERENCE_BIN_LABELS, 0), "by_workout": []}
+
+    status = progress["status"].to_numpy()
+    completed = status == "completed"
+    skipped = status == "skipped"
+    # Pending sessions whose date has passed were never done
+    missed = (status == "pending") & (pd.to_datetime(progress["scheduled_date"]).to_numpy() < np.datetime64(as_of))
+    due = completed | skipped | missed
+    frame = pd.DataFrame({
+        "member_id": progress["member_id"].to_numpy(),
+        "workout_name": progress["workout_name"].to_numpy(),
+        "due": due,
+        "completed": completed,
+    })
+
+    per_member = frame.groupby("member_id")[["due", "completed"]].sum()
+    per_member = per_member[per_member["due"] > 0]
+    member_rates = (per_member["completed"] / per_member["due"]).to_numpy()
+    histogram, _ = np.histogram(member_rates, bins=ADHERENCE_BINS)
+
+    per_workout = frame.groupby("workout_name")[["due", "completed"]].sum()
+    per_workout = per_workout[per_workout["due"] > 0].sort_values("due", ascending=False).head(10)
+
+    return {
+        "scheduled": int(due.sum()),
+        "completed": int(completed.sum()),
+        "skipped": int(skipped.sum()),
+        "missed": int(missed.sum()),
+        "adherence": round(float(completed.sum() / due.sum()), 4) if due.any() else 0.0,
+        "member_distribution": dict(zip(ADHERENCE_BIN_LABELS, (int(count) for count in histogram))),
+        "by_workout": [
+            {
+                "workout_name": name,
+                "scheduled": int(row.due),
+                "completed": int(row.completed),
+                "adherence": round(float(row.completed / row.due), 4),
+            }
+            for name, row in per_workout.iterrows()
+        ],
+    }
+
+def build_owner_report(data: dict, as_of: datetime, cohort_months: int = 12, window_days: int = 30) -> dict:
+    """Entry point for the worker process; `data` holds lists of projected records"""
+    members = pd.DataFrame.from_records(
+        data["members"], columns=["id", "plan_id", "membership_status", "start_date", "end_date"]
+    )
+    buckets = pd.DataFrame.from_records(data["attendance_buckets"], columns=["member_id", "month"])
+    visit_counts = pd.DataFrame.from_records(data["visit_counts"], columns=["member_id", "visits"])
+    progress = pd.DataFrame.from_records(
+        data["workout_progress"], columns=["member_id", "workout_name", "status", "scheduled_date"]
+    )
+    active_ids = members.loc[members["membership_status"] == "active", "id"].to_numpy()
+
+    return {
+        "as_of": as_of,
+        "window_days": window_days,
+        "retention_cohorts": retention_cohorts(members, buckets, as_of, cohort_months),
+        "churn_by_plan": churn_by_plan(members, data["plan_names"], as_of, window_days),
+        "visit_frequency": visit_frequency(active_ids, visit_counts),
+        "workout_adherence": workout_adherence(progress, as_of),
+    }
@@ -0,0 +1,267 @@
+"""Opt-in runtime diagnostics for the GYMBLE API workers.
+
+EventLoopMonitor finds synchronous work that blocks the event loop. It
+turns on asyncio debug mode so callbacks slower than the threshold are
+logged. It also samples loop lag with a heartbeat coroutine. A watchdog
+thread grabs the loop thread's stack while a stall is in progress and tags
+it with the route handler found on that stack. Slow callbacks are tagged
+with the route of the request whose task ran them; RequestScopeMiddleware
+records that in a context variable.
+
+StackSampler is a time-boxed statistical profiler for a live worker. It
+reads the loop thread's stack at a fixed interval from a background
+thread and emits collapsed stacks ("frame;frame;frame count") that
+flamegraph.pl and speedscope can load directly.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+# The ASGI scope of the request the current task is serving; the router fills in its endpoint
+current_request_scope = contextvars.ContextVar("current_request_scope", default=None)
+
+class RequestScopeMiddleware:
+    """Pure ASGI middleware that exposes each HTTP request's scope through `current_request_scope`"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            # Not reset afterwards: asyncio reports a slow callback only after the step has
+            # finished, which can be after the whole request. Uvicorn gives every request its own task.
+            current_request_scope.set(scope)
+        await self.app(scope, receive, send)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def find_route(frame, route_handlers: Dict) -> Optional[str]:
+    """Walk a frame chain outwards and return the first route handler on it"""
+    while frame is not None:
+        route = route_handlers.get(frame.f_code)
+        if route:
+            return route
+        frame = frame.f_back
+    return None
+
+class _SlowCallbackHandler(logging.Handler):
+    """Collects asyncio's 'Executing <Handle ...> took N seconds' debug warnings"""
+
+    PATTERN = re.compile(r"Executing (?P<handle>.*) took (?P<seconds>[\d.]+) seconds")
+    CORO_PATTERN = re.compile(r"coro=<(?P<name>[\w.]+)\(\)")
+
+    def __init__(self, monitor):
+        super().__init__(level=logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record):
+        match = self.PATTERN.search(record.getMessage())
+        if not match:
+            return
+        # The top-level coroutine is the server's request task, so prefer the route recorded in that task's context
+        route = self.monitor.route_for_handle(getattr(self.monitor._loop, "_current_handle", None))
+        if route is None:
+            coro = self.CORO_PATTERN.search(match.group("handle"))
+            name = coro.group("name") if coro else None
+            route = self.monitor.route_names.get(name, name)
+        self.monitor.record_event({
+            "kind": "slow_callback",
+            "at": datetime.utcnow().isoformat(),
+            "duration_ms": round(float(match.group("seconds")) * 1000, 1),
+            "route": route,
+            "callback": match.group("handle")[:300],
+        })
+
+class EventLoopMonitor:
+    def __init__(self, slow_callback_ms: float = 100, sample_interval_ms: float = 50, max_events: int = 200):
+        self.slow_callback_seconds = slow_callback_ms / 1000
+        self.sample_interval = sample_interval_ms / 1000
+        self.events = deque(maxlen=max_events)
+        self.lag_samples = deque(maxlen=2000)
+        self.route_handlers = {}  # code object -> "METHOD /path"
+        self.route_names = {}  # function name -> "METHOD /path"
+        self.enabled = False
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._sampler_task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        self._log_handler = _SlowCallbackHandler(self)
+        self._lock = threading.Lock()
+
+    def register_routes(self, routes):
+        """Map each endpoint's code object to its route so stacks can be tagged"""
+        for route in routes:
+            endpoint = getattr(route, "endpoint", None)
+            if endpoint is None or not hasattr(endpoint, "__code__"):
+                continue
+            label = f"{','.join(sorted(getattr(route, 'methods', None) or []))} {route.path}".strip()
+            self.route_handlers[endpoint.__code__] = label
+            self.route_names[endpoint.__name__] = label
+
+    def route_for_handle(self, handle) -> Optional[str]:
+        """Route of the request whose context the asyncio handle ran in, if any"""
+        context = getattr(handle, "_context", None)
+        scope = context.get(current_request_scope) if context is not None else None
+        if not scope:
+            return None
+        endpoint = scope.get("endpoint")
+        route = self.route_handlers.get(getattr(endpoint, "__code__", None))
+        return route or f"{scope.get('method', '')} {scope.get('path', '')}".strip()
+
+    def record_event(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        if self.enabled:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self.slow_callback_seconds
+        logging.getLogger("asyncio").addHandler(self._log_handler)
+        self._heartbeat = time.monotonic()
+        self._sampler_task = self._loop.create_task(self._sample_lag())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        self.enabled = True
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self._stop.set()
+        if self._sampler_task:
+            self._sampler_task.cancel()
+        logging.getLogger("asyncio").removeHandler(self._log_handler)
+        self._loop.set_debug(False)
+        self.enabled = False
+
+    async def _sample_lag(self):
+        while True:
+            expected = self._loop.time() + self.sample_interval
+            await asyncio.sleep(self.sample_interval)
+            self.lag_samples.append(max(0.0, self._loop.time() - expected) * 1000)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        stall = None
+        while not self._stop.wait(self.sample_interval / 2):
+            behind = time.monotonic() - self._heartbeat - self.sample_interval
+            if behind >= self.slow_callback_seconds:
+                if stall is None:
+                    # Capture while the blocking code is still on the loop thread's stack
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    stall = {
+                        "kind": "stall",
+                        "at": datetime.utcnow().isoformat(),
+                        "duration_ms": None,
+                        "route": find_route(frame, self.route_handlers),
+                        "stack": traceback.format_stack(frame)[-25:] if frame else [],
+                    }
+                    self.record_event(stall)
+                stall["duration_ms"] = round(behind * 1000, 1)
+            elif stall is not None:
+                stall = None
+
+    def snapshot(self) -> dict:
+        lags = sorted(self.lag_samples)
+        with self._lock:
+            events = list(self.events)
+        by_route = {}
+        for event in events:
+            route = event.get("route") or "unknown"
+            summary = by_route.setdefault(route, {"count": 0, "max_ms": 0.0})
+            summary["count"] += 1
+            summary["max_ms"] = max(summary["max_ms"], event.get("duration_ms") or 0.0)
+        return {
+            "enabled": self.enabled,
+            "slow_callback_ms": self.slow_callback_seconds * 1000,
+            "loop_lag_ms": {
+                "samples": len(lags),
+                "p50": round(percentile(lags, 50), 2),
+                "p99": round(percentile(lags, 99), 2),
+                "max": round(lags[-1], 2) if lags else 0.0,
+            },
+            "by_route": by_route,
+            "events": list(reversed(events)),
+        }
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+        self.lag_samples.clear()
+
+class StackSampler:
+    """Samples one thread's stack from a background thread and aggregates collapsed stacks"""
+
+    def __init__(self, thread_id: int, route_handlers: Dict, interval_ms: float = 5, include_idle: bool = False):
+        self.thread_id = thread_id
+        self.route_handlers = route_handlers
+        self.interval = interval_ms / 1000
+        self.include_idle = include_idle
+        self.counts = {}
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+
+    def sample_once(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        if frame.f_code.co_filename.endswith("selectors.py"):
+            # The loop is waiting for I/O, not burning CPU
+            self.idle_samples += 1
+            if not self.include_idle:
+                return
+
+        labels = []
+        route = None
+        while frame is not None:
+            labels.append(self.frame_label(frame))
+            route = route or self.route_handlers.get(frame.f_code)
+            frame = frame.f_back
+        labels.reverse()
+        if route:
+            labels.insert(0, f"route:{route.replace(' ', '_')}")
+        stack = ";".join(labels)
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample_once()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        lines = [f"{stack} {count}" for stack, count in sorted(self.counts.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n"
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -9,19 +10,36 @@ from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, validator
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 import jwt
 import bcrypt
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse
+from diagnostics import EventLoopMonitor, RequestScopeMiddleware, StackSampler
+from analytics import build_owner_report
+from pymongo import ReturnDocument, ReplaceOne, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import qrcode
 import io
 import base64
 import hashlib
+import hmac
 import time
 from datetime import timedelta
 import calendar
 import re
+import asyncio
+import csv
+import json
+import itertools
+import socket
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -44,6 +62,30 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
 security = HTTPBearer()
 
+# Attendance QR tokens are HMAC-signed per gym and rotate every QR_ROTATION_SECONDS
+QR_SECRET = os.environ.get('GYMBLE_QR_SECRET') or hmac.new(SECRET_KEY.encode(), b'gymble-attendance-qr', hashlib.sha256).hexdigest()
+QR_ROTATION_SECONDS = max(5, int(os.environ.get('GYMBLE_QR_ROTATION_SECONDS', 30)))
+QR_GRACE_SLOTS = int(os.environ.get('GYMBLE_QR_GRACE_SLOTS', 1))  # Earlier slots still accepted, for slow scans
+
+# Member day passes are Ed25519-signed so kiosks can verify them offline with the public key
+DAY_PASS_SEED = (
+    base64.b64decode(os.environ['GYMBLE_DAY_PASS_KEY']) if os.environ.get('GYMBLE_DAY_PASS_KEY')
+    else hashlib.sha256(SECRET_KEY.encode() + b'gymble-day-pass').digest()
+)
+DAY_PASS_SIGNING_KEY = Ed25519PrivateKey.from_private_bytes(DAY_PASS_SEED)
+DAY_PASS_VERIFY_KEY = DAY_PASS_SIGNING_KEY.public_key()
+
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.environ.get('GYMBLE_ADMIN_EMAILS', '').split(',') if email.strip()
+}
+
+# Opt-in diagnostics: asyncio slow-callback logging plus event loop lag sampling
+DIAGNOSTICS_ENABLED = os.environ.get('GYMBLE_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+event_loop_monitor = EventLoopMonitor(
+    slow_callback_ms=float(os.environ.get('GYMBLE_SLOW_CALLBACK_MS', 100)),
+    sample_interval_ms=float(os.environ.get('GYMBLE_LOOP_SAMPLE_MS', 50))
+)
+
 # Enums
 class MembershipStatus(str, Enum):
     ACTIVE = "active"
@@ -234,6 +276,59 @@ class MemberUpdate(BaseModel):
     membership_status: Optional[MembershipStatus] = None
     auto_renewal: Optional[bool] = None
 
+# Bulk Import Models
+class MemberImportRow(BaseModel):
+    name: str
+    email: EmailStr
+    password: str
+    phone: str
+    plan_id: Optional[str] = None
+    plan_name: Optional[str] = None  # Alternative to plan_id for exported sheets
+    address: Optional[str] = None
+    date_of_birth: Optional[str] = None
+    emergency_contact: Optional[str] = None
+    payment_method: PaymentMethod = PaymentMethod.CASH
+    payment_amount: Optional[float] = None  # Defaults to the plan price
+    start_date: Optional[datetime] = None  # Keeps the original join date when migrating
+    auto_renewal: bool = True
+
+    @validator('password')
+    def validate_password(cls, v):
+        if len(v) < 6:
+            raise ValueError('Password must be at least 6 characters long')
+        return v
+
+    @validator('name')
+    def validate_name(cls, v):
+        if len(v.strip()) < 2:
+            raise ValueError('Name must be at least 2 characters long')
+        return v.strip()
+
+    @validator('phone')
+    def validate_phone(cls, v):
+        if not re.match(r'^[+]?[\d\s\-()]{10,15}$', v):
+            raise ValueError('Invalid phone number format')
+        return v
+
+    @validator('start_date')
+    def validate_start_date(cls, v):
+        # Stored dates are naive UTC throughout the API
+        return naive_utc(v)
+
+class MemberImportRowResult(BaseModel):
+    row: int
+    email: Optional[str] = None
+    status: str  # "created", "duplicate", "invalid", "failed"
+    member_id: Optional[str] = None
+    error: Optional[str] = None
+
+class MemberImportReport(BaseModel):
+    total_rows: int
+    created: int
+    skipped: int
+    failed: int
+    results: List[MemberImportRowResult] = []
+
 # User Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -260,6 +355,8 @@ class Payment(BaseModel):
     notes: Optional[str] = None
     plan_id: str
     plan_name: str
+    idempotency_key: Optional[str] = None  # Unique per gym; repeats return the original payment
+    paid_at: Optional[datetime] = None  # When a pending or overdue payment was settled; payment_date stays its period
 
 class PaymentCreate(BaseModel):
     member_id: str
@@ -267,6 +364,43 @@ class PaymentCreate(BaseModel):
     payment_method: PaymentMethod
     transaction_id: Optional[str] = None
     notes: Optional[str] = None
+    status: PaymentStatus = PaymentStatus.PAID
+    payment_date: Optional[datetime] = None
+    plan_id: Optional[str] = None  # Defaults to the member's current plan
+    idempotency_key: Optional[str] = None
+
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v <= 0:
+            raise ValueError('Amount must be positive')
+        return v
+
+    @validator('payment_date')
+    def validate_payment_date(cls, v):
+        return naive_utc(v)
+
+class PaymentSettle(BaseModel):
+    payment_method: Optional[PaymentMethod] = None
+    transaction_id: Optional[str] = None
+
+class MemberBalance(BaseModel):
+    member_id: str
+    total_paid: float = 0
+    outstanding: float = 0  # Pending and overdue payments not yet settled
+    payments: int = 0
+    last_payment_at: Optional[datetime] = None
+
+class PaymentMonthTotal(BaseModel):
+    month: str  # "YYYY-MM"
+    revenue: float = 0
+    payments: int = 0
+    outstanding: float = 0
+    outstanding_payments: int = 0
+
+class PaymentSummary(BaseModel):
+    months: List[PaymentMonthTotal] = []  # Oldest first, zero-filled
+    total_revenue: float
+    total_outstanding: float
 
 # Check-in Models
 class CheckIn(BaseModel):
@@ -291,11 +425,19 @@ class Announcement(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
     priority: str = "normal"  # normal, high, urgent
+    expires_at: Optional[datetime] = None  # Hidden from feeds and archived after this time
 
 class AnnouncementCreate(BaseModel):
     title: str
     content: str
     priority: str = "normal"
+    expires_at: Optional[datetime] = None
+
+class AnnouncementFeed(BaseModel):
+    announcements: List[Announcement] = []
+    latest: Optional[datetime] = None  # Pass back as `since` to fetch only newer announcements
+    oldest: Optional[datetime] = None  # Pass back as `before` to page further back
+    has_more: bool = False
 
 # Attendance Models
 class AttendanceRecord(BaseModel):
@@ -306,9 +448,12 @@ class AttendanceRecord(BaseModel):
     check_in_time: datetime = Field(default_factory=datetime.utcnow)
     check_out_time: Optional[datetime] = None
     duration_minutes: Optional[int] = None
-    qr_code_data: str  # The QR code data used for check-in
+    qr_code_data: Optional[str] = None  # The QR code data used for check-in (None for staff check-ins)
     ip_address: Optional[str] = None
     device_info: Optional[str] = None
+    source: str = "qr"  # "qr", "qr_location", "kiosk" or "staff"
+    auto_checked_out: bool = False
+    backdated: bool = False  # Recorded after the fact (offline kiosk scans); kept out of live occupancy
 
 # Workout Plan Models
 class ExerciseSet(BaseModel):
@@ -332,6 +477,7 @@ class WorkoutTemplate(BaseModel):
     created_by: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
+    current_version: Optional[str] = None  # Content hash of the latest TemplateVersion
 
 class WorkoutTemplateCreate(BaseModel):
     name: str
@@ -371,6 +517,7 @@ class DietTemplate(BaseModel):
     created_by: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
+    current_version: Optional[str] = None  # Content hash of the latest TemplateVersion
 
 class DietTemplateCreate(BaseModel):
     name: str
@@ -382,6 +529,21 @@ class DietTemplateCreate(BaseModel):
     fat_target: Optional[float] = None
     meals: List[Meal] = []
 
+# Template Version Models
+class TemplateVersion(BaseModel):
+    id: str  # Hash of the template id and content, so re-saving the same content maps to the same version
+    kind: str  # "workout" or "diet"
+    gym_id: str
+    template_id: str
+    content: dict  # WorkoutTemplateCreate / DietTemplateCreate fields
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    saved_at: Optional[datetime] = None  # When this version became current (history listings only)
+
+class TemplateBatch(BaseModel):
+    workout_templates: dict = {}  # template_id -> WorkoutTemplate
+    diet_templates: dict = {}  # template_id -> DietTemplate
+    missing: List[str] = []
+
 # Member Plan Assignment Models
 class MemberPlanAssignment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -391,6 +553,7 @@ class MemberPlanAssignment(BaseModel):
     plan_type: str  # "workout" or "diet"
     plan_id: str  # workout_template_id or diet_template_id
     plan_name: str
+    plan_version: Optional[str] = None  # TemplateVersion the assignment was made against
     assigned_by: str  # gym owner/staff name
     assigned_at: datetime = Field(default_factory=datetime.utcnow)
     start_date: datetime = Field(default_factory=datetime.utcnow)
@@ -421,6 +584,7 @@ class WorkoutProgress(BaseModel):
     assignment_id: str  # reference to MemberPlanAssignment
     workout_template_id: str
     workout_name: str
+    template_version: Optional[str] = None
     scheduled_date: datetime
     completed_at: Optional[datetime] = None
     duration_minutes: Optional[int] = None
@@ -428,6 +592,7 @@ class WorkoutProgress(BaseModel):
     overall_rating: Optional[int] = None  # 1-5 rating
     notes: Optional[str] = None
     status: str = "pending"  # "pending", "completed", "skipped"
+    idempotency_key: Optional[str] = None  # Client-generated, set for entries synced from offline queues
 
 class MealProgress(BaseModel):
     meal_type: str
@@ -435,6 +600,23 @@ class MealProgress(BaseModel):
     total_calories: Optional[int] = None
     notes: Optional[str] = None
 
+class DietAdherence(BaseModel):
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    calories_target: Optional[float] = None
+    protein_target: Optional[float] = None
+    carbs_target: Optional[float] = None
+    fat_target: Optional[float] = None
+    calories_ratio: Optional[float] = None  # consumed / target
+    protein_ratio: Optional[float] = None
+    carbs_ratio: Optional[float] = None
+    fat_ratio: Optional[float] = None
+    meals_logged: int
+    meals_planned: int
+    score: float  # 0-1, how close the day was to the plan
+
 class DietProgress(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     gym_id: str
@@ -442,6 +624,7 @@ class DietProgress(BaseModel):
     assignment_id: str  # reference to MemberPlanAssignment
     diet_template_id: str
     diet_name: str
+    template_version: Optional[str] = None
     date: datetime
     meals_progress: List[MealProgress] = []
     total_calories_consumed: Optional[int] = None
@@ -449,6 +632,8 @@ class DietProgress(BaseModel):
     overall_rating: Optional[int] = None  # 1-5 rating
     notes: Optional[str] = None
     status: str = "pending"  # "pending", "completed"
+    adherence: Optional[DietAdherence] = None  # Computed against the template when logged
+    idempotency_key: Optional[str] = None  # Client-generated, set for entries synced from offline queues
 
 class WorkoutProgressCreate(BaseModel):
     assignment_id: str
@@ -468,6 +653,75 @@ class DietProgressCreate(BaseModel):
     overall_rating: Optional[int] = None
     notes: Optional[str] = None
 
+# Diet Adherence Models
+class DietAdherenceWeek(BaseModel):
+    week: str  # ISO week, "YYYY-Www"
+    entries: int
+    average_score: Optional[float] = None
+    average_calories: Optional[float] = None
+    average_protein: Optional[float] = None
+    average_calories_ratio: Optional[float] = None
+
+class MemberDietAdherence(BaseModel):
+    member_id: str
+    diet_template_id: str
+    diet_name: str
+    weeks: List[DietAdherenceWeek] = []  # Oldest first, zero-filled
+
+class DietPlanAdherence(BaseModel):
+    diet_template_id: str
+    diet_name: str
+    weeks: List[DietAdherenceWeek] = []  # All members of the plan, oldest first
+    members: List[MemberDietAdherence] = []
+
+# Exercise Analytics Models
+class ExerciseBestSet(BaseModel):
+    weight_kg: float
+    reps: int
+    estimated_1rm_kg: float
+    performed_at: datetime
+
+class WeeklyVolume(BaseModel):
+    week: str  # ISO week, "YYYY-Www"
+    volume_kg: float
+
+class ExerciseStats(BaseModel):
+    exercise_name: str
+    sets: int
+    total_reps: int
+    total_volume_kg: float
+    best_weight_kg: float
+    best_set: Optional[ExerciseBestSet] = None  # Set with the highest estimated 1RM
+    last_performed_at: Optional[datetime] = None
+    weekly_volume: List[WeeklyVolume] = []  # Oldest first, zero-filled
+
+class ProgressSyncItem(BaseModel):
+    idempotency_key: str
+    kind: str  # "workout" or "diet"
+    entry: dict  # WorkoutProgressCreate or DietProgressCreate fields
+
+    @validator('idempotency_key')
+    def validate_idempotency_key(cls, v):
+        if not 8 <= len(v.strip()) <= 128:
+            raise ValueError('Idempotency key must be 8-128 characters')
+        return v.strip()
+
+class ProgressSyncRequest(BaseModel):
+    items: List[ProgressSyncItem]
+
+class ProgressSyncItemResult(BaseModel):
+    idempotency_key: str
+    kind: str
+    status: str  # "created", "duplicate" or "failed"
+    id: Optional[str] = None  # Progress record id for created and duplicate items
+    error: Optional[str] = None
+
+class ProgressSyncReport(BaseModel):
+    created: int
+    duplicates: int
+    failed: int
+    results: List[ProgressSyncItemResult] = []
+
 class AttendanceMarkRequest(BaseModel):
     qr_code_data: str
     device_info: Optional[str] = None
@@ -476,15 +730,101 @@ class AttendanceMarkRequest(BaseModel):
 
 class QRCodeResponse(BaseModel):
     qr_code_data: str
-    qr_code_image: str  # Base64 encoded image
+    qr_code_image: Optional[str] = None  # Base64 encoded PNG (format=base64)
+    qr_code_svg: Optional[str] = None  # SVG document (format=svg)
+    qr_code_matrix: Optional[List[str]] = None  # Module rows, "1" = dark, no quiet zone (format=matrix)
     expires_at: datetime
+    rotation_seconds: int = 300
     
+# Day Pass & Kiosk Models
+class DayPassResponse(BaseModel):
+    pass_token: str
+    member_id: str
+    member_name: str
+    valid_on: str  # UTC day, YYYY-MM-DD
+    expires_at: datetime
+    qr_code_image: Optional[str] = None  # Base64 encoded PNG (format=base64)
+    qr_code_svg: Optional[str] = None  # SVG document (format=svg)
+    qr_code_matrix: Optional[List[str]] = None  # Module rows, "1" = dark (format=matrix)
+
+class DayPassVerifyRequest(BaseModel):
+    pass_token: str
+
+class DayPassInfo(BaseModel):
+    valid: bool
+    member_id: Optional[str] = None
+    member_name: Optional[str] = None
+    valid_on: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class KioskConfig(BaseModel):
+    gym_id: str
+    algorithm: str = "Ed25519"
+    public_key: str  # Raw 32-byte key, base64url without padding
+    pass_prefix: str
+    debounce_seconds: int
+    max_scans_per_ingest: int
+    max_scan_age_days: int
+    server_time: datetime
+
+class KioskScan(BaseModel):
+    scan_id: str  # Generated by the kiosk; makes re-uploads idempotent
+    pass_token: str
+    scanned_at: datetime
+
+    @validator('scan_id')
+    def validate_scan_id(cls, v):
+        if not 8 <= len(v.strip()) <= 128:
+            raise ValueError('Scan id must be 8-128 characters')
+        return v.strip()
+
+    @validator('scanned_at')
+    def validate_scanned_at(cls, v):
+        return naive_utc(v)
+
+class KioskIngestRequest(BaseModel):
+    device_id: Optional[str] = None
+    scans: List[KioskScan]
+
+class KioskScanResult(BaseModel):
+    scan_id: str
+    status: str  # "checked_in", "checked_out", "duplicate", "conflict" or "rejected"
+    member_id: Optional[str] = None
+    attendance_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class KioskIngestReport(BaseModel):
+    checked_in: int
+    checked_out: int
+    duplicates: int
+    conflicts: int
+    rejected: int
+    results: List[KioskScanResult] = []
+
 class AttendanceStats(BaseModel):
     date: str
     total_attendance: int
     unique_members: int
     member_details: List[dict] = []
 
+class AttendanceHistoryMonth(BaseModel):
+    month: str  # "YYYY-MM"
+    visits: int
+    visit_days: int
+    total_minutes: int
+    average_duration_minutes: Optional[float] = None
+
+class AttendanceHistory(BaseModel):
+    member_id: str
+    current_streak: int  # Consecutive days visited, ending today or yesterday
+    longest_streak: int
+    total_visits: int
+    average_duration_minutes: Optional[float] = None
+    visits_per_week: float  # Over the requested window
+    last_visit_day: Optional[str] = None
+    months: List[AttendanceHistoryMonth] = []
+    visit_days: List[str] = []  # "YYYY-MM-DD", newest first
+
 # Dashboard Models
 class DashboardStats(BaseModel):
     total_members: int
@@ -504,6 +844,66 @@ class MembershipData(BaseModel):
     plan_name: str
     count: int
 
+class PlanRevenueData(BaseModel):
+    plan_id: str
+    plan_name: str
+    revenue: float
+    payments: int
+
+class RevenueAnalytics(BaseModel):
+    monthly_revenue: List[RevenueData] = []  # Oldest first, zero-filled
+    total_revenue: float
+    revenue_by_plan: List[PlanRevenueData] = []
+    membership_distribution: List[MembershipData] = []  # Active members per plan
+    popular_plan: Optional[str] = None
+
+class RetentionCohort(BaseModel):
+    cohort: str  # "YYYY-MM" the members joined
+    members: int
+    retention: List[float] = []  # Share with a visit 0, 1, 2... months after joining
+
+class PlanChurn(BaseModel):
+    plan_id: str
+    plan_name: str
+    members: int
+    active: int
+    churned: int
+    churned_recently: int  # Expired within the report window
+    churn_rate: float
+
+class VisitFrequency(BaseModel):
+    members: int
+    mean: float
+    median: float
+    p90: float
+    inactive_share: float
+    distribution: dict  # Visit-count bucket -> members
+
+class WorkoutAdherenceByWorkout(BaseModel):
+    workout_name: str
+    scheduled: int
+    completed: int
+    adherence: float
+
+class WorkoutAdherence(BaseModel):
+    scheduled: int
+    completed: int
+    skipped: int
+    missed: int
+    adherence: float
+    member_distribution: dict  # Adherence bucket -> members
+    by_workout: List[WorkoutAdherenceByWorkout] = []
+
+class OwnerAnalyticsReport(BaseModel):
+    gym_id: str
+    day: str
+    generated_at: datetime
+    window_days: int
+    retention_cohorts: List[RetentionCohort] = []
+    churn_by_plan: List[PlanChurn] = []
+    visit_frequency: VisitFrequency
+    workout_adherence: WorkoutAdherence
+
 # Helper functions
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -511,6 +911,33 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert an aware datetime to the naive UTC form stored in Mongo"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def recent_month_keys(months: int, now: Optional[datetime] = None) -> List[str]:
+    """"YYYY-MM" keys for the last `months` months, newest (the current month) first"""
+    now = now or datetime.utcnow()
+    keys = []
+    year, month = now.year, now.month
+    for _ in range(months):
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return keys
+
+# bcrypt releases the GIL, so a thread pool keeps bulk hashing off the event loop
+password_hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """Hash many passwords concurrently in the worker pool"""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*[
+        loop.run_in_executor(password_hash_executor, hash_password, password)
+        for password in passwords
+    ])
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -521,61 +948,491 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def generate_dynamic_qr_code(gym_id: str) -> tuple[str, str, datetime]:
-    """Generate a dynamic QR code that changes every 5 minutes for security"""
-    current_time = int(time.time())
-    # Round to nearest 5 minutes for consistent generation
-    time_slot = (current_time // 300) * 300
-    
-    # Create unique data combining gym_id and time slot
-    qr_data = f"GYMBLE_ATTENDANCE:{gym_id}:{time_slot}"
-    
-    # Create QR code
+# Token format: "G1.<slot base36>.<signature>". The signature is a truncated
+# HMAC-SHA256 over the gym id and time slot, so a token is only valid for one
+# gym and one slot, and checking it needs no database access.
+QR_TOKEN_PREFIX = "G1"
+QR_SIGNATURE_BYTES = 12
+
+def current_qr_slot(now: Optional[float] = None) -> int:
+    return int(now if now is not None else time.time()) // QR_ROTATION_SECONDS
+
+def to_base36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    encoded = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        encoded = digits[remainder] + encoded
+        if not value:
+            return encoded
+
+def sign_qr_slot(gym_id: str, slot: int) -> str:
+    digest = hmac.new(QR_SECRET.encode(), f"{gym_id}:{slot}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:QR_SIGNATURE_BYTES]).decode().rstrip("=")
+
+def create_qr_token(gym_id: str, slot: int) -> str:
+    return f"{QR_TOKEN_PREFIX}.{to_base36(slot)}.{sign_qr_slot(gym_id, slot)}"
+
+QR_FORMATS = ("base64", "png", "svg", "matrix")
+QR_QUIET_ZONE = 4  # Modules of white border around the code
+
+def qr_matrix(qr_data: str) -> List[str]:
+    """Module rows without the quiet zone, "1" for dark modules"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, border=0)
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    return ["".join("1" if module else "0" for module in row) for row in qr.get_matrix()]
+
+def qr_svg(matrix: List[str]) -> str:
+    """Minimal SVG: one path with a rectangle per horizontal run of dark modules"""
+    size = len(matrix) + 2 * QR_QUIET_ZONE
+    runs = []
+    for y, row in enumerate(matrix):
+        for match in re.finditer("1+", row):
+            runs.append(f"M{match.start() + QR_QUIET_ZONE} {y + QR_QUIET_ZONE}h{len(match.group())}v1h-{len(match.group())}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path fill="#000" d="{"".join(runs)}"/></svg>'
+    )
+
+def qr_png(qr_data: str) -> bytes:
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
         box_size=10,
-        border=4,
+        border=QR_QUIET_ZONE,
     )
     qr.add_data(qr_data)
     qr.make(fit=True)
     
-    # Generate QR code image
     img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
     buffer = io.BytesIO()
     img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.read()).decode()
-    
-    # Calculate expiry time (next 5-minute slot)
-    expires_at = datetime.fromtimestamp(time_slot + 300)
-    
-    return qr_data, img_base64, expires_at
-
-def validate_qr_code(qr_data: str, gym_id: str) -> bool:
-    """Validate if QR code is valid and not expired"""
+    return buffer.getvalue()
+
+def render_qr(qr_data: str, qr_format: str):
+    """Render a QR code in one of QR_FORMATS (CPU bound, run in an executor)"""
+    if qr_format == "matrix":
+        return qr_matrix(qr_data)
+    if qr_format == "svg":
+        return qr_svg(qr_matrix(qr_data))
+    png = qr_png(qr_data)
+    return png if qr_format == "png" else base64.b64encode(png).decode()
+
+def validate_qr_code(qr_data: str, gym_id: str, now: Optional[float] = None) -> bool:
+    """Check the token's signature for this gym and that its slot is current (or within the grace slots)"""
+    parts = qr_data.strip().split(".")
+    if len(parts) != 3 or parts[0] != QR_TOKEN_PREFIX or len(parts[1]) > 12:
+        return False
     try:
-        parts = qr_data.split(':')
-        if len(parts) != 3 or parts[0] != "GYMBLE_ATTENDANCE":
-            return False
-        
-        qr_gym_id = parts[1]
-        qr_time_slot = int(parts[2])
-        
-        if qr_gym_id != gym_id:
-            return False
-        
-        current_time = int(time.time())
-        current_slot = (current_time // 300) * 300
-        
-        # Allow current slot and previous slot (10 minutes total validity)
-        valid_slots = [current_slot, current_slot - 300]
-        
-        return qr_time_slot in valid_slots
-    except:
+        slot = int(parts[1], 36)
+    except ValueError:
+        return False
+    
+    current_slot = current_qr_slot(now)
+    if not current_slot - QR_GRACE_SLOTS <= slot <= current_slot:
         return False
+    return hmac.compare_digest(parts[2], sign_qr_slot(gym_id, slot))
+
+class QRRenderCache:
+    """Rendered QR codes per (gym, slot, format).
+
+    Every tablet polling a gym shares one render per slot, and serving a slot
+    also starts rendering the next one in the background, so rotation never
+    puts PIL on the request path.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._renders = {}  # (gym_id, slot, format) -> Future[(token, rendered)]
+
+    def _render(self, gym_id: str, slot: int, qr_format: str) -> asyncio.Future:
+        key = (gym_id, slot, qr_format)
+        future = self._renders.get(key)
+        if future is None:
+            token = create_qr_token(gym_id, slot)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, lambda: (token, render_qr(token, qr_format)))
+            self._renders[key] = future
+            future.add_done_callback(lambda done: self._forget_failed(key, done))
+            if len(self._renders) > self.max_entries:
+                self._prune(slot)
+        return future
+
+    def _forget_failed(self, key: tuple, future: asyncio.Future):
+        # A failed render is retried by the next request instead of being cached
+        if future.cancelled() or future.exception() is not None:
+            self._renders.pop(key, None)
+
+    def _prune(self, current_slot: int):
+        for key in [key for key in self._renders if key[1] < current_slot]:
+            del self._renders[key]
+
+    async def get(self, gym_id: str, qr_format: str = "base64") -> tuple:
+        """(token, rendered code, expires_at) for the gym's current slot"""
+        slot = current_qr_slot()
+        token, rendered = await asyncio.shield(self._render(gym_id, slot, qr_format))
+        self._render(gym_id, slot + 1, qr_format)
+        return token, rendered, datetime.utcfromtimestamp((slot + 1) * QR_ROTATION_SECONDS)
+
+qr_render_cache = QRRenderCache()
+
+# Day pass format: "P1.<payload>.<signature>", both base64url. The payload is
+# compact JSON {"g": gym id, "m": member id, "n": name, "d": UTC day, "x": expiry}
+# and the signature is Ed25519 over "P1.<payload>", so anyone holding the
+# public key (a front-desk kiosk) can check a pass without the server.
+DAY_PASS_PREFIX = "P1"
+DAY_PASS_FORMATS = ("base64", "svg", "matrix")
+DAY_PASS_MAX_LENGTH = 1024
+DAY_PASS_CLOCK_SKEW = timedelta(minutes=5)
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def b64url_decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def day_pass_public_key() -> str:
+    return b64url_encode(DAY_PASS_VERIFY_KEY.public_bytes(Encoding.Raw, PublicFormat.Raw))
+
+def create_day_pass(gym_id: str, member: dict, day_start: datetime, expires_at: datetime) -> str:
+    payload = json.dumps({
+        "g": gym_id,
+        "m": member["id"],
+        "n": member["name"][:40],
+        "d": day_start.strftime("%Y-%m-%d"),
+        "x": int(expires_at.replace(tzinfo=timezone.utc).timestamp())
+    }, separators=(",", ":"))
+    signed = f"{DAY_PASS_PREFIX}.{b64url_encode(payload.encode())}"
+    return f"{signed}.{b64url_encode(DAY_PASS_SIGNING_KEY.sign(signed.encode()))}"
+
+def verify_day_pass(pass_token: str, gym_id: str, at: Optional[datetime] = None) -> Optional[dict]:
+    """Pass details when the signature is good, the pass is for this gym and `at` (default now) is in its day"""
+    parts = pass_token.strip().split(".")
+    if len(pass_token) > DAY_PASS_MAX_LENGTH or len(parts) != 3 or parts[0] != DAY_PASS_PREFIX:
+        return None
+    try:
+        DAY_PASS_VERIFY_KEY.verify(b64url_decode(parts[2]), f"{parts[0]}.{parts[1]}".encode())
+        payload = json.loads(b64url_decode(parts[1]))
+        valid_from = datetime.strptime(payload["d"], "%Y-%m-%d")
+        expires_at = datetime.utcfromtimestamp(payload["x"])
+    except (InvalidSignature, ValueError, KeyError, TypeError):
+        return None
+
+    at = at or datetime.utcnow()
+    if payload.get("g") != gym_id or not valid_from <= at < expires_at:
+        return None
+    return {"member_id": payload["m"], "member_name": payload.get("n"), "valid_on": payload["d"], "expires_at": expires_at}
+
+TRANSACTION_MAX_ATTEMPTS = 3
+TRANSACTION_RETRY_BACKOFF_SECONDS = 0.05
+transactions_supported: Optional[bool] = None  # Detected on first use
+
+async def commit_with_retry(session):
+    """Commit, retrying only when the outcome of the commit itself is unknown"""
+    for attempt in range(1, TRANSACTION_MAX_ATTEMPTS + 1):
+        try:
+            await session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if not e.has_error_label("UnknownTransactionCommitResult") or attempt == TRANSACTION_MAX_ATTEMPTS:
+                raise
+
+async def insert_documents_atomically(writes: List[tuple]):
+    """Insert (collection, document) pairs all-or-nothing.
+
+    Uses a MongoDB transaction with retries on transient errors. Standalone
+    servers cannot run transactions, so there the inserts run in order and
+    any already-written documents are deleted again if a later insert fails.
+    """
+    global transactions_supported
+
+    if transactions_supported is not False:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with await client.start_session() as session:
+                    session.start_transaction()
+                    try:
+                        for collection, document in writes:
+                            await collection.insert_one(document, session=session)
+                    except Exception:
+                        await session.abort_transaction()
+                        raise
+                    await commit_with_retry(session)
+                transactions_supported = True
+                return
+            except OperationFailure as e:
+                # IllegalOperation: "Transaction numbers are only allowed on a replica set member or mongos"
+                if e.code == 20 and transactions_supported is None:
+                    transactions_supported = False
+                    logging.getLogger(__name__).warning("MongoDB transactions unavailable, using compensating writes")
+                    break
+                if not e.has_error_label("TransientTransactionError") or attempt >= TRANSACTION_MAX_ATTEMPTS:
+                    raise
+            except PyMongoError as e:
+                if not e.has_error_label("TransientTransactionError") or attempt >= TRANSACTION_MAX_ATTEMPTS:
+                    raise
+            await asyncio.sleep(TRANSACTION_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+    written = []
+    try:
+        for collection, document in writes:
+            await collection.insert_one(document)
+            written.append((collection, document))
+    except Exception:
+        for collection, document in reversed(written):
+            await collection.delete_one({"id": document["id"]})
+        raise
+
+class PlanCatalogCache:
+    """In-process cache of every plan per gym, including inactive ones.
+
+    Plan writes go through `store`, which updates the cached catalog and bumps
+    the gym's version. A load that started before a write never overwrites
+    the newer entry. Catalogs also expire after `ttl_seconds` so that other
+    uvicorn workers pick up writes they did not see. At most `max_gyms`
+    catalogs are kept (least recently used first out), and gyms without
+    plans are never cached, since the public plan route takes any gym id.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_gyms: int = 2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_gyms = max_gyms
+        self._catalogs = OrderedDict()  # gym_id -> (version, loaded_at, {plan_id: plan})
+        self._versions = {}  # gym_id -> write version
+        self._locks = {}
+
+    def _fresh(self, gym_id: str) -> Optional[dict]:
+        entry = self._catalogs.get(gym_id)
+        if entry and entry[0] == self._versions.get(gym_id, 0) and time.monotonic() - entry[1] < self.ttl_seconds:
+            self._catalogs.move_to_end(gym_id)
+            return entry[2]
+        return None
+
+    async def get_catalog(self, gym_id: str) -> dict:
+        catalog = self._fresh(gym_id)
+        if catalog is not None:
+            return catalog
+
+        lock = self._locks.setdefault(gym_id, asyncio.Lock())
+        try:
+            async with lock:
+                catalog = self._fresh(gym_id)
+                if catalog is not None:
+                    return catalog
+
+                version = self._versions.get(gym_id, 0)
+                plans = await db.plans.find({"gym_id": gym_id}, {"_id": 0}).to_list(None)
+                catalog = {plan["id"]: plan for plan in plans}
+                if catalog and self._versions.get(gym_id, 0) == version:
+                    self._catalogs[gym_id] = (version, time.monotonic(), catalog)
+                    self._catalogs.move_to_end(gym_id)
+                    while len(self._catalogs) > self.max_gyms:
+                        self._catalogs.popitem(last=False)
+                return catalog
+        finally:
+            if not lock.locked():
+                self._locks.pop(gym_id, None)
+
+    async def get_plan(self, gym_id: str, plan_id: str) -> Optional[dict]:
+        if not gym_id:
+            return None
+        return (await self.get_catalog(gym_id)).get(plan_id)
+
+    async def get_active_plans(self, gym_id: str) -> List[dict]:
+        return [plan for plan in (await self.get_catalog(gym_id)).values() if plan.get("is_active", True)]
+
+    def store(self, plan: dict):
+        """Write-through after a plan has been inserted or updated in Mongo"""
+        gym_id = plan["gym_id"]
+        version = self._versions.get(gym_id, 0) + 1
+        self._versions[gym_id] = version
+        entry = self._catalogs.get(gym_id)
+        if entry:
+            catalog = dict(entry[2])
+            catalog[plan["id"]] = {k: v for k, v in plan.items() if k != "_id"}
+            self._catalogs[gym_id] = (version, entry[1], catalog)
+
+    def invalidate(self, gym_id: str):
+        self._versions[gym_id] = self._versions.get(gym_id, 0) + 1
+        self._catalogs.pop(gym_id, None)
+
+plan_cache = PlanCatalogCache()
+
+class TemplateCache:
+    """In-process per-id cache of workout and diet templates.
+
+    `get_many` serves what it can from memory and loads the rest with one
+    `$in` query per collection. Template writes call `invalidate`; a load that
+    raced with a write does not store its stale copy. Entries also expire
+    after `ttl_seconds` for writes made through other workers.
+    """
+
+    def __init__(self, ttl_seconds: int = 120, max_entries: int = 20000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}  # template_id -> (loaded_at, kind, template)
+        self._generations = {}  # template_id -> write generation
+
+    async def get_many(self, gym_id: str, template_ids: List[str]) -> dict:
+        """{template_id: (kind, template)} for the ids found in this gym"""
+        now = time.monotonic()
+        found, missing = {}, []
+        for template_id in template_ids:
+            entry = self._entries.get(template_id)
+            if entry and now - entry[0] < self.ttl_seconds:
+                if entry[2]["gym_id"] == gym_id:
+                    found[template_id] = (entry[1], entry[2])
+            else:
+                missing.append(template_id)
+
+        if missing:
+            generations = {template_id: self._generations.get(template_id, 0) for template_id in missing}
+            query = {"id": {"$in": missing}, "gym_id": gym_id}
+            workouts, diets = await asyncio.gather(
+                db.workout_templates.find(query, {"_id": 0}).to_list(len(missing)),
+                db.diet_templates.find(query, {"_id": 0}).to_list(len(missing))
+            )
+            loaded_at = time.monotonic()
+            for kind, templates in (("workout", workouts), ("diet", diets)):
+                for template in templates:
+                    found[template["id"]] = (kind, template)
+                    if self._generations.get(template["id"], 0) == generations[template["id"]]:
+                        self._entries[template["id"]] = (loaded_at, kind, template)
+            if len(self._entries) > self.max_entries:
+                self._prune(loaded_at)
+        return found
+
+    def invalidate(self, template_id: str):
+        self._generations[template_id] = self._generations.get(template_id, 0) + 1
+        self._entries.pop(template_id, None)
+
+    def _prune(self, now: float):
+        for template_id in [key for key, entry in self._entries.items() if now - entry[0] >= self.ttl_seconds]:
+            del self._entries[template_id]
+        self._generations = {key: value for key, value in self._generations.items() if key in self._entries}
+
+template_cache = TemplateCache()
+
+class RequestCoalescer:
+    """Single-flight: concurrent calls with the same key share one in-flight result"""
+
+    def __init__(self):
+        self._in_flight = {}
+
+    async def run(self, key: str, factory):
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so one cancelled caller does not cancel the query for everyone else
+        return await asyncio.shield(future)
+
+request_coalescer = RequestCoalescer()
+
+class TokenBucketLimiter:
+    """In-memory token buckets keyed by an arbitrary string (per worker).
+
+    `scale` multiplies every rate and burst; load tests raise it so they
+    measure the routes rather than the limiter.
+    """
+
+    def __init__(self, max_buckets: int = 100000, scale: float = 1.0):
+        self.max_buckets = max_buckets
+        self.scale = scale
+        self._buckets = {}  # key -> (tokens, last_refill)
+
+    def acquire(self, key: str, rate: float, burst: int) -> float:
+        """Take one token; returns 0 when allowed, otherwise seconds until a token is available"""
+        rate, burst = rate * self.scale, burst * self.scale
+        now = time.monotonic()
+        tokens, last_refill = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last_refill) * rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+    def _prune(self, now: float):
+        # Buckets untouched for a minute have refilled completely and can be forgotten
+        for key in [key for key, (_, last_refill) in self._buckets.items() if now - last_refill > 60]:
+            del self._buckets[key]
+
+rate_limiter = TokenBucketLimiter()
+
+def rate_limited(name: str, user_limit: tuple, gym_limit: tuple, base_dependency=None):
+    """Dependency that authenticates via `base_dependency`, then applies per-user and per-gym
+    token buckets given as (tokens per second, burst). Exhausted buckets return 429 with Retry-After."""
+    base_dependency = base_dependency or get_current_user
+
+    async def dependency(current_user: User = Depends(base_dependency)):
+        checks = [(f"{name}:user:{current_user.id}", user_limit)]
+        if current_user.gym_id:
+            checks.append((f"{name}:gym:{current_user.gym_id}", gym_limit))
+        for key, (rate, burst) in checks:
+            retry_after = rate_limiter.acquire(key, rate, burst)
+            if retry_after:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests, please retry shortly",
+                    headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+                )
+        return current_user
+
+    return dependency
+
+def encode_keyset_cursor(record: dict, date_field: str) -> str:
+    raw = f"{record[date_field].isoformat()}|{record['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_keyset_cursor(cursor: str) -> tuple:
+    try:
+        date_text, record_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(date_text), record_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+UNPAGED_HISTORY_LIMIT = 1000  # What the history endpoints returned before they took limit/cursor
+
+def history_page_size(limit: Optional[int], cursor: Optional[str], default_limit: int) -> int:
+    """An explicit limit, else the default page when following a cursor, else the pre-paging response size"""
+    if limit:
+        return limit
+    return default_limit if cursor else UNPAGED_HISTORY_LIMIT
+
+async def fetch_keyset_page(collection, query: dict, date_field: str, date_from: Optional[datetime],
+                            date_to: Optional[datetime], limit: int, cursor: Optional[str],
+                            projection: Optional[dict] = None) -> tuple:
+    """Newest-first page ordered by (date_field, id); returns (records, cursor for the next page or None)"""
+    query = dict(query)
+    date_range = {}
+    if date_from:
+        date_range["$gte"] = naive_utc(date_from)
+    if date_to:
+        date_range["$lte"] = naive_utc(date_to)
+    if date_range:
+        query[date_field] = date_range
+    if cursor:
+        cursor_date, cursor_id = decode_keyset_cursor(cursor)
+        query["$or"] = [
+            {date_field: {"$lt": cursor_date}},
+            {date_field: cursor_date, "id": {"$lt": cursor_id}}
+        ]
+
+    # Fetch one extra record to know whether another page exists
+    records = await collection.find(query, projection or {"_id": 0}).sort(
+        [(date_field, DESCENDING), ("id", DESCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    if len(records) > limit:
+        records = records[:limit]
+        return records, encode_keyset_cursor(records[-1], date_field)
+    return records, None
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
@@ -601,6 +1458,12 @@ async def get_current_owner_or_staff(current_user: User = Depends(get_current_us
         raise HTTPException(status_code=403, detail="Access denied")
     return current_user
 
+async def get_current_admin(current_user: User = Depends(get_current_owner)):
+    # Platform operators, listed in GYMBLE_ADMIN_EMAILS (comma separated)
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Only administrators can access this resource")
+    return current_user
+
 # API Routes
 
 # Health check endpoint
@@ -628,10 +1491,14 @@ async def root():
     return {"message": "GYMBLE API is running", "status": "success"}
 
 # Authentication Routes
+# Emails are unique regardless of case: duplicate checks use this collation, and so do the
+# unique email indexes that catch two registrations racing past those checks.
+EMAIL_COLLATION = {"locale": "en", "strength": 2}
+
 @api_router.post("/auth/register", response_model=Token)
 async def register_user(user_data: UserRegister):
     # Check if user already exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await db.users.find_one({"email": user_data.email}, collation=EMAIL_COLLATION)
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -644,7 +1511,10 @@ async def register_user(user_data: UserRegister):
         password_hash=password_hash
     )
     
-    await db.users.insert_one(user.dict())
+    try:
+        await db.users.insert_one(user.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create access token
     access_token = create_access_token(data={"sub": user.email})
@@ -657,23 +1527,25 @@ async def register_user(user_data: UserRegister):
 
 @api_router.post("/auth/register-member", response_model=Token)
 async def register_member(member_data: MemberRegister):
-    # Check if user already exists
-    existing_user = await db.users.find_one({"email": member_data.email})
+    # The duplicate, gym and plan checks are independent, so run them together
+    existing_user, gym, plan = await asyncio.gather(
+        db.users.find_one({"email": member_data.email}, collation=EMAIL_COLLATION),
+        db.gyms.find_one({"id": member_data.gym_id}),
+        plan_cache.get_plan(member_data.gym_id, member_data.plan_id)
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Verify gym exists
-    gym = await db.gyms.find_one({"id": member_data.gym_id})
     if not gym:
         raise HTTPException(status_code=404, detail="Gym not found")
     
     # Verify plan exists and belongs to the gym
-    plan = await db.plans.find_one({"id": member_data.plan_id, "gym_id": member_data.gym_id})
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found for this gym")
     
     # Hash password
-    password_hash = hash_password(member_data.password)
+    password_hash = (await hash_passwords([member_data.password]))[0]
     
     # Create user account
     user = User(
@@ -685,10 +1557,7 @@ async def register_member(member_data: MemberRegister):
         gym_id=member_data.gym_id
     )
     
-    await db.users.insert_one(user.dict())
-    
     # Create member record
-    from datetime import timedelta
     start_date = datetime.utcnow()
     end_date = start_date + timedelta(days=plan["duration_days"])
     
@@ -708,8 +1577,6 @@ async def register_member(member_data: MemberRegister):
         membership_status=MembershipStatus.ACTIVE
     )
     
-    await db.members.insert_one(member.dict())
-    
     # Create a payment record for the registration
     payment = Payment(
         gym_id=member_data.gym_id,
@@ -722,7 +1589,16 @@ async def register_member(member_data: MemberRegister):
         plan_name=plan["name"]
     )
     
-    await db.payments.insert_one(payment.dict())
+    # User, member and payment are written together or not at all
+    try:
+        await insert_documents_atomically([
+            (db.users, user.dict()),
+            (db.members, member.dict()),
+            (db.payments, payment.dict())
+        ])
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await apply_payment_effects([payment.dict()])
     
     # Create access token
     access_token = create_access_token(data={"sub": user.email})
@@ -811,6 +1687,7 @@ async def create_plan(plan_data: PlanCreate, current_user: User = Depends(get_cu
     
     plan = Plan(**plan_data.dict(), gym_id=current_user.gym_id)
     await db.plans.insert_one(plan.dict())
+    plan_cache.store(plan.dict())
     return plan
 
 @api_router.get("/plans", response_model=List[Plan])
@@ -818,42 +1695,44 @@ async def get_plans(current_user: User = Depends(get_current_user)):
     if not current_user.gym_id:
         return []
     
-    plans = await db.plans.find({"gym_id": current_user.gym_id, "is_active": True}).to_list(1000)
+    plans = await plan_cache.get_active_plans(current_user.gym_id)
     return [Plan(**plan) for plan in plans]
 
 @api_router.get("/plans/gym/{gym_id}", response_model=List[Plan])
 async def get_gym_plans(gym_id: str):
     """Get all plans for a specific gym (for member registration)"""
-    plans = await db.plans.find({"gym_id": gym_id, "is_active": True}).to_list(1000)
+    plans = await plan_cache.get_active_plans(gym_id)
     return [Plan(**plan) for plan in plans]
 
 @api_router.get("/plans/{plan_id}", response_model=Plan)
 async def get_plan(plan_id: str, current_user: User = Depends(get_current_user)):
-    plan = await db.plans.find_one({"id": plan_id, "gym_id": current_user.gym_id})
+    plan = await plan_cache.get_plan(current_user.gym_id, plan_id)
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     return Plan(**plan)
 
 @api_router.put("/plans/{plan_id}", response_model=Plan)
 async def update_plan(plan_id: str, plan_update: PlanCreate, current_user: User = Depends(get_current_owner)):
-    plan = await db.plans.find_one({"id": plan_id, "gym_id": current_user.gym_id})
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan not found")
-    
-    await db.plans.update_one(
-        {"id": plan_id},
-        {"$set": plan_update.dict()}
+    updated_plan = await db.plans.find_one_and_update(
+        {"id": plan_id, "gym_id": current_user.gym_id},
+        {"$set": plan_update.dict()},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
     
-    updated_plan = await db.plans.find_one({"id": plan_id})
+    plan_cache.store(updated_plan)
     return Plan(**updated_plan)
 
 @api_router.delete("/plans/{plan_id}")
 async def delete_plan(plan_id: str, current_user: User = Depends(get_current_owner)):
-    await db.plans.update_one(
+    deleted_plan = await db.plans.find_one_and_update(
         {"id": plan_id, "gym_id": current_user.gym_id},
-        {"$set": {"is_active": False}}
+        {"$set": {"is_active": False}},
+        return_document=ReturnDocument.AFTER
     )
+    if deleted_plan:
+        plan_cache.store(deleted_plan)
     return {"message": "Plan deleted successfully"}
 
 # Member Management Routes
@@ -862,18 +1741,18 @@ async def create_member(member_data: MemberCreate, current_user: User = Depends(
     if not current_user.gym_id:
         raise HTTPException(status_code=400, detail="No gym associated with user")
     
-    # Check if email already exists
-    existing_member = await db.members.find_one({"email": member_data.email, "gym_id": current_user.gym_id})
+    # Duplicate checks and plan lookup are independent, so run them together
+    existing_member, existing_user, plan = await asyncio.gather(
+        db.members.find_one({"email": member_data.email, "gym_id": current_user.gym_id}, collation=EMAIL_COLLATION),
+        db.users.find_one({"email": member_data.email}, collation=EMAIL_COLLATION),
+        plan_cache.get_plan(current_user.gym_id, member_data.plan_id)
+    )
     if existing_member:
         raise HTTPException(status_code=400, detail="Member with this email already exists")
     
-    # Check if user already exists
-    existing_user = await db.users.find_one({"email": member_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Get plan details
-    plan = await db.plans.find_one({"id": member_data.plan_id, "gym_id": current_user.gym_id})
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     
@@ -882,7 +1761,7 @@ async def create_member(member_data: MemberCreate, current_user: User = Depends(
     end_date = start_date + timedelta(days=plan["duration_days"])
     
     # Hash password for member login
-    password_hash = hash_password(member_data.password)
+    password_hash = (await hash_passwords([member_data.password]))[0]
     
     # Create user account for member login
     user = User(
@@ -894,8 +1773,6 @@ async def create_member(member_data: MemberCreate, current_user: User = Depends(
         gym_id=current_user.gym_id
     )
     
-    await db.users.insert_one(user.dict())
-    
     # Create member
     member = Member(
         **member_data.dict(exclude={"password", "payment_method", "payment_amount"}),
@@ -905,8 +1782,6 @@ async def create_member(member_data: MemberCreate, current_user: User = Depends(
         end_date=end_date
     )
     
-    await db.members.insert_one(member.dict())
-    
     # Create payment record
     payment = Payment(
         gym_id=current_user.gym_id,
@@ -918,7 +1793,15 @@ async def create_member(member_data: MemberCreate, current_user: User = Depends(
         plan_name=plan["name"]
     )
     
-    await db.payments.insert_one(payment.dict())
+    try:
+        await insert_documents_atomically([
+            (db.users, user.dict()),
+            (db.members, member.dict()),
+            (db.payments, payment.dict())
+        ])
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await apply_payment_effects([payment.dict()])
     
     return member
 
@@ -947,9 +1830,495 @@ async def search_members(query: str, current_user: User = Depends(get_current_ow
             {"phone": {"$regex": query, "$options": "i"}}
         ]
     }).limit(10).to_list(10)
-    
+
     return [Member(**member) for member in members]
 
+# Bulk Import / Export Routes
+BULK_IMPORT_BATCH_SIZE = 500
+IMPORT_READ_CHUNK_SIZE = 64 * 1024
+IMPORT_MAX_ROW_CHARS = 1024 * 1024
+MEMBER_EXPORT_FIELDS = [
+    "id", "name", "email", "phone", "address", "date_of_birth", "emergency_contact",
+    "plan_id", "membership_status", "start_date", "end_date", "created_at",
+    "last_visit", "total_visits", "auto_renewal"
+]
+
+def iter_import_rows(upload: UploadFile, file_format: str):
+    """Yield (row_number, raw_row) pairs from a CSV, JSON array or JSON Lines upload"""
+    stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig")
+    if file_format == "csv":
+        for index, row in enumerate(csv.DictReader(stream), start=1):
+            yield index, row
+        return
+
+    first_char = stream.read(1)
+    while first_char and first_char.isspace():
+        first_char = stream.read(1)
+    if first_char == "[":
+        yield from enumerate(iter_json_array(stream), start=1)
+        return
+
+    # JSON Lines: one member object per line
+    index = 0
+    for line in itertools.chain([first_char + stream.readline()], stream):
+        if not line.strip():
+            continue
+        index += 1
+        try:
+            yield index, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield index, {"__error__": f"Invalid JSON: {e.msg}"}
+
+JSON_NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+def iter_json_array(stream, chunk_size: int = IMPORT_READ_CHUNK_SIZE):
+    """Yield the items of a JSON array whose opening "[" was already read, one chunk of text at a time"""
+    decoder = json.JSONDecoder()
+    buffer, eof = "", False
+    expect_item, allow_close = True, True
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                raise json.JSONDecodeError("Unterminated array", buffer, 0)
+            buffer = stream.read(chunk_size)
+            eof = not buffer
+            continue
+        if allow_close and buffer[0] == "]":
+            return
+        if not expect_item:
+            if buffer[0] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, 0)
+            buffer = buffer[1:]
+            expect_item, allow_close = True, False
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+            # A value ending at the buffer edge, or followed by what could continue a number ("15." of "15.5"), may be cut off
+            complete = eof or (end < len(buffer) and buffer[end] not in JSON_NUMBER_CHARS)
+        except json.JSONDecodeError:
+            if eof or len(buffer) > IMPORT_MAX_ROW_CHARS:
+                raise
+            complete = False
+        if not complete:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+        expect_item, allow_close = False, True
+
+def clean_import_row(raw_row) -> dict:
+    """Drop blank CSV cells so optional fields fall back to their defaults"""
+    if not isinstance(raw_row, dict):
+        return {"__error__": "Row must be an object"}
+    cleaned = {}
+    for key, value in raw_row.items():
+        if key is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                continue
+        cleaned[key.strip()] = value
+    return cleaned
+
+async def import_member_batch(batch: List[tuple], gym_id: str, plans_by_id: dict, plans_by_name: dict, seen_emails: set) -> List[MemberImportRowResult]:
+    """Validate, dedupe, hash and insert one batch of import rows"""
+    results = {}
+    valid_rows = []
+
+    for row_number, raw_row in batch:
+        row_data = clean_import_row(raw_row)
+        if "__error__" in row_data:
+            results[row_number] = MemberImportRowResult(row=row_number, status="invalid", error=row_data["__error__"])
+            continue
+        try:
+            row = MemberImportRow(**row_data)
+        except ValueError as e:
+            results[row_number] = MemberImportRowResult(
+                row=row_number, email=row_data.get("email"), status="invalid", error=str(e)
+            )
+            continue
+
+        plan = plans_by_id.get(row.plan_id) if row.plan_id else plans_by_name.get((row.plan_name or "").lower())
+        if not plan:
+            results[row_number] = MemberImportRowResult(
+                row=row_number, email=row.email, status="invalid", error="Plan not found"
+            )
+            continue
+
+        email = row.email.lower()
+        if email in seen_emails:
+            results[row_number] = MemberImportRowResult(
+                row=row_number, email=row.email, status="duplicate", error="Duplicate email in upload"
+            )
+            continue
+        seen_emails.add(email)
+        valid_rows.append((row_number, row, plan))
+
+    # One round trip per collection for every email in this batch that is already taken, in any case
+    if valid_rows:
+        emails = [row.email for _, row, _ in valid_rows]
+        existing_users, existing_members = await asyncio.gather(
+            db.users.find({"email": {"$in": emails}}, {"email": 1}, collation=EMAIL_COLLATION).to_list(None),
+            db.members.find(
+                {"email": {"$in": emails}, "gym_id": gym_id}, {"email": 1}, collation=EMAIL_COLLATION
+            ).to_list(None)
+        )
+        registered_emails = {user["email"].lower() for user in existing_users}
+        member_emails = {member["email"].lower() for member in existing_members}
+
+        new_rows = []
+        for row_number, row, plan in valid_rows:
+            if row.email.lower() in member_emails:
+                error = "Member with this email already exists"
+            elif row.email.lower() in registered_emails:
+                error = "Email already registered"
+            else:
+                new_rows.append((row_number, row, plan))
+                continue
+            results[row_number] = MemberImportRowResult(row=row_number, email=row.email, status="duplicate", error=error)
+        valid_rows = new_rows
+
+    if valid_rows:
+        password_hashes = await hash_passwords([row.password for _, row, _ in valid_rows])
+
+        users, members, payments = [], [], []
+        for (row_number, row, plan), password_hash in zip(valid_rows, password_hashes):
+            start_date = row.start_date or datetime.utcnow()
+            end_date = start_date + timedelta(days=plan["duration_days"])
+            users.append(User(
+                email=row.email,
+                password_hash=password_hash,
+                name=row.name,
+                phone=row.phone,
+                role=UserRole.MEMBER,
+                gym_id=gym_id
+            ).dict())
+            member = Member(
+                gym_id=gym_id,
+                name=row.name,
+                email=row.email,
+                password_hash=password_hash,
+                phone=row.phone,
+                address=row.address,
+                date_of_birth=row.date_of_birth,
+                emergency_contact=row.emergency_contact,
+                plan_id=plan["id"],
+                start_date=start_date,
+                end_date=end_date,
+                membership_status=MembershipStatus.ACTIVE if end_date > datetime.utcnow() else MembershipStatus.EXPIRED,
+                auto_renewal=row.auto_renewal
+            )
+            members.append(member.dict())
+            payments.append(Payment(
+                gym_id=gym_id,
+                member_id=member.id,
+                member_name=member.name,
+                amount=row.payment_amount if row.payment_amount is not None else plan["price"],
+                payment_date=start_date,
+                payment_method=row.payment_method,
+                plan_id=plan["id"],
+                plan_name=plan["name"]
+            ).dict())
+
+        # Only rows whose user account was written get a member and payment record
+        failed_indexes = {}
+        try:
+            await db.users.insert_many(users, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed_indexes[error["index"]] = error.get("errmsg", "Insert failed")
+
+        inserted = [i for i in range(len(valid_rows)) if i not in failed_indexes]
+        if inserted:
+            member_docs = [members[i] for i in inserted]
+            payment_docs = [payments[i] for i in inserted]
+            try:
+                await db.members.insert_many(member_docs)
+                await db.payments.insert_many(payment_docs)
+            except PyMongoError as e:
+                # Remove whatever this batch wrote so no login is left without its member record
+                await asyncio.gather(
+                    db.users.delete_many({"id": {"$in": [users[i]["id"] for i in inserted]}}),
+                    db.members.delete_many({"id": {"$in": [member["id"] for member in member_docs]}}),
+                    db.payments.delete_many({"id": {"$in": [payment["id"] for payment in payment_docs]}})
+                )
+                for i in inserted:
+                    failed_indexes[i] = f"Insert failed: {e}"
+            else:
+                await apply_payment_effects(payment_docs)
+
+        for i, (row_number, row, _) in enumerate(valid_rows):
+            if i in failed_indexes:
+                results[row_number] = MemberImportRowResult(
+                    row=row_number, email=row.email, status="failed", error=failed_indexes[i]
+                )
+            else:
+                results[row_number] = MemberImportRowResult(
+                    row=row_number, email=row.email, status="created", member_id=members[i]["id"]
+                )
+
+    return [results[row_number] for row_number, _ in batch]
+
+@api_router.post("/members/import", response_model=MemberImportReport)
+async def import_members(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format"),
+    current_user: User = Depends(get_current_owner)
+):
+    """Bulk import members from a CSV, JSON array or JSON Lines file"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+
+    if not file_format:
+        filename = (file.filename or "").lower()
+        file_format = "csv" if filename.endswith(".csv") or file.content_type == "text/csv" else "json"
+    if file_format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv' or 'json'")
+
+    plans = await plan_cache.get_active_plans(current_user.gym_id)
+    plans_by_id = {plan["id"]: plan for plan in plans}
+    plans_by_name = {plan["name"].lower(): plan for plan in plans}
+
+    results: List[MemberImportRowResult] = []
+    seen_emails = set()
+    batch = []
+    try:
+        for row_number, raw_row in iter_import_rows(file, file_format):
+            batch.append((row_number, raw_row))
+            if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+                results.extend(await import_member_batch(batch, current_user.gym_id, plans_by_id, plans_by_name, seen_emails))
+                batch = []
+    except (UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse upload after {len(results) + len(batch)} rows: {e}")
+    if batch:
+        results.extend(await import_member_batch(batch, current_user.gym_id, plans_by_id, plans_by_name, seen_emails))
+
+    created = sum(1 for result in results if result.status == "created")
+    failed = sum(1 for result in results if result.status == "failed")
+
+    return MemberImportReport(
+        total_rows=len(results),
+        created=created,
+        skipped=len(results) - created - failed,
+        failed=failed,
+        results=results
+    )
+
+def format_export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+@api_router.get("/members/export")
+async def export_members(
+    file_format: str = Query("csv", alias="format"),
+    status: Optional[str] = None,
+    current_user: User = Depends(get_current_owner)
+):
+    """Stream the gym's members as CSV or JSON Lines without loading them all into memory"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    if file_format not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv' or 'json'")
+
+    query = {"gym_id": current_user.gym_id}
+    if status:
+        query["membership_status"] = status
+
+    catalog = await plan_cache.get_catalog(current_user.gym_id)
+    plan_names = {plan_id: plan["name"] for plan_id, plan in catalog.items()}
+    projection = {field: 1 for field in MEMBER_EXPORT_FIELDS}
+    projection["_id"] = 0
+
+    async def generate_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if file_format == "csv":
+            writer.writerow(MEMBER_EXPORT_FIELDS + ["plan_name"])
+
+        cursor = db.members.find(query, projection).sort("created_at", 1).batch_size(BULK_IMPORT_BATCH_SIZE)
+        async for member in cursor:
+            values = [format_export_value(member.get(field)) for field in MEMBER_EXPORT_FIELDS]
+            values.append(plan_names.get(member.get("plan_id")))
+            if file_format == "csv":
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(MEMBER_EXPORT_FIELDS + ["plan_name"], values))) + "\n")
+            # Flush in chunks rather than per row
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    media_type = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    extension = "csv" if file_format == "csv" else "jsonl"
+    return StreamingResponse(
+        generate_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=members-{current_user.gym_id}.{extension}"}
+    )
+
+# Session Store
+BACKDATED_VISIT_SECONDS = 60  # Opens recorded later than this after their check-in time are backdated
+class SessionStore:
+    """Single write path for gym visits.
+
+    Staff check-ins (/checkin), QR check-ins (/attendance/mark,
+    /attendance/mark-new) and kiosk scans (/attendance/kiosk/ingest) all
+    land in the `attendance` collection with a `source` tag. Opening or
+    closing a session also updates the member's visit counters, the
+    history buckets and the live occupancy. Backdated sessions skip the
+    live occupancy and only count towards their hour's check-ins.
+    """
+
+    @property
+    def collection(self):
+        return db.attendance
+
+    async def find_open(self, member_id: str, since: datetime) -> Optional[dict]:
+        return await self.collection.find_one({
+            "member_id": member_id,
+            "check_in_time": {"$gte": since},
+            "check_out_time": None
+        })
+
+    async def find_latest(self, member_id: str, since: datetime) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"member_id": member_id, "check_in_time": {"$gte": since}},
+            sort=[("check_in_time", -1)]
+        )
+
+    async def open(self, gym_id: str, member: dict, source: str, qr_code_data: Optional[str] = None,
+                   device_info: Optional[str] = None, check_in_time: Optional[datetime] = None) -> AttendanceRecord:
+        now = datetime.utcnow()
+        session = AttendanceRecord(
+            gym_id=gym_id,
+            member_id=member["id"],
+            member_name=member["name"],
+            check_in_time=check_in_time or now,
+            qr_code_data=qr_code_data,
+            device_info=device_info,
+            source=source,
+            backdated=check_in_time is not None and (now - check_in_time).total_seconds() > BACKDATED_VISIT_SECONDS
+        )
+        await self.collection.insert_one(session.dict())
+
+        # Update member's last visit and total visits (a backdated visit may be older than the last one)
+        await db.members.update_one(
+            {"id": member["id"]},
+            {
+                "$max" if session.backdated else "$set": {"last_visit": session.check_in_time},
+                "$inc": {"total_visits": 1}
+            }
+        )
+        await record_attendance_visit(gym_id, member["id"], session.id, session.check_in_time, live=not session.backdated)
+        return session
+
+    async def close(self, session: dict, check_out_time: Optional[datetime] = None,
+                    auto_checked_out: bool = False) -> Optional[dict]:
+        check_out_time = check_out_time or datetime.utcnow()
+        duration = int((check_out_time - session["check_in_time"]).total_seconds() / 60)
+        closed = await self.collection.find_one_and_update(
+            {"id": session["id"], "check_out_time": None},
+            {"$set": {"check_out_time": check_out_time, "duration_minutes": duration, "auto_checked_out": auto_checked_out}},
+            return_document=ReturnDocument.AFTER
+        )
+        if closed:
+            await record_attendance_checkout(
+                session["gym_id"], session["member_id"], session["id"], session["check_in_time"],
+                check_out_time, duration, live=not closed.get("backdated", False)
+            )
+        return closed
+
+    async def list_for_gym(self, gym_id: str, since: datetime, until: Optional[datetime] = None, limit: int = 1000) -> List[dict]:
+        check_in_time = {"$gte": since}
+        if until:
+            check_in_time["$lte"] = until
+        return await self.collection.find(
+            {"gym_id": gym_id, "check_in_time": check_in_time}
+        ).sort("check_in_time", -1).to_list(limit)
+
+    async def count_for_gym(self, gym_id: str, since: datetime) -> int:
+        return await self.collection.count_documents({"gym_id": gym_id, "check_in_time": {"$gte": since}})
+
+sessions = SessionStore()
+
+async def migrate_checkins_to_sessions() -> int:
+    """Move legacy `checkins` documents into the session store and leave a read-only view behind.
+
+    Idempotent: copies are upserted by id, and once `checkins` is a view the
+    migration is a no-op.
+    """
+    existing = await db.list_collections(filter={"name": "checkins"}).to_list(None)
+    if not existing or existing[0].get("type") == "view":
+        return 0
+
+    migrated = 0
+    async for checkin in db.checkins.find({}, {"_id": 0}).batch_size(SCHEDULER_BATCH_SIZE):
+        checkin.setdefault("qr_code_data", None)
+        checkin["source"] = "staff"
+        await sessions.collection.replace_one({"id": checkin["id"]}, checkin, upsert=True)
+        migrated += 1
+
+    # Keep the original data, then expose staff sessions under the old name for legacy readers
+    await db.checkins.rename(f"checkins_migrated_{int(time.time())}")
+    await db.command({
+        "create": "checkins",
+        "viewOn": "attendance",
+        "pipeline": [{"$match": {"source": "staff"}}]
+    })
+    return migrated
+
+async def backfill_attendance_history():
+    """Build buckets, summaries and hourly occupancy for visits recorded before they existed"""
+    for gym_id in await sessions.collection.distinct("gym_id"):
+        await rebuild_attendance_history(gym_id)
+    await backfill_occupancy_hourly()
+
+async def key_bucket_sessions_by_id():
+    """Turn bucket session arrays written before check-outs used plain $set paths into objects keyed by visit id"""
+    cursor = db.attendance_buckets.find({"sessions": {"$type": "array"}}, {"_id": 1, "sessions": 1})
+    batch = await cursor.to_list(SCHEDULER_BATCH_SIZE)
+    while batch:
+        await db.attendance_buckets.bulk_write([
+            UpdateOne(
+                # Skips a bucket that was converted since it was read
+                {"_id": bucket["_id"], "sessions": {"$type": "array"}},
+                {"$set": {"sessions": {
+                    # Arrays only kept the duration; the check-out is the check-in plus that many minutes
+                    session["id"]: {
+                        "check_in_time": session["check_in_time"],
+                        "check_out_time": session["check_in_time"] + timedelta(minutes=session["duration_minutes"])
+                        if session.get("duration_minutes") is not None else None,
+                        "duration_minutes": session.get("duration_minutes")
+                    }
+                    for session in bucket["sessions"]
+                }}}
+            )
+            for bucket in batch
+        ], ordered=False)
+        batch = await cursor.to_list(SCHEDULER_BATCH_SIZE)
+
+async def run_checkins_migration():
+    try:
+        if await acquire_lease("checkins_migration"):
+            migrated = await migrate_checkins_to_sessions()
+            if migrated:
+                logging.getLogger(__name__).info(f"Migrated {migrated} check-ins into the session store")
+        # Runs after the copy so migrated staff check-ins get history too
+        await run_once("attendance_history_backfill", backfill_attendance_history)
+        await run_once("attendance_bucket_sessions_by_id", key_bucket_sessions_by_id)
+    except Exception:
+        logging.getLogger(__name__).exception("Check-in migration failed")
+
 # Check-in Routes
 @api_router.post("/checkin", response_model=CheckIn)
 async def check_in_member(checkin_data: CheckInCreate, current_user: User = Depends(get_current_owner_or_staff)):
@@ -959,44 +2328,22 @@ async def check_in_member(checkin_data: CheckInCreate, current_user: User = Depe
     
     # Check if member already checked in today
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    existing_checkin = await db.checkins.find_one({
-        "member_id": checkin_data.member_id,
-        "check_in_time": {"$gte": today_start},
-        "check_out_time": None
-    })
+    existing_checkin = await sessions.find_open(checkin_data.member_id, today_start)
     
     if existing_checkin:
         raise HTTPException(status_code=400, detail="Member already checked in")
     
-    checkin = CheckIn(
-        gym_id=current_user.gym_id,
-        member_id=checkin_data.member_id,
-        member_name=member["name"]
-    )
-    
-    await db.checkins.insert_one(checkin.dict())
-    
-    # Update member's last visit and total visits
-    await db.members.update_one(
-        {"id": checkin_data.member_id},
-        {
-            "$set": {"last_visit": datetime.utcnow()},
-            "$inc": {"total_visits": 1}
-        }
-    )
-    
-    return checkin
+    session = await sessions.open(current_user.gym_id, member, source="staff")
+    return CheckIn(**session.dict())
 
 @api_router.get("/checkins/today", response_model=List[CheckIn])
 async def get_today_checkins(current_user: User = Depends(get_current_owner_or_staff)):
+    """Compatibility view of today's sessions in the legacy check-in shape"""
     if not current_user.gym_id:
         return []
     
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    checkins = await db.checkins.find({
-        "gym_id": current_user.gym_id,
-        "check_in_time": {"$gte": today_start}
-    }).sort("check_in_time", -1).to_list(1000)
+    checkins = await sessions.list_for_gym(current_user.gym_id, today_start)
     
     return [CheckIn(**checkin) for checkin in checkins]
 
@@ -1020,40 +2367,36 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_owner_or_
     
     # Today's check-ins
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_checkins = await db.checkins.count_documents({
-        "gym_id": current_user.gym_id,
-        "check_in_time": {"$gte": today_start}
-    })
+    today_checkins = await sessions.count_for_gym(current_user.gym_id, today_start)
     
-    # Currently checked in
-    current_checkedin = await db.checkins.count_documents({
-        "gym_id": current_user.gym_id,
-        "check_out_time": None
-    })
+    # Currently checked in (live counter, kept honest by the auto-checkout sweeper)
+    current_checkedin = await get_live_occupancy(current_user.gym_id)
     
-    # Monthly revenue
+    # Monthly revenue (pre-aggregated as payments are recorded)
     month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    payments = await db.payments.find({
-        "gym_id": current_user.gym_id,
-        "payment_date": {"$gte": month_start},
-        "status": "paid"
-    }).to_list(1000)
-    
-    monthly_revenue = sum(payment["amount"] for payment in payments)
-    
-    # Memberships expiring in next 7 days
-    next_week = datetime.utcnow() + timedelta(days=7)
-    expiring_soon = await db.members.count_documents({
-        "gym_id": current_user.gym_id,
-        "end_date": {"$lte": next_week},
-        "membership_status": "active"
-    })
+    month = await db.revenue_monthly.find_one(
+        {"gym_id": current_user.gym_id, "month": month_start.strftime("%Y-%m")},
+        {"revenue": 1}
+    )
+    if month:
+        monthly_revenue = month.get("revenue", 0)
+    else:
+        # No aggregate yet (startup backfill still running): sum this month's payments directly
+        rows = await db.payments.aggregate([
+            {"$match": {
+                "gym_id": current_user.gym_id,
+                "status": PaymentStatus.PAID.value,
+                "payment_date": {"$gte": month_start}
+            }},
+            {"$group": {"_id": None, "revenue": {"$sum": "$amount"}}}
+        ]).to_list(1)
+        monthly_revenue = rows[0]["revenue"] if rows else 0
+    
+    # Memberships expiring in next 7 days (maintained by the membership scheduler)
+    expiring_soon = await get_expiring_soon_count(current_user.gym_id)
     
     # Total plans
-    total_plans = await db.plans.count_documents({
-        "gym_id": current_user.gym_id,
-        "is_active": True
-    })
+    total_plans = len(await plan_cache.get_active_plans(current_user.gym_id))
     
     return DashboardStats(
         total_members=total_members,
@@ -1062,35 +2405,621 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_owner_or_
         current_checkedin=current_checkedin,
         monthly_revenue=monthly_revenue,
         expiring_soon=expiring_soon,
-        total_plans=total_plans
+        total_plans=total_plans,
+        popular_plan=await get_popular_plan(current_user.gym_id)
     )
 
-# Announcement Routes
-@api_router.post("/announcements", response_model=Announcement)
-async def create_announcement(announcement_data: AnnouncementCreate, current_user: User = Depends(get_current_owner)):
+# Revenue Analytics
+# revenue_monthly holds one document per gym per month with paid revenue
+# and a per-plan breakdown, incremented whenever paid payments are recorded.
+# Pending and overdue payments are counted as outstanding in their month.
+OUTSTANDING_STATUSES = (PaymentStatus.PENDING, PaymentStatus.OVERDUE)
+POPULAR_PLAN_REFRESH_SECONDS = 900
+
+async def record_payment_revenue(payments: List[dict]):
+    """Fold paid payments into the monthly revenue aggregates"""
+    increments = {}
+    outstanding = {}
+    for payment in payments:
+        key = (payment["gym_id"], payment["payment_date"].strftime("%Y-%m"))
+        status = payment.get("status", PaymentStatus.PAID)
+        if status in OUTSTANDING_STATUSES:
+            month = outstanding.setdefault(key, {"outstanding": 0.0, "outstanding_payments": 0})
+            month["outstanding"] += payment["amount"]
+            month["outstanding_payments"] += 1
+            continue
+        if status != PaymentStatus.PAID:
+            continue
+        month = increments.setdefault(key, {"revenue": 0.0, "payments": 0, "plans": {}})
+        month["revenue"] += payment["amount"]
+        month["payments"] += 1
+        plan = month["plans"].setdefault(payment["plan_id"], {"plan_name": payment["plan_name"], "revenue": 0.0, "payments": 0})
+        plan["revenue"] += payment["amount"]
+        plan["payments"] += 1
+
+    updates = []
+    for (gym_id, month_key), month in increments.items():
+        inc = {"revenue": month["revenue"], "payments": month["payments"]}
+        plan_names = {}
+        for plan_id, plan in month["plans"].items():
+            inc[f"by_plan.{plan_id}.revenue"] = plan["revenue"]
+            inc[f"by_plan.{plan_id}.payments"] = plan["payments"]
+            plan_names[f"by_plan.{plan_id}.plan_name"] = plan["plan_name"]
+        updates.append(UpdateOne(
+            {"gym_id": gym_id, "month": month_key},
+            {"$inc": inc, "$set": plan_names},
+            upsert=True
+        ))
+    for (gym_id, month_key), month in outstanding.items():
+        updates.append(UpdateOne({"gym_id": gym_id, "month": month_key}, {"$inc": month}, upsert=True))
+    if updates:
+        await db.revenue_monthly.bulk_write(updates, ordered=False)
+
+async def rebuild_revenue_aggregates(gym_id: str) -> int:
+    """Recompute a gym's monthly aggregates from its payment history"""
+    rows = await db.payments.aggregate([
+        {"$match": {"gym_id": gym_id, "status": {"$in": [PaymentStatus.PAID.value] + [status.value for status in OUTSTANDING_STATUSES]}}},
+        {"$group": {
+            "_id": {
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$payment_date"}},
+                "plan_id": "$plan_id",
+                "paid": {"$eq": ["$status", PaymentStatus.PAID.value]}
+            },
+            "plan_name": {"$last": "$plan_name"},
+            "revenue": {"$sum": "$amount"},
+            "payments": {"$sum": 1}
+        }}
+    ]).to_list(None)
+
+    months = {}
+    for row in rows:
+        month = months.setdefault(row["_id"]["month"], {
+            "gym_id": gym_id, "month": row["_id"]["month"], "revenue": 0.0, "payments": 0, "by_plan": {},
+            "outstanding": 0.0, "outstanding_payments": 0
+        })
+        if not row["_id"]["paid"]:
+            month["outstanding"] += row["revenue"]
+            month["outstanding_payments"] += row["payments"]
+            continue
+        month["revenue"] += row["revenue"]
+        month["payments"] += row["payments"]
+        month["by_plan"][row["_id"]["plan_id"]] = {
+            "plan_name": row["plan_name"], "revenue": row["revenue"], "payments": row["payments"]
+        }
+
+    # Replace month by month so live $inc upserts never meet a missing document or a duplicate key
+    if months:
+        await db.revenue_monthly.bulk_write([
+            ReplaceOne({"gym_id": gym_id, "month": month_key}, month, upsert=True)
+            for month_key, month in months.items()
+        ], ordered=False)
+    await db.revenue_monthly.delete_many({"gym_id": gym_id, "month": {"$nin": list(months)}})
+    await rebuild_member_balances(gym_id)
+    return len(months)
+
+# Payment Ledger
+# Payments are written through insert_payments / apply_payment_effects, which
+# keep revenue_monthly and member_balances (one running balance per member)
+# in step. Failed payments count towards neither. Histories page
+# newest-first by (payment_date, id).
+PAYMENT_HISTORY_DEFAULT_LIMIT = 50
+PAYMENT_HISTORY_MAX_LIMIT = 200
+
+async def update_member_balances(payments: List[dict]):
+    increments = {}
+    for payment in payments:
+        status = payment.get("status", PaymentStatus.PAID)
+        if status == PaymentStatus.FAILED:
+            continue
+        balance = increments.setdefault(payment["member_id"], {
+            "gym_id": payment["gym_id"], "total_paid": 0.0, "outstanding": 0.0, "payments": 0, "last_payment_at": None
+        })
+        balance["payments"] += 1
+        if status == PaymentStatus.PAID:
+            balance["total_paid"] += payment["amount"]
+            balance["last_payment_at"] = max(filter(None, [balance["last_payment_at"], payment["payment_date"]]))
+        elif status in OUTSTANDING_STATUSES:
+            balance["outstanding"] += payment["amount"]
+
+    updates = []
+    for member_id, balance in increments.items():
+        update = {
+            "$setOnInsert": {"gym_id": balance["gym_id"]},
+            "$inc": {"total_paid": balance["total_paid"], "outstanding": balance["outstanding"], "payments": balance["payments"]}
+        }
+        if balance["last_payment_at"]:
+            update["$max"] = {"last_payment_at": balance["last_payment_at"]}
+        updates.append(UpdateOne({"member_id": member_id}, update, upsert=True))
+    if updates:
+        await db.member_balances.bulk_write(updates, ordered=False)
+
+async def apply_payment_effects(payments: List[dict]):
+    """Update monthly totals and member balances for newly stored payments"""
+    await asyncio.gather(record_payment_revenue(payments), update_member_balances(payments))
+
+async def insert_payments(payments: List[dict]) -> List[dict]:
+    """Insert payments, skipping any whose idempotency key is already stored; returns the ones written"""
+    if not payments:
+        return []
+    duplicate_indexes = set()
+    try:
+        await db.payments.insert_many(payments, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        duplicate_indexes = {error["index"] for error in e.details["writeErrors"]}
+    inserted = [payment for index, payment in enumerate(payments) if index not in duplicate_indexes]
+    await apply_payment_effects(inserted)
+    return inserted
+
+async def rebuild_member_balances(gym_id: str):
+    # Replaced in place rather than deleted first, so readers never see a member's balance missing
+    counted = {"gym_id": gym_id, "status": {"$ne": PaymentStatus.FAILED.value}}
+    await db.payments.aggregate([
+        {"$match": counted},
+        {"$group": {
+            "_id": "$member_id",
+            "total_paid": {"$sum": {"$cond": [{"$eq": ["$status", PaymentStatus.PAID.value]}, "$amount", 0]}},
+            "outstanding": {"$sum": {"$cond": [
+                {"$in": ["$status", [status.value for status in OUTSTANDING_STATUSES]]}, "$amount", 0
+            ]}},
+            "payments": {"$sum": 1},
+            "last_payment_at": {"$max": {"$cond": [
+                {"$eq": ["$status", PaymentStatus.PAID.value]}, {"$ifNull": ["$paid_at", "$payment_date"]}, None
+            ]}}
+        }},
+        {"$project": {
+            "_id": 0, "member_id": "$_id", "gym_id": gym_id, "total_paid": 1, "outstanding": 1,
+            "payments": 1, "last_payment_at": 1
+        }},
+        {"$merge": {"into": "member_balances", "on": "member_id", "whenMatched": "replace"}}
+    ]).to_list(None)
+    await db.member_balances.delete_many({
+        "gym_id": gym_id, "member_id": {"$nin": await db.payments.distinct("member_id", counted)}
+    })
+
+async def payment_history_response(query: dict, date_from: Optional[datetime], date_to: Optional[datetime],
+                                   limit: Optional[int], cursor: Optional[str]):
+    payments, next_cursor = await fetch_keyset_page(
+        db.payments, query, "payment_date", date_from, date_to,
+        history_page_size(limit, cursor, PAYMENT_HISTORY_DEFAULT_LIMIT), cursor
+    )
+    return JSONResponse(
+        content=[jsonable_encoder(Payment(**payment)) for payment in payments],
+        headers={"X-Next-Cursor": next_cursor} if next_cursor else {}
+    )
+
+async def load_member_balance(member_id: str) -> MemberBalance:
+    balance = await db.member_balances.find_one({"member_id": member_id}, {"_id": 0})
+    return MemberBalance(**balance) if balance else MemberBalance(member_id=member_id)
+
+@api_router.post("/payments", response_model=Payment)
+async def record_payment(payment_data: PaymentCreate, current_user: User = Depends(get_current_owner_or_staff)):
+    """Record a payment; retries with the same idempotency key return the original"""
     if not current_user.gym_id:
         raise HTTPException(status_code=400, detail="No gym associated with user")
     
-    announcement = Announcement(
-        **announcement_data.dict(),
+    if payment_data.idempotency_key:
+        existing = await db.payments.find_one(
+            {"gym_id": current_user.gym_id, "idempotency_key": payment_data.idempotency_key}, {"_id": 0}
+        )
+        if existing:
+            return Payment(**existing)
+    
+    member = await db.members.find_one({"id": payment_data.member_id, "gym_id": current_user.gym_id})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    plan = await plan_cache.get_plan(current_user.gym_id, payment_data.plan_id or member["plan_id"])
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found for this gym")
+    
+    payment = Payment(
         gym_id=current_user.gym_id,
-        created_by=current_user.name
+        member_id=member["id"],
+        member_name=member["name"],
+        amount=payment_data.amount,
+        payment_date=payment_data.payment_date or datetime.utcnow(),
+        payment_method=payment_data.payment_method,
+        status=payment_data.status,
+        transaction_id=payment_data.transaction_id,
+        notes=payment_data.notes,
+        plan_id=plan["id"],
+        plan_name=plan["name"],
+        idempotency_key=payment_data.idempotency_key
     )
-    
-    await db.announcements.insert_one(announcement.dict())
-    return announcement
-
-@api_router.get("/announcements", response_model=List[Announcement])
-async def get_announcements(current_user: User = Depends(get_current_user)):
+    if not await insert_payments([payment.dict()]):
+        # Lost a race with a concurrent retry of the same key
+        existing = await db.payments.find_one(
+            {"gym_id": current_user.gym_id, "idempotency_key": payment_data.idempotency_key}, {"_id": 0}
+        )
+        return Payment(**existing)
+    return payment
+
+@api_router.post("/payments/{payment_id}/mark-paid", response_model=Payment)
+async def mark_payment_paid(payment_id: str, settle: PaymentSettle, current_user: User = Depends(get_current_owner_or_staff)):
+    """Settle a pending or overdue payment"""
+    now = datetime.utcnow()
+    # payment_date keeps the billing period the payment is counted in
+    updates = {"status": PaymentStatus.PAID.value, "paid_at": now}
+    if settle.payment_method:
+        updates["payment_method"] = settle.payment_method.value
+    if settle.transaction_id:
+        updates["transaction_id"] = settle.transaction_id
+    
+    # The status filter makes settling idempotent: only one caller moves the money
+    previous = await db.payments.find_one_and_update(
+        {"id": payment_id, "gym_id": current_user.gym_id, "status": {"$in": [status.value for status in OUTSTANDING_STATUSES]}},
+        {"$set": updates},
+        projection={"_id": 0}
+    )
+    if not previous:
+        payment = await db.payments.find_one({"id": payment_id, "gym_id": current_user.gym_id}, {"_id": 0})
+        if not payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        if payment["status"] != PaymentStatus.PAID.value:
+            raise HTTPException(status_code=400, detail=f"Cannot settle a {payment['status']} payment")
+        return Payment(**payment)
+    
+    settled = {**previous, **updates}
+    await asyncio.gather(
+        db.revenue_monthly.update_one(
+            {"gym_id": previous["gym_id"], "month": previous["payment_date"].strftime("%Y-%m")},
+            {"$inc": {"outstanding": -previous["amount"], "outstanding_payments": -1}}
+        ),
+        record_payment_revenue([settled]),
+        db.member_balances.update_one(
+            {"member_id": previous["member_id"]},
+            {
+                "$inc": {"outstanding": -previous["amount"], "total_paid": previous["amount"]},
+                "$max": {"last_payment_at": now}
+            }
+        )
+    )
+    return Payment(**settled)
+
+@api_router.get("/payments", response_model=List[Payment])
+async def get_gym_payments(
+    member_id: Optional[str] = None,
+    payment_status: Optional[PaymentStatus] = Query(None, alias="status"),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: int = Query(PAYMENT_HISTORY_DEFAULT_LIMIT, ge=1, le=PAYMENT_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_owner_or_staff)
+):
+    """Gym-wide payment history, newest first; the next page cursor is in X-Next-Cursor"""
     if not current_user.gym_id:
         return []
     
-    announcements = await db.announcements.find({
-        "gym_id": current_user.gym_id,
-        "is_active": True
-    }).sort("created_at", -1).to_list(1000)
+    query = {"gym_id": current_user.gym_id}
+    if member_id:
+        query["member_id"] = member_id
+    if payment_status:
+        query["status"] = payment_status.value
+    return await payment_history_response(query, date_from, date_to, limit, cursor)
+
+@api_router.get("/payments/summary", response_model=PaymentSummary)
+async def get_payment_summary(months: int = Query(12, ge=1, le=60), current_user: User = Depends(get_current_owner)):
+    """Monthly collected and outstanding totals from the precomputed aggregates"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    month_keys = recent_month_keys(months)[::-1]
+
+    aggregates = await db.revenue_monthly.find(
+        {"gym_id": current_user.gym_id},
+        {"_id": 0, "month": 1, "revenue": 1, "payments": 1, "outstanding": 1, "outstanding_payments": 1}
+    ).to_list(None)
+    by_month = {aggregate["month"]: aggregate for aggregate in aggregates}
+    totals = [PaymentMonthTotal(**by_month.get(key, {"month": key})) for key in month_keys]
+    return PaymentSummary(
+        months=totals,
+        total_revenue=sum(total.revenue for total in totals),
+        # Outstanding counts every month, not just the ones charted
+        total_outstanding=sum(aggregate.get("outstanding", 0) for aggregate in aggregates)
+    )
+
+@api_router.get("/payments/balance/{member_id}", response_model=MemberBalance)
+async def get_member_balance(member_id: str, current_user: User = Depends(get_current_owner_or_staff)):
+    member = await db.members.find_one({"id": member_id, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    return await load_member_balance(member_id)
+
+async def get_membership_distribution(gym_id: str) -> tuple:
+    """Active members per plan, most popular first, plus the most popular plan's name"""
+    rows = await db.members.aggregate([
+        {"$match": {"gym_id": gym_id, "membership_status": MembershipStatus.ACTIVE.value}},
+        {"$group": {"_id": "$plan_id", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ]).to_list(None)
+    catalog = await plan_cache.get_catalog(gym_id)
+    distribution = [
+        MembershipData(plan_name=catalog.get(row["_id"], {}).get("name", "Unknown Plan"), count=row["count"])
+        for row in rows
+    ]
+    return distribution, distribution[0].plan_name if distribution else None
+
+async def get_popular_plan(gym_id: str) -> Optional[str]:
+    """Most popular plan's name, kept in gym_stats and recounted at most every POPULAR_PLAN_REFRESH_SECONDS"""
+    stats = await db.gym_stats.find_one({"gym_id": gym_id}, {"popular_plan": 1, "popular_plan_at": 1})
+    if stats and stats.get("popular_plan_at") and \
+            datetime.utcnow() - stats["popular_plan_at"] < timedelta(seconds=POPULAR_PLAN_REFRESH_SECONDS):
+        return stats.get("popular_plan")
+
+    _, popular_plan = await get_membership_distribution(gym_id)
+    await db.gym_stats.update_one(
+        {"gym_id": gym_id},
+        {"$set": {"popular_plan": popular_plan, "popular_plan_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return popular_plan
+
+async def backfill_revenue_aggregates():
+    """Build revenue_monthly and member_balances for payments recorded before the aggregates existed"""
+    for gym_id in await db.payments.distinct("gym_id"):
+        await rebuild_revenue_aggregates(gym_id)
+
+async def backfill_member_balances():
+    """Recompute member_balances, which counted failed payments before they were excluded"""
+    for gym_id in await db.payments.distinct("gym_id"):
+        await rebuild_member_balances(gym_id)
+
+async def run_revenue_backfill():
+    try:
+        await run_once("revenue_backfill", backfill_revenue_aggregates)
+        await run_once("member_balances_backfill", backfill_member_balances)
+    except Exception:
+        logging.getLogger(__name__).exception("Revenue backfill failed")
+
+@api_router.get("/analytics/revenue", response_model=RevenueAnalytics)
+async def get_revenue_analytics(
+    months: int = Query(12, ge=1, le=60),
+    current_user: User = Depends(get_current_owner)
+):
+    """Monthly revenue series, revenue by plan and membership distribution"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    month_keys = recent_month_keys(months)[::-1]
+
+    aggregates, (distribution, popular_plan) = await asyncio.gather(
+        db.revenue_monthly.find(
+            {"gym_id": current_user.gym_id, "month": {"$gte": month_keys[0], "$lte": month_keys[-1]}},
+            {"_id": 0}
+        ).sort("month", 1).to_list(months),
+        get_membership_distribution(current_user.gym_id)
+    )
+    by_month = {aggregate["month"]: aggregate for aggregate in aggregates}
+
+    plan_totals = {}
+    for aggregate in aggregates:
+        for plan_id, plan in aggregate.get("by_plan", {}).items():
+            total = plan_totals.setdefault(plan_id, {"plan_name": plan.get("plan_name", ""), "revenue": 0.0, "payments": 0})
+            total["revenue"] += plan.get("revenue", 0)
+            total["payments"] += plan.get("payments", 0)
+
+    monthly_revenue = [
+        RevenueData(month=key, revenue=by_month.get(key, {}).get("revenue", 0))
+        for key in month_keys
+    ]
+    return RevenueAnalytics(
+        monthly_revenue=monthly_revenue,
+        total_revenue=sum(point.revenue for point in monthly_revenue),
+        revenue_by_plan=sorted(
+            [PlanRevenueData(plan_id=plan_id, **total) for plan_id, total in plan_totals.items()],
+            key=lambda plan: plan.revenue,
+            reverse=True
+        ),
+        membership_distribution=distribution,
+        popular_plan=popular_plan
+    )
+
+@api_router.post("/analytics/revenue/rebuild")
+async def rebuild_my_gym_revenue(current_user: User = Depends(get_current_owner)):
+    """Backfill monthly revenue aggregates from existing payments"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    months = await rebuild_revenue_aggregates(current_user.gym_id)
+    return {"message": "Revenue aggregates rebuilt", "months": months}
+
+# Owner Analytics
+# Reports are computed by analytics.build_owner_report in a worker process
+# from narrow projections, then cached in analytics_reports per gym per day.
+
+ANALYTICS_COHORT_MONTHS = 12
+ANALYTICS_WINDOW_DAYS = 30
+ANALYTICS_BATCH_SIZE = 5000
+ANALYTICS_WORKERS = int(os.environ.get("GYMBLE_ANALYTICS_WORKERS", "2"))
+ANALYTICS_REPORT_TTL_SECONDS = 2 * 24 * 3600
+
+analytics_executor = None
+
+def get_analytics_executor() -> ProcessPoolExecutor:
+    # Created at startup (or on first use when the app runs without lifespan events). Workers are
+    # spawned, not forked: forking the threaded server process would copy Motor's locks mid-use.
+    global analytics_executor
+    if analytics_executor is None:
+        analytics_executor = ProcessPoolExecutor(
+            max_workers=ANALYTICS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return analytics_executor
+
+async def load_analytics_inputs(gym_id: str, as_of: datetime) -> dict:
+    """Pull only the fields the reports need, grouped in Mongo where possible"""
+    year, month = as_of.year, as_of.month - (ANALYTICS_COHORT_MONTHS - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    window_start = as_of - timedelta(days=ANALYTICS_WINDOW_DAYS)
+
+    members, buckets, visit_counts, progress, catalog = await asyncio.gather(
+        db.members.find(
+            {"gym_id": gym_id},
+            {"_id": 0, "id": 1, "plan_id": 1, "membership_status": 1, "start_date": 1, "end_date": 1}
+        ).batch_size(ANALYTICS_BATCH_SIZE).to_list(None),
+        db.attendance_buckets.find(
+            {"gym_id": gym_id, "month": {"$gte": f"{year:04d}-{month:02d}"}},
+            {"_id": 0, "member_id": 1, "month": 1}
+        ).batch_size(ANALYTICS_BATCH_SIZE).to_list(None),
+        sessions.collection.aggregate([
+            {"$match": {"gym_id": gym_id, "check_in_time": {"$gte": window_start}}},
+            {"$group": {"_id": "$member_id", "visits": {"$sum": 1}}},
+            {"$project": {"_id": 0, "member_id": "$_id", "visits": 1}}
+        ], batchSize=ANALYTICS_BATCH_SIZE).to_list(None),
+        db.workout_progress.find(
+            {"gym_id": gym_id, "scheduled_date": {"$gte": window_start, "$lte": as_of}},
+            {"_id": 0, "member_id": 1, "workout_name": 1, "status": 1, "scheduled_date": 1}
+        ).batch_size(ANALYTICS_BATCH_SIZE).to_list(None),
+        plan_cache.get_catalog(gym_id)
+    )
+    return {
+        "members": members,
+        "attendance_buckets": buckets,
+        "visit_counts": visit_counts,
+        "workout_progress": progress,
+        "plan_names": {plan_id: plan["name"] for plan_id, plan in catalog.items()}
+    }
+
+async def compute_owner_report(gym_id: str, day: str) -> dict:
+    as_of = datetime.utcnow()
+    data = await load_analytics_inputs(gym_id, as_of)
+    loop = asyncio.get_running_loop()
+    report = await loop.run_in_executor(
+        get_analytics_executor(), build_owner_report, data, as_of, ANALYTICS_COHORT_MONTHS, ANALYTICS_WINDOW_DAYS
+    )
+    report.pop("as_of", None)
+    report.update({"gym_id": gym_id, "day": day, "generated_at": as_of})
+    await db.analytics_reports.replace_one({"gym_id": gym_id, "day": day}, report, upsert=True)
+    return report
+
+@api_router.get("/analytics/reports", response_model=OwnerAnalyticsReport)
+async def get_owner_analytics(refresh: bool = False, current_user: User = Depends(get_current_owner)):
+    """Retention cohorts, churn by plan, visit frequency and workout adherence (cached per day)"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    day = datetime.utcnow().strftime("%Y-%m-%d")
+    if not refresh:
+        cached = await db.analytics_reports.find_one({"gym_id": current_user.gym_id, "day": day}, {"_id": 0})
+        if cached:
+            return OwnerAnalyticsReport(**cached)
+
+    report = await request_coalescer.run(
+        f"analytics_report:{current_user.gym_id}:{day}",
+        lambda: compute_owner_report(current_user.gym_id, day)
+    )
+    return OwnerAnalyticsReport(**report)
+
+# Announcement Routes
+@api_router.post("/announcements", response_model=Announcement)
+async def create_announcement(announcement_data: AnnouncementCreate, current_user: User = Depends(get_current_owner)):
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    announcement = Announcement(
+        **announcement_data.dict(exclude={"expires_at"}),
+        expires_at=naive_utc(announcement_data.expires_at),
+        gym_id=current_user.gym_id,
+        created_by=current_user.name
+    )
+    
+    await db.announcements.insert_one(announcement.dict())
+    return announcement
+
+ANNOUNCEMENT_DEFAULT_LIMIT = 50
+ANNOUNCEMENT_MAX_LIMIT = 200
+ANNOUNCEMENT_ARCHIVE_INTERVAL_SECONDS = 3600
+
+async def fetch_announcement_feed(
+    gym_id: str,
+    since: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    limit: int = ANNOUNCEMENT_DEFAULT_LIMIT
+) -> AnnouncementFeed:
+    """Newest-first page of live announcements, served by the (gym_id, is_active, created_at) index"""
+    now = datetime.utcnow()
+    query = {
+        "gym_id": gym_id,
+        "is_active": True,
+        "$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]
+    }
+    created_at = {}
+    if since:
+        created_at["$gt"] = since
+    if before:
+        created_at["$lt"] = before
+    if created_at:
+        query["created_at"] = created_at
+
+    # Fetch one extra document to know whether another page exists
+    announcements = await db.announcements.find(query, {"_id": 0}).sort("created_at", -1).limit(limit + 1).to_list(limit + 1)
+    has_more = len(announcements) > limit
+    announcements = [Announcement(**announcement) for announcement in announcements[:limit]]
+
+    return AnnouncementFeed(
+        announcements=announcements,
+        latest=announcements[0].created_at if announcements else since,
+        oldest=announcements[-1].created_at if announcements else None,
+        has_more=has_more
+    )
+
+async def archive_expired_announcements() -> int:
+    """Move expired and deleted announcements out of the hot collection"""
+    now = datetime.utcnow()
+    query = {"$or": [{"expires_at": {"$lte": now}}, {"is_active": False}]}
+    archived = 0
+    while True:
+        batch = await db.announcements.find(query).limit(500).to_list(500)
+        if not batch:
+            return archived
+        # Upsert by id so concurrent workers archiving the same batch do not duplicate it
+        await db.announcements_archive.bulk_write([
+            ReplaceOne({"id": announcement["id"]}, {**announcement, "archived_at": now}, upsert=True)
+            for announcement in batch
+        ], ordered=False)
+        await db.announcements.delete_many({"_id": {"$in": [announcement["_id"] for announcement in batch]}})
+        archived += len(batch)
+
+async def run_announcement_archiver():
+    while True:
+        try:
+            archived = await archive_expired_announcements()
+            if archived:
+                logging.getLogger(__name__).info(f"Archived {archived} announcements")
+        except Exception:
+            logging.getLogger(__name__).exception("Announcement archival failed")
+        await asyncio.sleep(ANNOUNCEMENT_ARCHIVE_INTERVAL_SECONDS)
+
+@api_router.get("/announcements", response_model=List[Announcement])
+async def get_announcements(
+    limit: int = Query(ANNOUNCEMENT_DEFAULT_LIMIT, ge=1, le=ANNOUNCEMENT_MAX_LIMIT),
+    current_user: User = Depends(get_current_user)
+):
+    if not current_user.gym_id:
+        return []
     
-    return [Announcement(**announcement) for announcement in announcements]
+    feed = await fetch_announcement_feed(current_user.gym_id, limit=limit)
+    return feed.announcements
+
+@api_router.get("/announcements/feed", response_model=AnnouncementFeed)
+async def get_announcement_feed(
+    since: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    limit: int = Query(ANNOUNCEMENT_DEFAULT_LIMIT, ge=1, le=ANNOUNCEMENT_MAX_LIMIT),
+    current_user: User = Depends(get_current_user)
+):
+    """Announcements newer than `since` (last view) and/or older than `before` (paging)"""
+    if not current_user.gym_id:
+        return AnnouncementFeed()
+    
+    return await fetch_announcement_feed(
+        current_user.gym_id,
+        since=naive_utc(since),
+        before=naive_utc(before),
+        limit=limit
+    )
 
 # Member-specific routes for the mobile app
 @api_router.get("/members/me", response_model=Member)
@@ -1142,25 +3071,31 @@ async def update_my_member_profile(member_update: MemberUpdate, current_user: Us
     return Member(**updated_member)
 
 @api_router.get("/payments/me", response_model=List[Payment])
-async def get_my_payments(current_user: User = Depends(get_current_user)):
+@api_router.get("/payments/my-history", response_model=List[Payment])
+async def get_my_payments(
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PAYMENT_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """Get current member's payment history"""
-    if current_user.role != UserRole.MEMBER:
-        raise HTTPException(status_code=403, detail="Only members can access this endpoint")
-    
-    # First get the member record to get member_id
-    member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id})
-    if not member:
-        raise HTTPException(status_code=404, detail="Member profile not found")
-    
-    payments = await db.payments.find({
-        "member_id": member["id"],
-        "gym_id": current_user.gym_id
-    }).sort("payment_date", -1).to_list(1000)
-    
-    return [Payment(**payment) for payment in payments]
+    member_id = await get_member_id_for_user(current_user)
+    return await payment_history_response(
+        {"member_id": member_id, "gym_id": current_user.gym_id}, date_from, date_to, limit, cursor
+    )
+
+@api_router.get("/payments/my-balance", response_model=MemberBalance)
+async def get_my_balance(current_user: User = Depends(get_current_user)):
+    """Get current member's paid and outstanding totals"""
+    member_id = await get_member_id_for_user(current_user)
+    return await load_member_balance(member_id)
 
 @api_router.get("/announcements/me", response_model=List[Announcement])
-async def get_my_announcements(current_user: User = Depends(get_current_user)):
+async def get_my_announcements(
+    limit: int = Query(ANNOUNCEMENT_DEFAULT_LIMIT, ge=1, le=ANNOUNCEMENT_MAX_LIMIT),
+    current_user: User = Depends(get_current_user)
+):
     """Get announcements for current member's gym"""
     if current_user.role != UserRole.MEMBER:
         raise HTTPException(status_code=403, detail="Only members can access this endpoint")
@@ -1168,25 +3103,29 @@ async def get_my_announcements(current_user: User = Depends(get_current_user)):
     if not current_user.gym_id:
         return []
     
-    announcements = await db.announcements.find({
-        "gym_id": current_user.gym_id,
-        "is_active": True
-    }).sort("created_at", -1).to_list(1000)
-    
-    return [Announcement(**announcement) for announcement in announcements]
+    feed = await fetch_announcement_feed(current_user.gym_id, limit=limit)
+    return feed.announcements
 
 @api_router.get("/members/me/stats")
-async def get_my_member_stats(current_user: User = Depends(get_current_user)):
+async def get_my_member_stats(
+    current_user: User = Depends(rate_limited("member_stats", user_limit=(1, 5), gym_limit=(50, 200)))
+):
     """Get current member's stats (visits, membership status, etc.)"""
     if current_user.role != UserRole.MEMBER:
         raise HTTPException(status_code=403, detail="Only members can access this endpoint")
     
+    return await request_coalescer.run(
+        f"member_stats:{current_user.gym_id}:{current_user.email}",
+        lambda: load_member_stats(current_user)
+    )
+
+async def load_member_stats(current_user: User) -> dict:
     member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id})
     if not member:
         raise HTTPException(status_code=404, detail="Member profile not found")
     
     # Get plan details
-    plan = await db.plans.find_one({"id": member["plan_id"]})
+    plan = await plan_cache.get_plan(member["gym_id"], member["plan_id"])
     
     # Calculate days remaining
     end_date = member["end_date"]
@@ -1209,18 +3148,41 @@ async def get_my_member_stats(current_user: User = Depends(get_current_user)):
 
 # Attendance Routes
 
-@api_router.get("/attendance/qr-code", response_model=QRCodeResponse)
-async def get_attendance_qr_code(current_user: User = Depends(get_current_owner_or_staff)):
+@api_router.get("/attendance/qr-code", response_model=QRCodeResponse, response_model_exclude_none=True)
+async def get_attendance_qr_code(
+    request: Request,
+    qr_format: str = Query("base64", alias="format", description="base64 (PNG in JSON), png (binary), svg or matrix"),
+    current_user: User = Depends(rate_limited(
+        "attendance_qr", user_limit=(1, 10), gym_limit=(5, 20), base_dependency=get_current_owner_or_staff
+    ))
+):
     """Generate dynamic QR code for gym attendance"""
     if not current_user.gym_id:
         raise HTTPException(status_code=400, detail="No gym associated with user")
-    
-    qr_data, qr_image, expires_at = generate_dynamic_qr_code(current_user.gym_id)
+    if qr_format not in QR_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(QR_FORMATS)}")
+    
+    qr_data, rendered, expires_at = await qr_render_cache.get(current_user.gym_id, qr_format)
+    
+    if qr_format == "png":
+        # The image only changes when the slot rotates, so clients may reuse it until then
+        headers = {
+            "Cache-Control": f"private, max-age={max(0, int((expires_at - datetime.utcnow()).total_seconds()))}",
+            "ETag": f'"{qr_data}"',
+            "X-QR-Data": qr_data,
+            "X-QR-Expires-At": expires_at.isoformat()
+        }
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=rendered, media_type="image/png", headers=headers)
     
     return QRCodeResponse(
         qr_code_data=qr_data,
-        qr_code_image=qr_image,
-        expires_at=expires_at
+        qr_code_image=rendered if qr_format == "base64" else None,
+        qr_code_svg=rendered if qr_format == "svg" else None,
+        qr_code_matrix=rendered if qr_format == "matrix" else None,
+        expires_at=expires_at,
+        rotation_seconds=QR_ROTATION_SECONDS
     )
 
 @api_router.post("/attendance/mark", response_model=AttendanceRecord)
@@ -1250,51 +3212,24 @@ async def mark_attendance(
     
     # Check if already checked in today
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    existing_attendance = await db.attendance.find_one({
-        "member_id": member["id"],
-        "check_in_time": {"$gte": today_start},
-        "check_out_time": None
-    })
+    existing_attendance = await sessions.find_open(member["id"], today_start)
     
     if existing_attendance:
         # Member is checking out
-        check_out_time = datetime.utcnow()
-        duration = int((check_out_time - existing_attendance["check_in_time"]).total_seconds() / 60)
-        
-        await db.attendance.update_one(
-            {"id": existing_attendance["id"]},
-            {
-                "$set": {
-                    "check_out_time": check_out_time,
-                    "duration_minutes": duration
-                }
-            }
-        )
-        
-        updated_record = await db.attendance.find_one({"id": existing_attendance["id"]})
+        updated_record = await sessions.close(existing_attendance)
+        if not updated_record:
+            # A concurrent scan already closed this session
+            updated_record = await sessions.collection.find_one({"id": existing_attendance["id"]})
         return AttendanceRecord(**updated_record)
     else:
         # Member is checking in
-        attendance_record = AttendanceRecord(
-            gym_id=current_user.gym_id,
-            member_id=member["id"],
-            member_name=member["name"],
+        return await sessions.open(
+            current_user.gym_id,
+            member,
+            source="qr",
             qr_code_data=attendance_data.qr_code_data,
             device_info=attendance_data.device_info
         )
-        
-        await db.attendance.insert_one(attendance_record.dict())
-        
-        # Update member's last visit and total visits
-        await db.members.update_one(
-            {"id": member["id"]},
-            {
-                "$set": {"last_visit": datetime.utcnow()},
-                "$inc": {"total_visits": 1}
-            }
-        )
-        
-        return attendance_record
 
 from math import radians, sin, cos, sqrt, atan2
 
@@ -1349,49 +3284,314 @@ async def mark_attendance_new(
 
     # 5. Prevent Duplicate Check-ins within 24 hours
     twenty_four_hours_ago = datetime.utcnow() - timedelta(hours=24)
-    recent_attendance = await db.attendance.find_one({
-        "member_id": member["id"],
-        "check_in_time": {"$gte": twenty_four_hours_ago}
-    })
+    recent_attendance = await sessions.find_latest(member["id"], twenty_four_hours_ago)
 
     if recent_attendance:
         raise HTTPException(status_code=400, detail="You have already checked in within the last 24 hours.")
 
     # 6. Create Attendance Record
-    attendance_record = AttendanceRecord(
-        gym_id=current_user.gym_id,
+    return await sessions.open(
+        current_user.gym_id,
+        member,
+        source="qr_location",
+        qr_code_data=request_data.qr_code_data,
+        device_info=request_data.device_info
+    )
+
+# Day Passes & Kiosk
+# Members fetch a signed pass for the day while online. A front-desk kiosk
+# verifies passes offline with the public key, queues the scans, and uploads
+# them to /attendance/kiosk/ingest, which replays them in scan order against
+# the member's visits that day: a scan inside an open visit checks it out,
+# a scan outside any visit checks in, a scan inside a closed visit is a
+# conflict and repeat taps within KIOSK_DEBOUNCE_SECONDS are duplicates.
+KIOSK_MAX_SCANS = 500
+KIOSK_DEBOUNCE_SECONDS = 60
+KIOSK_MAX_SCAN_AGE_DAYS = 7
+KIOSK_SCAN_TTL_SECONDS = 14 * 24 * 3600  # Longer than the max scan age, so late re-uploads still dedupe
+
+def resolve_kiosk_scan(day_visits: List[dict], scanned_at: datetime) -> tuple:
+    """(action, visit) for a scan against one member's visits on the scan's day"""
+    for visit in day_visits:
+        for event in (visit["check_in_time"], visit.get("check_out_time")):
+            if event and abs((scanned_at - event).total_seconds()) <= KIOSK_DEBOUNCE_SECONDS:
+                return "duplicate", visit
+
+    containing = [
+        visit for visit in day_visits
+        if visit["check_in_time"] <= scanned_at and (visit.get("check_out_time") is None or scanned_at <= visit["check_out_time"])
+    ]
+    if not containing:
+        return "check_in", None
+    visit = max(containing, key=lambda visit: visit["check_in_time"])
+    return ("check_out" if visit.get("check_out_time") is None else "conflict"), visit
+
+@api_router.get("/attendance/day-pass", response_model=DayPassResponse, response_model_exclude_none=True)
+async def get_day_pass(
+    qr_format: Optional[str] = Query(None, alias="format", description="Also render the pass: base64, svg or matrix"),
+    current_user: User = Depends(rate_limited("day_pass", user_limit=(1, 5), gym_limit=(50, 200)))
+):
+    """Signed pass for today that front-desk kiosks can verify offline"""
+    if current_user.role != UserRole.MEMBER:
+        raise HTTPException(status_code=403, detail="Only members can get a day pass")
+    if qr_format is not None and qr_format not in DAY_PASS_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(DAY_PASS_FORMATS)}")
+    
+    member = await db.members.find_one(
+        {"email": current_user.email, "gym_id": current_user.gym_id},
+        {"_id": 0, "id": 1, "name": 1, "membership_status": 1, "end_date": 1}
+    )
+    if not member:
+        raise HTTPException(status_code=404, detail="Member record not found")
+    
+    now = datetime.utcnow()
+    end_date = member.get("end_date")
+    if member["membership_status"] != "active" or (end_date and end_date <= now):
+        raise HTTPException(status_code=400, detail="Membership is not active")
+    
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    expires_at = min(day_start + timedelta(days=1), end_date) if end_date else day_start + timedelta(days=1)
+    pass_token = create_day_pass(current_user.gym_id, member, day_start, expires_at)
+    
+    rendered = None
+    if qr_format:
+        rendered = await asyncio.get_running_loop().run_in_executor(None, render_qr, pass_token, qr_format)
+    
+    return DayPassResponse(
+        pass_token=pass_token,
         member_id=member["id"],
         member_name=member["name"],
-        qr_code_data=request_data.qr_code_data,
-        device_info=request_data.device_info,
-        latitude=request_data.latitude,
-        longitude=request_data.longitude
+        valid_on=day_start.strftime("%Y-%m-%d"),
+        expires_at=expires_at,
+        qr_code_image=rendered if qr_format == "base64" else None,
+        qr_code_svg=rendered if qr_format == "svg" else None,
+        qr_code_matrix=rendered if qr_format == "matrix" else None
     )
 
-    await db.attendance.insert_one(attendance_record.dict())
+@api_router.post("/attendance/day-pass/verify", response_model=DayPassInfo)
+async def verify_day_pass_scan(verify_request: DayPassVerifyRequest, current_user: User = Depends(get_current_owner_or_staff)):
+    """Check a scanned day pass for this gym right now; no database access"""
+    pass_info = verify_day_pass(verify_request.pass_token, current_user.gym_id or "")
+    if not pass_info:
+        return DayPassInfo(valid=False)
+    return DayPassInfo(valid=True, **pass_info)
+
+@api_router.get("/attendance/kiosk/config", response_model=KioskConfig)
+async def get_kiosk_config(current_user: User = Depends(get_current_owner_or_staff)):
+    """Everything a kiosk needs to verify day passes and queue scans offline"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    return KioskConfig(
+        gym_id=current_user.gym_id,
+        public_key=day_pass_public_key(),
+        pass_prefix=DAY_PASS_PREFIX,
+        debounce_seconds=KIOSK_DEBOUNCE_SECONDS,
+        max_scans_per_ingest=KIOSK_MAX_SCANS,
+        max_scan_age_days=KIOSK_MAX_SCAN_AGE_DAYS,
+        server_time=datetime.utcnow()
+    )
 
-    await db.members.update_one(
-        {"id": member["id"]},
-        {
-            "$set": {"last_visit": datetime.utcnow()},
-            "$inc": {"total_visits": 1}
-        }
+@api_router.post("/attendance/kiosk/ingest", response_model=KioskIngestReport)
+async def ingest_kiosk_scans(ingest_request: KioskIngestRequest, current_user: User = Depends(get_current_owner_or_staff)):
+    """Reconcile scans a kiosk queued offline; safe to retry with the same scan ids"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    if len(ingest_request.scans) > KIOSK_MAX_SCANS:
+        raise HTTPException(status_code=400, detail=f"At most {KIOSK_MAX_SCANS} scans per ingest")
+    
+    gym_id = current_user.gym_id
+    now = datetime.utcnow()
+    scans = []
+    seen_ids = set()
+    for scan in ingest_request.scans:
+        # A scan queued twice is the same tap retried; the first copy wins
+        if scan.scan_id in seen_ids:
+            continue
+        seen_ids.add(scan.scan_id)
+        scans.append(scan)
+    
+    results = {}
+    ingested = await db.kiosk_scans.find(
+        {"gym_id": gym_id, "scan_id": {"$in": list(seen_ids)}}, {"_id": 0}
+    ).to_list(None)
+    for record in ingested:
+        results[record["scan_id"]] = KioskScanResult(
+            scan_id=record["scan_id"],
+            status="duplicate",
+            member_id=record.get("member_id"),
+            attendance_id=record.get("attendance_id"),
+            detail=f"Already ingested ({record['status']})"
+        )
+    
+    # Claim every new scan id first so concurrent uploads of one queue cannot both apply it
+    claims, pending = [], []
+    for scan in scans:
+        if scan.scan_id in results:
+            continue
+        pass_info = verify_day_pass(scan.pass_token, gym_id, at=scan.scanned_at)
+        if scan.scanned_at > now + DAY_PASS_CLOCK_SKEW:
+            detail = "Scan time is in the future"
+        elif scan.scanned_at < now - timedelta(days=KIOSK_MAX_SCAN_AGE_DAYS):
+            detail = "Scan is too old to ingest"
+        elif not pass_info:
+            detail = "Day pass is not valid for this gym at the scan time"
+        else:
+            detail = None
+        claims.append({
+            "gym_id": gym_id,
+            "scan_id": scan.scan_id,
+            "device_id": ingest_request.device_id,
+            "member_id": pass_info["member_id"] if pass_info else None,
+            "scanned_at": scan.scanned_at,
+            "status": "rejected" if detail else "pending",
+            "attendance_id": None,
+            "detail": detail,
+            "ingested_at": now
+        })
+        if detail:
+            results[scan.scan_id] = KioskScanResult(scan_id=scan.scan_id, status="rejected", detail=detail)
+        else:
+            pending.append((scan, pass_info))
+    
+    if claims:
+        try:
+            await db.kiosk_scans.insert_many(claims, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                scan_id = claims[error["index"]]["scan_id"]
+                results[scan_id] = KioskScanResult(scan_id=scan_id, status="duplicate", detail="Ingested by a concurrent upload")
+            pending = [(scan, pass_info) for scan, pass_info in pending if scan.scan_id not in results]
+    
+    try:
+        await apply_kiosk_scans(gym_id, ingest_request.device_id, pending, results)
+    except Exception:
+        # Release the claims so the kiosk's retry is processed; already applied scans come back as duplicates
+        await db.kiosk_scans.delete_many({
+            "gym_id": gym_id, "scan_id": {"$in": [scan.scan_id for scan, _ in pending]}, "status": "pending"
+        })
+        raise
+    
+    if pending:
+        await db.kiosk_scans.bulk_write([
+            UpdateOne(
+                {"gym_id": gym_id, "scan_id": scan.scan_id},
+                {"$set": {
+                    "status": results[scan.scan_id].status,
+                    "attendance_id": results[scan.scan_id].attendance_id,
+                    "detail": results[scan.scan_id].detail
+                }}
+            )
+            for scan, _ in pending
+        ], ordered=False)
+    
+    ordered = [results[scan.scan_id] for scan in scans]
+    counts = {status: sum(1 for result in ordered if result.status == status)
+              for status in ("checked_in", "checked_out", "duplicate", "conflict", "rejected")}
+    return KioskIngestReport(
+        checked_in=counts["checked_in"],
+        checked_out=counts["checked_out"],
+        duplicates=counts["duplicate"],
+        conflicts=counts["conflict"],
+        rejected=counts["rejected"],
+        results=ordered
     )
 
-    return attendance_record
+async def apply_kiosk_scans(gym_id: str, device_id: Optional[str], pending: List[tuple], results: dict):
+    """Replay verified scans in scan order against each member's visits, filling `results`"""
+    if not pending:
+        return
+    member_ids = list({pass_info["member_id"] for _, pass_info in pending})
+    members = await db.members.find(
+        {"id": {"$in": member_ids}, "gym_id": gym_id}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    members = {member["id"]: member for member in members}
+    
+    earliest = min(scan.scanned_at for scan, _ in pending).replace(hour=0, minute=0, second=0, microsecond=0)
+    visits = {}
+    async for visit in sessions.collection.find(
+        {"gym_id": gym_id, "member_id": {"$in": member_ids}, "check_in_time": {"$gte": earliest}},
+        {"_id": 0, "id": 1, "gym_id": 1, "member_id": 1, "check_in_time": 1, "check_out_time": 1}
+    ):
+        visits.setdefault(visit["member_id"], []).append(visit)
+    
+    opened = []
+    restreak = set()
+    for scan, pass_info in sorted(pending, key=lambda item: item[0].scanned_at):
+        member = members.get(pass_info["member_id"])
+        if not member:
+            results[scan.scan_id] = KioskScanResult(scan_id=scan.scan_id, status="rejected", detail="Member not found")
+            continue
+        
+        day_start = scan.scanned_at.replace(hour=0, minute=0, second=0, microsecond=0)
+        member_visits = visits.setdefault(member["id"], [])
+        day_visits = [visit for visit in member_visits if day_start <= visit["check_in_time"] < day_start + timedelta(days=1)]
+        action, visit = resolve_kiosk_scan(day_visits, scan.scanned_at)
+        
+        if action == "check_in":
+            if any(visit["check_in_time"] >= day_start + timedelta(days=1) for visit in member_visits):
+                restreak.add(member["id"])
+            session = await sessions.open(
+                gym_id, member, source="kiosk", device_info=device_id, check_in_time=scan.scanned_at
+            )
+            visit = session.dict(include={"id", "gym_id", "member_id", "check_in_time", "check_out_time"})
+            member_visits.append(visit)
+            opened.append(visit)
+            status, detail = "checked_in", None
+        elif action == "check_out":
+            closed = await sessions.close(visit, scan.scanned_at)
+            if closed:
+                visit["check_out_time"] = closed["check_out_time"]
+                status, detail = "checked_out", None
+            else:
+                status, detail = "conflict", "Visit was closed by another check-out"
+        elif action == "conflict":
+            status, detail = "conflict", "Scan falls inside a visit that is already closed"
+        else:
+            status, detail = "duplicate", "Repeat scan of a recorded check-in or check-out"
+        results[scan.scan_id] = KioskScanResult(
+            scan_id=scan.scan_id, status=status, member_id=member["id"], attendance_id=visit["id"], detail=detail
+        )
+    
+    # A late check-in that was never checked out ends where the member's next visit that day begins
+    for visit in opened:
+        if visit["check_out_time"] is not None:
+            continue
+        day_end = visit["check_in_time"].replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        later = [
+            other["check_in_time"] for other in visits[visit["member_id"]]
+            if visit["check_in_time"] < other["check_in_time"] < day_end
+        ]
+        if later:
+            closed = await sessions.close(visit, min(later), auto_checked_out=True)
+            if closed:
+                visit["check_out_time"] = closed["check_out_time"]
+    
+    # A visit on a day before the member's latest one can join or bridge streaks the running summary has moved past
+    for member_id in restreak:
+        await rebuild_attendance_summary(gym_id, member_id)
 
 @api_router.get("/attendance/my-status")
-async def get_my_attendance_status(current_user: User = Depends(get_current_user)):
+async def get_my_attendance_status(
+    current_user: User = Depends(rate_limited("attendance_status", user_limit=(1, 5), gym_limit=(50, 200)))
+):
     """Get current member's attendance status for today"""
     if current_user.role != UserRole.MEMBER:
         raise HTTPException(status_code=403, detail="Only members can access this endpoint")
     
+    return await request_coalescer.run(
+        f"attendance_status:{current_user.gym_id}:{current_user.email}",
+        lambda: load_attendance_status(current_user)
+    )
+
+async def load_attendance_status(current_user: User) -> dict:
     member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id})
     if not member:
         raise HTTPException(status_code=404, detail="Member record not found")
     
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    attendance = await db.attendance.find_one({
+    attendance = await sessions.collection.find_one({
         "member_id": member["id"],
         "check_in_time": {"$gte": today_start}
     })
@@ -1414,10 +3614,7 @@ async def get_today_attendance(current_user: User = Depends(get_current_owner_or
         return []
     
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    attendances = await db.attendance.find({
-        "gym_id": current_user.gym_id,
-        "check_in_time": {"$gte": today_start}
-    }).sort("check_in_time", -1).to_list(1000)
+    attendances = await sessions.list_for_gym(current_user.gym_id, today_start)
     
     return [AttendanceRecord(**attendance) for attendance in attendances]
 
@@ -1434,7 +3631,7 @@ async def get_attendance_stats(
         days = 90
     
     start_date = datetime.utcnow() - timedelta(days=days)
-    attendances = await db.attendance.find({
+    attendances = await sessions.collection.find({
         "gym_id": current_user.gym_id,
         "check_in_time": {"$gte": start_date}
     }).to_list(10000)
@@ -1491,7 +3688,7 @@ async def get_attendance_calendar(
     else:
         last_day = datetime(year, month + 1, 1) - timedelta(days=1)
     
-    attendances = await db.attendance.find({
+    attendances = await sessions.collection.find({
         "gym_id": current_user.gym_id,
         "check_in_time": {
             "$gte": first_day,
@@ -1545,6 +3742,579 @@ async def get_attendance_calendar(
         "days": days
     }
 
+# Attendance History
+# Visits are also written into one bucket document per member per month
+# (attendance_buckets) and a running per-member summary with streaks
+# (attendance_summaries), so history reads touch a handful of documents.
+# A bucket's sessions are keyed by visit id, so a check-out is a plain $set.
+
+async def record_attendance_visit(gym_id: str, member_id: str, visit_id: str, check_in_time: datetime,
+                                  live: bool = True):
+    day = check_in_time.strftime("%Y-%m-%d")
+    yesterday = (check_in_time - timedelta(days=1)).strftime("%Y-%m-%d")
+    await asyncio.gather(
+        record_occupancy_change(gym_id, 1, check_in_time, live=live),
+        db.attendance_buckets.update_one(
+            {"member_id": member_id, "month": check_in_time.strftime("%Y-%m")},
+            {
+                "$setOnInsert": {"gym_id": gym_id},
+                "$inc": {"visits": 1},
+                "$addToSet": {"days": day},
+                "$set": {f"sessions.{visit_id}": {
+                    "check_in_time": check_in_time, "check_out_time": None, "duration_minutes": None
+                }}
+            },
+            upsert=True
+        ),
+        # Pipeline update keeps the streak arithmetic atomic on the server
+        db.attendance_summaries.update_one(
+            {"member_id": member_id},
+            [
+                {"$set": {
+                    "gym_id": gym_id,
+                    "current_streak": {"$switch": {
+                        "branches": [
+                            {"case": {"$eq": ["$last_visit_day", day]}, "then": "$current_streak"},
+                            # A backdated visit cannot extend or break the streak ending on a later day
+                            {"case": {"$lt": [day, "$last_visit_day"]}, "then": "$current_streak"},
+                            {"case": {"$eq": ["$last_visit_day", yesterday]},
+                             "then": {"$add": [{"$ifNull": ["$current_streak", 0]}, 1]}},
+                        ],
+                        "default": 1
+                    }},
+                    "total_visits": {"$add": [{"$ifNull": ["$total_visits", 0]}, 1]},
+                    "first_visit_day": {"$min": [{"$ifNull": ["$first_visit_day", day]}, day]}
+                }},
+                {"$set": {
+                    "longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]},
+                    "last_visit_day": {"$max": [{"$ifNull": ["$last_visit_day", day]}, day]}
+                }}
+            ],
+            upsert=True
+        )
+    )
+
+async def record_attendance_checkout(gym_id: str, member_id: str, visit_id: str, check_in_time: datetime,
+                                     check_out_time: datetime, duration_minutes: int, live: bool = True):
+    await asyncio.gather(
+        record_occupancy_change(gym_id, -1, live=live),
+        db.attendance_buckets.update_one(
+            {"member_id": member_id, "month": check_in_time.strftime("%Y-%m")},
+            {
+                "$inc": {"total_minutes": duration_minutes, "completed_visits": 1},
+                "$set": {
+                    f"sessions.{visit_id}.check_out_time": check_out_time,
+                    f"sessions.{visit_id}.duration_minutes": duration_minutes
+                }
+            }
+        ),
+        db.attendance_summaries.update_one(
+            {"member_id": member_id},
+            {"$inc": {"total_minutes": duration_minutes, "completed_visits": 1}}
+        )
+    )
+
+async def load_attendance_history(member_id: str, months: int) -> AttendanceHistory:
+    now = datetime.utcnow()
+    month_keys = recent_month_keys(months, now)
+
+    summary, buckets = await asyncio.gather(
+        db.attendance_summaries.find_one({"member_id": member_id}),
+        db.attendance_buckets.find(
+            {"member_id": member_id, "month": {"$in": month_keys}},
+            {"_id": 0, "sessions": 0}
+        ).to_list(months)
+    )
+    summary = summary or {}
+    buckets_by_month = {bucket["month"]: bucket for bucket in buckets}
+
+    month_stats = []
+    visit_days = []
+    window_visits = window_minutes = window_completed = 0
+    for key in month_keys:
+        bucket = buckets_by_month.get(key, {})
+        visits = bucket.get("visits", 0)
+        total_minutes = bucket.get("total_minutes", 0)
+        completed = bucket.get("completed_visits", 0)
+        month_stats.append(AttendanceHistoryMonth(
+            month=key,
+            visits=visits,
+            visit_days=len(bucket.get("days", [])),
+            total_minutes=total_minutes,
+            average_duration_minutes=round(total_minutes / completed, 1) if completed else None
+        ))
+        visit_days.extend(sorted(bucket.get("days", []), reverse=True))
+        window_visits += visits
+        window_minutes += total_minutes
+        window_completed += completed
+
+    # A streak only counts as current if it reaches today or yesterday
+    last_visit_day = summary.get("last_visit_day")
+    yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    current_streak = summary.get("current_streak", 0) if last_visit_day and last_visit_day >= yesterday else 0
+
+    window_start = datetime.strptime(month_keys[-1], "%Y-%m")
+    first_visit_day = summary.get("first_visit_day")
+    if first_visit_day:
+        window_start = max(window_start, datetime.strptime(first_visit_day, "%Y-%m-%d"))
+    weeks = max(1.0, (now - window_start).days / 7)
+
+    return AttendanceHistory(
+        member_id=member_id,
+        current_streak=current_streak,
+        longest_streak=summary.get("longest_streak", 0),
+        total_visits=summary.get("total_visits", 0),
+        average_duration_minutes=round(window_minutes / window_completed, 1) if window_completed else None,
+        visits_per_week=round(window_visits / weeks, 2),
+        last_visit_day=last_visit_day,
+        months=month_stats,
+        visit_days=visit_days
+    )
+
+@api_router.get("/attendance/my-history", response_model=AttendanceHistory)
+async def get_my_attendance_history(
+    months: int = Query(6, ge=1, le=24),
+    current_user: User = Depends(get_current_user)
+):
+    """Get current member's visit history, streaks and frequency"""
+    if current_user.role != UserRole.MEMBER:
+        raise HTTPException(status_code=403, detail="Only members can access this endpoint")
+    
+    member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member record not found")
+    
+    return await load_attendance_history(member["id"], months)
+
+@api_router.get("/attendance/member/{member_id}/history", response_model=AttendanceHistory)
+async def get_member_attendance_history(
+    member_id: str,
+    months: int = Query(6, ge=1, le=24),
+    current_user: User = Depends(get_current_owner_or_staff)
+):
+    """Get a member's visit history, streaks and frequency (for gym owners/staff)"""
+    member = await db.members.find_one({"id": member_id, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    return await load_attendance_history(member_id, months)
+
+async def rebuild_attendance_history(gym_id: str) -> int:
+    """Recreate buckets and summaries for a gym from raw attendance (for data recorded before bucketing)"""
+    await sessions.collection.aggregate([
+        {"$match": {"gym_id": gym_id}},
+        {"$sort": {"check_in_time": 1}},
+        {"$group": {
+            "_id": {"member_id": "$member_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$check_in_time"}}},
+            "gym_id": {"$first": "$gym_id"},
+            "visits": {"$sum": 1},
+            "days": {"$addToSet": {"$dateToString": {"format": "%Y-%m-%d", "date": "$check_in_time"}}},
+            "total_minutes": {"$sum": {"$ifNull": ["$duration_minutes", 0]}},
+            "completed_visits": {"$sum": {"$cond": [{"$gt": ["$check_out_time", None]}, 1, 0]}},
+            "sessions": {"$push": {"k": "$id", "v": {
+                "check_in_time": "$check_in_time",
+                "check_out_time": {"$ifNull": ["$check_out_time", None]},
+                "duration_minutes": {"$ifNull": ["$duration_minutes", None]}
+            }}}
+        }},
+        {"$project": {
+            "_id": 0, "member_id": "$_id.member_id", "month": "$_id.month", "gym_id": 1, "visits": 1,
+            "days": 1, "total_minutes": 1, "completed_visits": 1, "sessions": {"$arrayToObject": "$sessions"}
+        }},
+        {"$merge": {"into": "attendance_buckets", "on": ["member_id", "month"], "whenMatched": "replace"}}
+    ]).to_list(None)
+
+    rebuilt = 0
+    member_ids = await db.attendance_buckets.distinct("member_id", {"gym_id": gym_id})
+    for member_id in member_ids:
+        await rebuild_attendance_summary(gym_id, member_id)
+        rebuilt += 1
+    return rebuilt
+
+def streaks_from_days(days: List[str]) -> tuple:
+    """(current, longest) runs of consecutive days; `current` is the run ending on the last day"""
+    current_streak = longest_streak = 0
+    previous = None
+    for day in sorted(set(days)):
+        date = datetime.strptime(day, "%Y-%m-%d")
+        current_streak = current_streak + 1 if previous and (date - previous).days == 1 else 1
+        longest_streak = max(longest_streak, current_streak)
+        previous = date
+    return current_streak, longest_streak
+
+async def rebuild_attendance_summary(gym_id: str, member_id: str):
+    """Recompute one member's summary from their buckets (after backfills or out-of-order visits)"""
+    buckets = await db.attendance_buckets.find(
+        {"member_id": member_id}, {"days": 1, "visits": 1, "total_minutes": 1, "completed_visits": 1}
+    ).to_list(None)
+    days = sorted({day for bucket in buckets for day in bucket.get("days", [])})
+    current_streak, longest_streak = streaks_from_days(days)
+    await db.attendance_summaries.replace_one(
+        {"member_id": member_id},
+        {
+            "member_id": member_id,
+            "gym_id": gym_id,
+            "current_streak": current_streak,
+            "longest_streak": longest_streak,
+            "total_visits": sum(bucket.get("visits", 0) for bucket in buckets),
+            "total_minutes": sum(bucket.get("total_minutes", 0) for bucket in buckets),
+            "completed_visits": sum(bucket.get("completed_visits", 0) for bucket in buckets),
+            "first_visit_day": days[0] if days else None,
+            "last_visit_day": days[-1] if days else None
+        },
+        upsert=True
+    )
+
+@api_router.post("/attendance/history/rebuild")
+async def rebuild_my_gym_attendance_history(current_user: User = Depends(get_current_owner)):
+    """Backfill history buckets from raw attendance records"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    rebuilt = await rebuild_attendance_history(current_user.gym_id)
+    return {"message": "Attendance history rebuilt", "members": rebuilt}
+
+# Occupancy
+# gym_occupancy holds one live headcount per gym, moved by check-ins and
+# check-outs. occupancy_hourly holds one document per gym per day with
+# check-ins and peak headcount for each hour, for capacity planning.
+AUTO_CHECKOUT_AFTER_HOURS = 4
+AUTO_CHECKOUT_DURATION_MINUTES = 90
+OCCUPANCY_SWEEP_INTERVAL_SECONDS = 300
+
+async def record_occupancy_change(gym_id: str, delta: int, at: Optional[datetime] = None, live: bool = True):
+    """Move the live headcount and count check-ins per hour; backdated visits (live=False) only add their check-in"""
+    occupancy = None
+    if live:
+        occupancy = await db.gym_occupancy.find_one_and_update(
+            {"gym_id": gym_id},
+            [{"$set": {
+                "current": {"$max": [0, {"$add": [{"$ifNull": ["$current", 0]}, delta]}]},
+                "updated_at": "$$NOW"
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    if delta > 0:
+        at = at or datetime.utcnow()
+        hour = f"{at.hour:02d}"
+        update = {"$inc": {f"hours.{hour}.checkins": delta}}
+        if occupancy:
+            update["$max"] = {f"hours.{hour}.peak": occupancy["current"]}
+        await db.occupancy_hourly.update_one(
+            {"gym_id": gym_id, "date": at.strftime("%Y-%m-%d")}, update, upsert=True
+        )
+
+async def backfill_occupancy_hourly():
+    """Hourly check-in counts from raw attendance for days without an occupancy_hourly document.
+
+    Peak headcounts are not reconstructed; the live counter itself is
+    resynced by the occupancy sweeper.
+    """
+    await sessions.collection.aggregate([
+        {"$group": {
+            "_id": {
+                "gym_id": "$gym_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$check_in_time"}},
+                "hour": {"$dateToString": {"format": "%H", "date": "$check_in_time"}}
+            },
+            "checkins": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": {"gym_id": "$_id.gym_id", "date": "$_id.date"},
+            "hours": {"$push": {"k": "$_id.hour", "v": {"checkins": "$checkins"}}}
+        }},
+        {"$project": {"_id": 0, "gym_id": "$_id.gym_id", "date": "$_id.date", "hours": {"$arrayToObject": "$hours"}}},
+        {"$merge": {"into": "occupancy_hourly", "on": ["gym_id", "date"], "whenMatched": "keepExisting"}}
+    ]).to_list(None)
+
+async def get_live_occupancy(gym_id: str) -> int:
+    occupancy = await db.gym_occupancy.find_one({"gym_id": gym_id}, {"current": 1})
+    return occupancy["current"] if occupancy else 0
+
+async def sweep_stale_sessions(now: Optional[datetime] = None) -> int:
+    """Check out sessions left open past AUTO_CHECKOUT_AFTER_HOURS, then resync the live counters"""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=AUTO_CHECKOUT_AFTER_HOURS)
+    closed = 0
+
+    while True:
+        stale = await sessions.collection.find(
+            {"check_out_time": None, "check_in_time": {"$lt": cutoff}},
+            {"_id": 0, "id": 1, "gym_id": 1, "member_id": 1, "check_in_time": 1, "backdated": 1}
+        ).limit(SCHEDULER_BATCH_SIZE).to_list(SCHEDULER_BATCH_SIZE)
+        if not stale:
+            break
+        for session in stale:
+            check_out_time = session["check_in_time"] + timedelta(minutes=AUTO_CHECKOUT_DURATION_MINUTES)
+            result = await sessions.collection.update_one(
+                {"id": session["id"], "check_out_time": None},
+                {"$set": {
+                    "check_out_time": check_out_time,
+                    "duration_minutes": AUTO_CHECKOUT_DURATION_MINUTES,
+                    "auto_checked_out": True
+                }}
+            )
+            if result.modified_count:
+                closed += 1
+                await record_attendance_checkout(
+                    session["gym_id"], session["member_id"], session["id"],
+                    session["check_in_time"], check_out_time, AUTO_CHECKOUT_DURATION_MINUTES,
+                    live=not session.get("backdated", False)
+                )
+
+    # Recount the (now bounded) set of open sessions so counter drift cannot accumulate.
+    # Counters are read before counting and corrected by $inc only if still unchanged, so a
+    # check-in or check-out racing the sweep is never overwritten; its drift waits for the next sweep.
+    counters = {
+        occupancy["gym_id"]: occupancy.get("current", 0)
+        for occupancy in await db.gym_occupancy.find({}, {"_id": 0, "gym_id": 1, "current": 1}).to_list(None)
+    }
+    rows = await sessions.collection.aggregate([
+        {"$match": {"check_out_time": None, "check_in_time": {"$gte": cutoff}, "backdated": {"$ne": True}}},
+        {"$group": {"_id": "$gym_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    open_counts = {row["_id"]: row["count"] for row in rows}
+    updates = []
+    for gym_id in set(counters) | set(open_counts):
+        count = open_counts.get(gym_id, 0)
+        if gym_id not in counters:
+            updates.append(UpdateOne(
+                {"gym_id": gym_id}, {"$setOnInsert": {"current": count, "updated_at": now}}, upsert=True
+            ))
+        elif counters[gym_id] != count:
+            updates.append(UpdateOne(
+                {"gym_id": gym_id, "current": counters[gym_id]},
+                {"$inc": {"current": count - counters[gym_id]}, "$set": {"updated_at": now}}
+            ))
+    if updates:
+        await db.gym_occupancy.bulk_write(updates, ordered=False)
+    return closed
+
+async def run_occupancy_sweeper():
+    while True:
+        try:
+            if await acquire_lease("occupancy_sweeper", ttl_seconds=OCCUPANCY_SWEEP_INTERVAL_SECONDS * 3):
+                closed = await sweep_stale_sessions()
+                if closed:
+                    logging.getLogger(__name__).info(f"Auto-checked out {closed} stale sessions")
+        except Exception:
+            logging.getLogger(__name__).exception("Occupancy sweep failed")
+        await asyncio.sleep(OCCUPANCY_SWEEP_INTERVAL_SECONDS)
+
+@api_router.get("/occupancy/live")
+async def get_occupancy_live(current_user: User = Depends(get_current_user)):
+    """Current headcount at the user's gym"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    occupancy = await db.gym_occupancy.find_one({"gym_id": current_user.gym_id}, {"_id": 0})
+    return {
+        "gym_id": current_user.gym_id,
+        "current": occupancy["current"] if occupancy else 0,
+        "updated_at": occupancy.get("updated_at") if occupancy else None
+    }
+
+@api_router.get("/occupancy/hourly")
+async def get_occupancy_hourly(
+    days: int = Query(7, ge=1, le=90),
+    current_user: User = Depends(get_current_owner_or_staff)
+):
+    """Hourly check-ins and peak headcount for the last N days, plus the average profile by hour"""
+    if not current_user.gym_id:
+        return {"days": [], "average_by_hour": []}
+    
+    start = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    documents = await db.occupancy_hourly.find(
+        {"gym_id": current_user.gym_id, "date": {"$gte": start}},
+        {"_id": 0, "date": 1, "hours": 1}
+    ).sort("date", 1).to_list(days)
+
+    series = []
+    checkin_totals = [0] * 24
+    peak_totals = [0] * 24
+    for document in documents:
+        hours = document.get("hours", {})
+        day_hours = []
+        for hour in range(24):
+            values = hours.get(f"{hour:02d}", {})
+            checkins = values.get("checkins", 0)
+            peak = values.get("peak", 0)
+            checkin_totals[hour] += checkins
+            peak_totals[hour] += peak
+            day_hours.append({"hour": hour, "checkins": checkins, "peak": peak})
+        series.append({"date": document["date"], "hours": day_hours})
+
+    return {
+        "days": series,
+        "average_by_hour": [
+            {
+                "hour": hour,
+                "checkins": round(checkin_totals[hour] / days, 2),
+                "peak": round(peak_totals[hour] / days, 2)
+            }
+            for hour in range(24)
+        ]
+    }
+
+# Template Versions
+# Template content is snapshotted into template_versions under a hash of
+# the template id and content. Versions never change, so clients can cache
+# them forever; templates point at their current version and assignments
+# at the version they were made against. Every save also appends to
+# template_version_history, so reverting to earlier content shows up.
+
+TEMPLATE_COLLECTIONS = {"workout": "workout_templates", "diet": "diet_templates"}
+TEMPLATE_CONTENT_MODELS = {"workout": WorkoutTemplateCreate, "diet": DietTemplateCreate}
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+MAX_BATCH_VERSIONS = 100
+
+def template_version_id(kind: str, gym_id: str, template_id: str, content: dict) -> str:
+    canonical = json.dumps({"kind": kind, "gym_id": gym_id, "template_id": template_id, "content": content},
+                           sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+async def save_template_version(kind: str, template: dict) -> str:
+    """Store the template's content as a version (if new), record the save in the history and return the id"""
+    content = TEMPLATE_CONTENT_MODELS[kind](**template).dict()
+    version_id = template_version_id(kind, template["gym_id"], template["id"], content)
+    version = TemplateVersion(
+        id=version_id, kind=kind, gym_id=template["gym_id"], template_id=template["id"], content=content
+    )
+    await db.template_versions.update_one(
+        {"id": version_id},
+        {"$setOnInsert": version.dict(exclude={"saved_at"})},
+        upsert=True
+    )
+    await db.template_version_history.insert_one({
+        "template_id": template["id"],
+        "kind": kind,
+        "gym_id": template["gym_id"],
+        "version_id": version_id,
+        "saved_at": datetime.utcnow()
+    })
+    return version_id
+
+async def ensure_template_version(kind: str, template: dict) -> str:
+    """Current version of a template, snapshotting templates saved before versioning"""
+    if template.get("current_version"):
+        return template["current_version"]
+    version_id = await save_template_version(kind, template)
+    await db[TEMPLATE_COLLECTIONS[kind]].update_one(
+        {"id": template["id"]},
+        {"$set": {"current_version": version_id}}
+    )
+    return version_id
+
+async def load_assigned_plans(gym_id: str, assignments: List[dict]) -> dict:
+    """{assignment_id: plan content} as assigned; the current template for assignments made before versioning"""
+    version_ids = list({assignment["plan_version"] for assignment in assignments if assignment.get("plan_version")})
+    versions = {}
+    if version_ids:
+        versions = {
+            version["id"]: version["content"]
+            for version in await db.template_versions.find(
+                {"id": {"$in": version_ids}, "gym_id": gym_id}, {"_id": 0, "id": 1, "content": 1}
+            ).to_list(len(version_ids))
+        }
+    legacy_ids = list({assignment["plan_id"] for assignment in assignments if assignment.get("plan_version") not in versions})
+    templates = await template_cache.get_many(gym_id, legacy_ids) if legacy_ids else {}
+
+    plans = {}
+    for assignment in assignments:
+        if assignment.get("plan_version") in versions:
+            plans[assignment["id"]] = versions[assignment["plan_version"]]
+        elif assignment["plan_id"] in templates:
+            plans[assignment["id"]] = templates[assignment["plan_id"]][1]
+    return plans
+
+def set_immutable_headers(response: Response, etag: str):
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.headers["ETag"] = f'"{etag}"'
+
+@api_router.get("/template-versions/{version_id}", response_model=TemplateVersion)
+async def get_template_version(version_id: str, request: Request, response: Response,
+                               current_user: User = Depends(get_current_user)):
+    """One immutable template version; safe to cache forever"""
+    version = await db.template_versions.find_one({"id": version_id, "gym_id": current_user.gym_id}, {"_id": 0})
+    if not version:
+        raise HTTPException(status_code=404, detail="Template version not found")
+    
+    if request.headers.get("if-none-match") == f'"{version_id}"':
+        return Response(status_code=304, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{version_id}"'})
+    set_immutable_headers(response, version_id)
+    return TemplateVersion(**version)
+
+@api_router.get("/template-versions", response_model=List[TemplateVersion])
+async def get_template_versions(response: Response, ids: str = Query(..., description="Comma separated version ids"),
+                                current_user: User = Depends(get_current_user)):
+    """Many template versions in one call, in the order requested"""
+    version_ids = list(dict.fromkeys(version_id.strip() for version_id in ids.split(",") if version_id.strip()))
+    if len(version_ids) > MAX_BATCH_VERSIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_VERSIONS} versions per request")
+    
+    versions = await db.template_versions.find(
+        {"id": {"$in": version_ids}, "gym_id": current_user.gym_id}, {"_id": 0}
+    ).to_list(len(version_ids))
+    by_id = {version["id"]: version for version in versions}
+
+    # Only a complete answer is immutable; a missing id may still be created later
+    if len(by_id) == len(version_ids):
+        set_immutable_headers(response, hashlib.sha256(",".join(version_ids).encode("utf-8")).hexdigest()[:32])
+    return [TemplateVersion(**by_id[version_id]) for version_id in version_ids if version_id in by_id]
+
+async def list_template_versions(kind: str, template_id: str, gym_id: str) -> List[TemplateVersion]:
+    """One entry per save, newest first; a version saved again (e.g. a revert) appears again"""
+    history = await db.template_version_history.find(
+        {"template_id": template_id, "kind": kind, "gym_id": gym_id}, {"_id": 0, "version_id": 1, "saved_at": 1}
+    ).sort([("saved_at", DESCENDING), ("_id", DESCENDING)]).to_list(1000)
+    if not history:
+        # Saved before the history was kept: fall back to the versions themselves
+        versions = await db.template_versions.find(
+            {"template_id": template_id, "kind": kind, "gym_id": gym_id}, {"_id": 0}
+        ).sort("created_at", -1).to_list(1000)
+        return [TemplateVersion(**{**version, "saved_at": version["created_at"]}) for version in versions]
+    versions = await db.template_versions.find(
+        {"id": {"$in": list({entry["version_id"] for entry in history})}}, {"_id": 0}
+    ).to_list(None)
+    by_id = {version["id"]: version for version in versions}
+    return [
+        TemplateVersion(**{**by_id[entry["version_id"]], "saved_at": entry["saved_at"]})
+        for entry in history if entry["version_id"] in by_id
+    ]
+
+@api_router.get("/workout-templates/{template_id}/versions", response_model=List[TemplateVersion])
+async def get_workout_template_versions(template_id: str, current_user: User = Depends(get_current_owner_or_staff)):
+    """Version history of a workout template, newest first"""
+    return await list_template_versions("workout", template_id, current_user.gym_id)
+
+@api_router.get("/diet-templates/{template_id}/versions", response_model=List[TemplateVersion])
+async def get_diet_template_versions(template_id: str, current_user: User = Depends(get_current_owner_or_staff)):
+    """Version history of a diet template, newest first"""
+    return await list_template_versions("diet", template_id, current_user.gym_id)
+
+# Batch Template Routes
+MAX_BATCH_TEMPLATES = 100
+
+@api_router.get("/templates/batch", response_model=TemplateBatch)
+async def get_templates_batch(ids: str = Query(..., description="Comma separated workout and/or diet template ids"),
+                              current_user: User = Depends(get_current_user)):
+    """Resolve many workout and diet templates in one call"""
+    template_ids = list(dict.fromkeys(template_id.strip() for template_id in ids.split(",") if template_id.strip()))
+    if len(template_ids) > MAX_BATCH_TEMPLATES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TEMPLATES} templates per request")
+    if not current_user.gym_id:
+        return TemplateBatch(missing=template_ids)
+    
+    found = await template_cache.get_many(current_user.gym_id, template_ids)
+    batch = TemplateBatch(missing=[template_id for template_id in template_ids if template_id not in found])
+    for template_id, (kind, template) in found.items():
+        if kind == "workout":
+            batch.workout_templates[template_id] = WorkoutTemplate(**template)
+        else:
+            batch.diet_templates[template_id] = DietTemplate(**template)
+    return batch
+
 # Workout Template Routes
 @api_router.post("/workout-templates", response_model=WorkoutTemplate)
 async def create_workout_template(template_data: WorkoutTemplateCreate, current_user: User = Depends(get_current_owner_or_staff)):
@@ -1556,6 +4326,7 @@ async def create_workout_template(template_data: WorkoutTemplateCreate, current_
         gym_id=current_user.gym_id,
         created_by=current_user.name
     )
+    template.current_version = await save_template_version("workout", template.dict())
     
     await db.workout_templates.insert_one(template.dict())
     return template
@@ -1594,12 +4365,15 @@ async def update_workout_template(template_id: str, template_update: WorkoutTemp
     if not template:
         raise HTTPException(status_code=404, detail="Workout template not found")
     
-    await db.workout_templates.update_one(
+    # Edits create a new version; assignments keep pointing at the one they were made against
+    version_id = await save_template_version("workout", {**template, **template_update.dict()})
+    updated_template = await db.workout_templates.find_one_and_update(
         {"id": template_id},
-        {"$set": template_update.dict()}
+        {"$set": {**template_update.dict(), "current_version": version_id}},
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_template = await db.workout_templates.find_one({"id": template_id})
+    # After the write, so a load that read the old document cannot keep it cached
+    template_cache.invalidate(template_id)
     return WorkoutTemplate(**updated_template)
 
 @api_router.delete("/workout-templates/{template_id}")
@@ -1608,6 +4382,7 @@ async def delete_workout_template(template_id: str, current_user: User = Depends
         {"id": template_id, "gym_id": current_user.gym_id},
         {"$set": {"is_active": False}}
     )
+    template_cache.invalidate(template_id)
     return {"message": "Workout template deleted successfully"}
 
 # Diet Template Routes
@@ -1621,6 +4396,7 @@ async def create_diet_template(template_data: DietTemplateCreate, current_user:
         gym_id=current_user.gym_id,
         created_by=current_user.name
     )
+    template.current_version = await save_template_version("diet", template.dict())
     
     await db.diet_templates.insert_one(template.dict())
     return template
@@ -1659,12 +4435,15 @@ async def update_diet_template(template_id: str, template_update: DietTemplateCr
     if not template:
         raise HTTPException(status_code=404, detail="Diet template not found")
     
-    await db.diet_templates.update_one(
+    # Edits create a new version; assignments keep pointing at the one they were made against
+    version_id = await save_template_version("diet", {**template, **template_update.dict()})
+    updated_template = await db.diet_templates.find_one_and_update(
         {"id": template_id},
-        {"$set": template_update.dict()}
+        {"$set": {**template_update.dict(), "current_version": version_id}},
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_template = await db.diet_templates.find_one({"id": template_id})
+    # After the write, so a load that read the old document cannot keep it cached
+    template_cache.invalidate(template_id)
     return DietTemplate(**updated_template)
 
 @api_router.delete("/diet-templates/{template_id}")
@@ -1673,6 +4452,7 @@ async def delete_diet_template(template_id: str, current_user: User = Depends(ge
         {"id": template_id, "gym_id": current_user.gym_id},
         {"$set": {"is_active": False}}
     )
+    template_cache.invalidate(template_id)
     return {"message": "Diet template deleted successfully"}
 
 # Plan Assignment Routes
@@ -1710,6 +4490,8 @@ async def assign_plan_to_member(assignment_data: PlanAssignmentCreate, current_u
     if not plan:
         raise HTTPException(status_code=404, detail=f"{assignment_data.plan_type.title()} plan not found")
     
+    plan_version = await ensure_template_version(assignment_data.plan_type, plan)
+    
     assignment = MemberPlanAssignment(
         gym_id=current_user.gym_id,
         member_id=assignment_data.member_id,
@@ -1717,6 +4499,7 @@ async def assign_plan_to_member(assignment_data: PlanAssignmentCreate, current_u
         plan_type=assignment_data.plan_type,
         plan_id=assignment_data.plan_id,
         plan_name=plan_name,
+        plan_version=plan_version,
         assigned_by=current_user.name,
         start_date=assignment_data.start_date or datetime.utcnow(),
         end_date=assignment_data.end_date,
@@ -1779,6 +4562,168 @@ async def remove_plan_assignment(assignment_id: str, current_user: User = Depend
     return {"message": "Plan assignment removed successfully"}
 
 # Progress Tracking Routes
+MAX_SYNC_ITEMS = 500
+PROGRESS_COLLECTIONS = {"workout": "workout_progress", "diet": "diet_progress"}
+
+def build_workout_progress(gym_id: str, member: dict, assignment: dict, progress_data: WorkoutProgressCreate,
+                           idempotency_key: Optional[str] = None) -> WorkoutProgress:
+    return WorkoutProgress(
+        gym_id=gym_id,
+        member_id=member["id"],
+        assignment_id=progress_data.assignment_id,
+        workout_template_id=assignment["plan_id"],
+        workout_name=assignment["plan_name"],
+        template_version=assignment.get("plan_version"),
+        scheduled_date=progress_data.scheduled_date,
+        completed_at=datetime.utcnow() if progress_data.status == "completed" else None,
+        duration_minutes=progress_data.duration_minutes,
+        exercises_progress=progress_data.exercises_progress,
+        overall_rating=progress_data.overall_rating,
+        notes=progress_data.notes,
+        status=progress_data.status,
+        idempotency_key=idempotency_key
+    )
+
+def build_diet_progress(gym_id: str, member: dict, assignment: dict, progress_data: DietProgressCreate,
+                        template: dict, idempotency_key: Optional[str] = None) -> DietProgress:
+    return DietProgress(
+        gym_id=gym_id,
+        member_id=member["id"],
+        assignment_id=progress_data.assignment_id,
+        diet_template_id=assignment["plan_id"],
+        diet_name=assignment["plan_name"],
+        template_version=assignment.get("plan_version"),
+        date=progress_data.date,
+        meals_progress=progress_data.meals_progress,
+        total_calories_consumed=progress_data.total_calories_consumed,
+        water_intake_liters=progress_data.water_intake_liters,
+        overall_rating=progress_data.overall_rating,
+        notes=progress_data.notes,
+        status="completed",
+        adherence=compute_diet_adherence(progress_data, template),
+        idempotency_key=idempotency_key
+    )
+
+async def upsert_progress_records(kind: str, records: List[dict]) -> tuple:
+    """Insert records keyed by (member_id, idempotency_key) unless already present.
+    Returns (created records, records that already existed as stored)."""
+    collection = db[PROGRESS_COLLECTIONS[kind]]
+    created_indexes = set()
+    try:
+        result = await collection.bulk_write([
+            UpdateOne(
+                {"member_id": record["member_id"], "idempotency_key": record["idempotency_key"]},
+                {"$setOnInsert": record},
+                upsert=True
+            )
+            for record in records
+        ], ordered=False)
+        created_indexes = set(result.upserted_ids)
+    except BulkWriteError as e:
+        # A concurrent flush of the same key loses the unique-index race; that item is a duplicate
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        created_indexes = {upsert["index"] for upsert in e.details.get("upserted", [])}
+
+    created = [record for index, record in enumerate(records) if index in created_indexes]
+    duplicate_keys = [record["idempotency_key"] for index, record in enumerate(records) if index not in created_indexes]
+    existing = []
+    if duplicate_keys:
+        existing = await collection.find(
+            {"member_id": records[0]["member_id"], "idempotency_key": {"$in": duplicate_keys}},
+            {"_id": 0, "id": 1, "idempotency_key": 1}
+        ).to_list(None)
+    return created, existing
+
+@api_router.post("/progress/sync", response_model=ProgressSyncReport)
+async def sync_progress(sync_request: ProgressSyncRequest, current_user: User = Depends(get_current_user)):
+    """Flush a queue of offline workout and diet logs; safe to retry with the same keys"""
+    if current_user.role != UserRole.MEMBER:
+        raise HTTPException(status_code=403, detail="Only members can log progress")
+    if len(sync_request.items) > MAX_SYNC_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SYNC_ITEMS} items per sync")
+    
+    member = await db.members.find_one({
+        "email": current_user.email,
+        "gym_id": current_user.gym_id
+    })
+    
+    if not member:
+        raise HTTPException(status_code=404, detail="Member profile not found")
+    
+    results = {}
+    parsed = []
+    seen_keys = set()
+    for item in sync_request.items:
+        key = item.idempotency_key
+        # A key queued twice is the same entry retried; the first copy wins
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        if item.kind not in PROGRESS_COLLECTIONS:
+            results[key] = ProgressSyncItemResult(
+                idempotency_key=key, kind=item.kind, status="failed", error="Kind must be 'workout' or 'diet'"
+            )
+            continue
+        try:
+            entry = (WorkoutProgressCreate if item.kind == "workout" else DietProgressCreate)(**item.entry)
+        except ValueError as e:
+            results[key] = ProgressSyncItemResult(idempotency_key=key, kind=item.kind, status="failed", error=str(e))
+            continue
+        parsed.append((key, item.kind, entry))
+
+    # One query for every referenced assignment, one per template collection
+    assignments = await db.plan_assignments.find({
+        "id": {"$in": list({entry.assignment_id for _, _, entry in parsed})},
+        "member_id": member["id"],
+        "is_active": True
+    }, {"_id": 0}).to_list(None)
+    # Logs are scored against the plan as assigned, not the template's current content
+    plans = await load_assigned_plans(current_user.gym_id, assignments)
+    assignments = {assignment["id"]: assignment for assignment in assignments}
+
+    records = {"workout": [], "diet": []}
+    for key, kind, entry in parsed:
+        assignment = assignments.get(entry.assignment_id)
+        if not assignment or assignment["plan_type"] != kind:
+            error = f"{kind.title()} assignment not found"
+        elif assignment["id"] not in plans:
+            error = f"{kind.title()} template not found"
+        else:
+            if kind == "workout":
+                progress = build_workout_progress(current_user.gym_id, member, assignment, entry, idempotency_key=key)
+            else:
+                progress = build_diet_progress(current_user.gym_id, member, assignment, entry,
+                                               plans[assignment["id"]], idempotency_key=key)
+            records[kind].append(progress.dict())
+            continue
+        results[key] = ProgressSyncItemResult(idempotency_key=key, kind=kind, status="failed", error=error)
+
+    for kind, kind_records in records.items():
+        if not kind_records:
+            continue
+        created, existing = await upsert_progress_records(kind, kind_records)
+        if kind == "workout":
+            await record_exercise_logs(created)
+        else:
+            await record_diet_adherence(created)
+        for record in created:
+            results[record["idempotency_key"]] = ProgressSyncItemResult(
+                idempotency_key=record["idempotency_key"], kind=kind, status="created", id=record["id"]
+            )
+        for record in existing:
+            results[record["idempotency_key"]] = ProgressSyncItemResult(
+                idempotency_key=record["idempotency_key"], kind=kind, status="duplicate", id=record["id"]
+            )
+
+    ordered_results = [results[key] for key in dict.fromkeys(item.idempotency_key for item in sync_request.items) if key in results]
+    return ProgressSyncReport(
+        created=sum(1 for result in ordered_results if result.status == "created"),
+        duplicates=sum(1 for result in ordered_results if result.status == "duplicate"),
+        failed=sum(1 for result in ordered_results if result.status == "failed"),
+        results=ordered_results
+    )
+
 @api_router.post("/workout-progress", response_model=WorkoutProgress)
 async def log_workout_progress(progress_data: WorkoutProgressCreate, current_user: User = Depends(get_current_user)):
     """Log workout progress for a member"""
@@ -1813,22 +4758,9 @@ async def log_workout_progress(progress_data: WorkoutProgressCreate, current_use
     if not workout_template:
         raise HTTPException(status_code=404, detail="Workout template not found")
     
-    progress = WorkoutProgress(
-        gym_id=current_user.gym_id,
-        member_id=member["id"],
-        assignment_id=progress_data.assignment_id,
-        workout_template_id=assignment["plan_id"],
-        workout_name=assignment["plan_name"],
-        scheduled_date=progress_data.scheduled_date,
-        completed_at=datetime.utcnow() if progress_data.status == "completed" else None,
-        duration_minutes=progress_data.duration_minutes,
-        exercises_progress=progress_data.exercises_progress,
-        overall_rating=progress_data.overall_rating,
-        notes=progress_data.notes,
-        status=progress_data.status
-    )
-    
+    progress = build_workout_progress(current_user.gym_id, member, assignment, progress_data)
     await db.workout_progress.insert_one(progress.dict())
+    await record_exercise_logs([progress.dict()])
     return progress
 
 @api_router.post("/diet-progress", response_model=DietProgress)
@@ -1857,99 +4789,682 @@ async def log_diet_progress(progress_data: DietProgressCreate, current_user: Use
     if not assignment:
         raise HTTPException(status_code=404, detail="Diet assignment not found")
     
-    # Get diet template details
-    diet_template = await db.diet_templates.find_one({
-        "id": assignment["plan_id"]
-    })
+    # Score against the diet plan as it was assigned
+    diet_plan = (await load_assigned_plans(current_user.gym_id, [assignment])).get(assignment["id"])
     
-    if not diet_template:
+    if not diet_plan:
         raise HTTPException(status_code=404, detail="Diet template not found")
     
-    progress = DietProgress(
-        gym_id=current_user.gym_id,
-        member_id=member["id"],
-        assignment_id=progress_data.assignment_id,
-        diet_template_id=assignment["plan_id"],
-        diet_name=assignment["plan_name"],
-        date=progress_data.date,
-        meals_progress=progress_data.meals_progress,
-        total_calories_consumed=progress_data.total_calories_consumed,
-        water_intake_liters=progress_data.water_intake_liters,
-        overall_rating=progress_data.overall_rating,
-        notes=progress_data.notes,
-        status="completed"
-    )
-    
+    progress = build_diet_progress(current_user.gym_id, member, assignment, progress_data, diet_plan)
     await db.diet_progress.insert_one(progress.dict())
+    await record_diet_adherence([progress.dict()])
     return progress
 
-@api_router.get("/workout-progress/my", response_model=List[WorkoutProgress])
-async def get_my_workout_progress(current_user: User = Depends(get_current_user)):
-    """Get current member's workout progress"""
+# Progress History
+# History endpoints page newest-first with an opaque (date, id) keyset cursor
+# returned in the X-Next-Cursor header, served by the (member_id, gym_id,
+# date, id) indexes. Without limit or cursor they return what they did
+# before paging (up to UNPAGED_HISTORY_LIMIT records, plus a cursor if more
+# remain). summary=true drops the nested exercise and meal arrays.
+PROGRESS_HISTORY_DEFAULT_LIMIT = 100
+PROGRESS_HISTORY_MAX_LIMIT = 500
+PROGRESS_HISTORY = {
+    "workout": ("workout_progress", "scheduled_date", WorkoutProgress, "exercises_progress"),
+    "diet": ("diet_progress", "date", DietProgress, "meals_progress"),
+}
+
+async def progress_history_response(kind: str, member_id: str, gym_id: str, date_from: Optional[datetime],
+                                    date_to: Optional[datetime], limit: Optional[int], cursor: Optional[str], summary: bool):
+    collection_name, date_field, model, nested_field = PROGRESS_HISTORY[kind]
+    projection = {"_id": 0, nested_field: 0} if summary else {"_id": 0}
+    records, next_cursor = await fetch_keyset_page(
+        db[collection_name], {"member_id": member_id, "gym_id": gym_id}, date_field,
+        date_from, date_to, history_page_size(limit, cursor, PROGRESS_HISTORY_DEFAULT_LIMIT), cursor, projection
+    )
+    exclude = {nested_field} if summary else None
+    return JSONResponse(
+        content=[jsonable_encoder(model(**record), exclude=exclude) for record in records],
+        headers={"X-Next-Cursor": next_cursor} if next_cursor else {}
+    )
+
+async def get_member_id_for_user(current_user: User) -> str:
     if current_user.role != UserRole.MEMBER:
         raise HTTPException(status_code=403, detail="Only members can access this endpoint")
     
     member = await db.members.find_one({
         "email": current_user.email,
         "gym_id": current_user.gym_id
-    })
+    }, {"id": 1})
     
     if not member:
         raise HTTPException(status_code=404, detail="Member profile not found")
-    
-    progress_records = await db.workout_progress.find({
-        "member_id": member["id"],
-        "gym_id": current_user.gym_id
-    }).sort("scheduled_date", -1).to_list(1000)
-    
-    return [WorkoutProgress(**record) for record in progress_records]
+    return member["id"]
+
+@api_router.get("/workout-progress/my", response_model=List[WorkoutProgress])
+async def get_my_workout_progress(
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PROGRESS_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    summary: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Get current member's workout progress"""
+    member_id = await get_member_id_for_user(current_user)
+    return await progress_history_response(
+        "workout", member_id, current_user.gym_id, date_from, date_to, limit, cursor, summary
+    )
 
 @api_router.get("/diet-progress/my", response_model=List[DietProgress])
-async def get_my_diet_progress(current_user: User = Depends(get_current_user)):
+async def get_my_diet_progress(
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PROGRESS_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    summary: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     """Get current member's diet progress"""
-    if current_user.role != UserRole.MEMBER:
-        raise HTTPException(status_code=403, detail="Only members can access this endpoint")
-    
-    member = await db.members.find_one({
-        "email": current_user.email,
-        "gym_id": current_user.gym_id
-    })
-    
-    if not member:
-        raise HTTPException(status_code=404, detail="Member profile not found")
-    
-    progress_records = await db.diet_progress.find({
-        "member_id": member["id"],
-        "gym_id": current_user.gym_id
-    }).sort("date", -1).to_list(1000)
-    
-    return [DietProgress(**record) for record in progress_records]
+    member_id = await get_member_id_for_user(current_user)
+    return await progress_history_response(
+        "diet", member_id, current_user.gym_id, date_from, date_to, limit, cursor, summary
+    )
 
 @api_router.get("/member-progress/{member_id}/workout", response_model=List[WorkoutProgress])
-async def get_member_workout_progress(member_id: str, current_user: User = Depends(get_current_owner_or_staff)):
+async def get_member_workout_progress(
+    member_id: str,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PROGRESS_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    summary: bool = False,
+    current_user: User = Depends(get_current_owner_or_staff)
+):
     """Get workout progress for a specific member (for gym owners/staff)"""
     if not current_user.gym_id:
         return []
     
-    progress_records = await db.workout_progress.find({
-        "member_id": member_id,
-        "gym_id": current_user.gym_id
-    }).sort("scheduled_date", -1).to_list(1000)
-    
-    return [WorkoutProgress(**record) for record in progress_records]
+    return await progress_history_response(
+        "workout", member_id, current_user.gym_id, date_from, date_to, limit, cursor, summary
+    )
 
 @api_router.get("/member-progress/{member_id}/diet", response_model=List[DietProgress])
-async def get_member_diet_progress(member_id: str, current_user: User = Depends(get_current_owner_or_staff)):
+async def get_member_diet_progress(
+    member_id: str,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1, le=PROGRESS_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    summary: bool = False,
+    current_user: User = Depends(get_current_owner_or_staff)
+):
     """Get diet progress for a specific member (for gym owners/staff)"""
     if not current_user.gym_id:
         return []
     
-    progress_records = await db.diet_progress.find({
-        "member_id": member_id,
-        "gym_id": current_user.gym_id
-    }).sort("date", -1).to_list(1000)
+    return await progress_history_response(
+        "diet", member_id, current_user.gym_id, date_from, date_to, limit, cursor, summary
+    )
+
+# Diet Adherence
+# Each diet log carries macro totals and ratios against its template,
+# computed when it is written. diet_adherence_weekly keeps running sums per
+# member per plan per ISO week, so member and plan dashboards read rollups.
+MACROS = ("calories", "protein", "carbs", "fat")
+TEMPLATE_TARGET_FIELDS = {"calories": "total_calories", "protein": "protein_target", "carbs": "carbs_target", "fat": "fat_target"}
+
+def compute_diet_adherence(progress_data: DietProgressCreate, template: dict) -> DietAdherence:
+    planned_meals = {meal["meal_type"].lower(): meal for meal in template.get("meals", [])}
+    planned_totals = dict.fromkeys(MACROS, 0.0)
+    for meal in planned_meals.values():
+        for item in meal.get("items", []):
+            for macro in MACROS:
+                planned_totals[macro] += item.get(macro) or 0
+
+    consumed = dict.fromkeys(MACROS, 0.0)
+    meal_calories = 0.0
+    for meal_progress in progress_data.meals_progress:
+        planned_items = {
+            item["food_name"].lower(): item
+            for item in planned_meals.get(meal_progress.meal_type.lower(), {}).get("items", [])
+        }
+        eaten = [planned_items[name.lower()] for name in meal_progress.items_consumed if name.lower() in planned_items]
+        for macro in MACROS:
+            consumed[macro] += sum(item.get(macro) or 0 for item in eaten)
+        meal_calories += meal_progress.total_calories if meal_progress.total_calories is not None else sum(
+            item.get("calories") or 0 for item in eaten
+        )
+    # Calories the member reported win over what we can infer from the plan's items
+    consumed["calories"] = float(progress_data.total_calories_consumed) if progress_data.total_calories_consumed is not None else meal_calories
+
+    values = {}
+    scores = []
+    for macro in MACROS:
+        target = template.get(TEMPLATE_TARGET_FIELDS[macro]) or planned_totals[macro] or None
+        ratio = round(consumed[macro] / target, 3) if target else None
+        values.update({macro: round(consumed[macro], 1), f"{macro}_target": target, f"{macro}_ratio": ratio})
+        if ratio is not None:
+            scores.append(max(0.0, 1 - abs(1 - ratio)))
+
+    meals_logged = sum(1 for meal in progress_data.meals_progress if meal.items_consumed or meal.total_calories)
+    meals_planned = len(planned_meals)
+    if meals_planned:
+        scores.append(min(1.0, meals_logged / meals_planned))
+    return DietAdherence(
+        **values,
+        meals_logged=meals_logged,
+        meals_planned=meals_planned,
+        score=round(sum(scores) / len(scores), 3) if scores else 0.0
+    )
+
+async def record_diet_adherence(progress_records: List[dict]):
+    """Fold diet logs into the weekly per-member rollups"""
+    updates = []
+    for progress in progress_records:
+        adherence = progress.get("adherence")
+        if not adherence:
+            continue
+        increments = {"entries": 1, "score_sum": adherence["score"]}
+        for macro in MACROS:
+            increments[f"{macro}_sum"] = adherence[macro]
+        if adherence["calories_ratio"] is not None:
+            increments["calories_ratio_sum"] = adherence["calories_ratio"]
+            increments["calories_ratio_entries"] = 1
+        updates.append(UpdateOne(
+            {"member_id": progress["member_id"], "diet_template_id": progress["diet_template_id"], "week": iso_week(progress["date"])},
+            {
+                "$setOnInsert": {"gym_id": progress["gym_id"]},
+                "$set": {"diet_name": progress["diet_name"]},
+                "$inc": increments
+            },
+            upsert=True
+        ))
+    if updates:
+        await db.diet_adherence_weekly.bulk_write(updates, ordered=False)
+
+def recent_iso_weeks(weeks: int) -> List[str]:
+    now = datetime.utcnow()
+    return [iso_week(now - timedelta(weeks=offset)) for offset in range(weeks - 1, -1, -1)]
+
+def to_adherence_week(week: str, rollup: Optional[dict]) -> DietAdherenceWeek:
+    if not rollup or not rollup.get("entries"):
+        return DietAdherenceWeek(week=week, entries=0)
+    entries = rollup["entries"]
+    ratio_entries = rollup.get("calories_ratio_entries", 0)
+    return DietAdherenceWeek(
+        week=week,
+        entries=entries,
+        average_score=round(rollup.get("score_sum", 0) / entries, 3),
+        average_calories=round(rollup.get("calories_sum", 0) / entries, 1),
+        average_protein=round(rollup.get("protein_sum", 0) / entries, 1),
+        average_calories_ratio=round(rollup["calories_ratio_sum"] / ratio_entries, 3) if ratio_entries else None
+    )
+
+def group_member_adherence(rollups: List[dict], week_keys: List[str]) -> List[MemberDietAdherence]:
+    grouped = {}
+    for rollup in rollups:
+        grouped.setdefault((rollup["member_id"], rollup["diet_template_id"]), {})[rollup["week"]] = rollup
+    return [
+        MemberDietAdherence(
+            member_id=member_id,
+            diet_template_id=template_id,
+            diet_name=next(iter(by_week.values()))["diet_name"],
+            weeks=[to_adherence_week(week, by_week.get(week)) for week in week_keys]
+        )
+        for (member_id, template_id), by_week in grouped.items()
+    ]
+
+async def load_member_diet_adherence(member_id: str, weeks: int) -> List[MemberDietAdherence]:
+    week_keys = recent_iso_weeks(weeks)
+    rollups = await db.diet_adherence_weekly.find(
+        {"member_id": member_id, "week": {"$in": week_keys}}, {"_id": 0}
+    ).to_list(None)
+    return group_member_adherence(rollups, week_keys)
+
+@api_router.get("/diet-adherence/my", response_model=List[MemberDietAdherence])
+async def get_my_diet_adherence(weeks: int = Query(8, ge=1, le=52), current_user: User = Depends(get_current_user)):
+    """Weekly diet adherence for the current member, per diet plan"""
+    if current_user.role != UserRole.MEMBER:
+        raise HTTPException(status_code=403, detail="Only members can access this endpoint")
+    
+    member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member profile not found")
     
-    return [DietProgress(**record) for record in progress_records]
+    return await load_member_diet_adherence(member["id"], weeks)
+
+@api_router.get("/diet-adherence/member/{member_id}", response_model=List[MemberDietAdherence])
+async def get_member_diet_adherence(member_id: str, weeks: int = Query(8, ge=1, le=52),
+                                    current_user: User = Depends(get_current_owner_or_staff)):
+    """Weekly diet adherence for one member, per diet plan"""
+    member = await db.members.find_one({"id": member_id, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    return await load_member_diet_adherence(member_id, weeks)
+
+@api_router.get("/diet-adherence/plans/{template_id}", response_model=DietPlanAdherence)
+async def get_diet_plan_adherence(template_id: str, weeks: int = Query(8, ge=1, le=52),
+                                  current_user: User = Depends(get_current_owner_or_staff)):
+    """Weekly adherence across every member following a diet plan"""
+    template = await db.diet_templates.find_one({"id": template_id, "gym_id": current_user.gym_id}, {"name": 1})
+    if not template:
+        raise HTTPException(status_code=404, detail="Diet template not found")
+    
+    week_keys = recent_iso_weeks(weeks)
+    rollups = await db.diet_adherence_weekly.find(
+        {"diet_template_id": template_id, "gym_id": current_user.gym_id, "week": {"$in": week_keys}}, {"_id": 0}
+    ).to_list(None)
+
+    plan_weeks = {}
+    for rollup in rollups:
+        totals = plan_weeks.setdefault(rollup["week"], {})
+        for field in ("entries", "score_sum", "calories_sum", "protein_sum", "calories_ratio_sum", "calories_ratio_entries"):
+            totals[field] = totals.get(field, 0) + rollup.get(field, 0)
+    return DietPlanAdherence(
+        diet_template_id=template_id,
+        diet_name=template["name"],
+        weeks=[to_adherence_week(week, plan_weeks.get(week)) for week in week_keys],
+        members=group_member_adherence(rollups, week_keys)
+    )
+
+# Exercise Analytics
+# Completed workouts are flattened into exercise_logs (one document per set
+# with numeric weight in kg) and folded into exercise_stats, one document
+# per member per exercise with totals, the best set and weekly volume.
+LB_TO_KG = 0.45359237
+WEIGHT_PATTERN = re.compile(r'^\s*(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>kgs?|kilos?|lbs?|pounds?)?\s*$', re.IGNORECASE)
+BODYWEIGHT_WORDS = {"bodyweight", "body weight", "bw", "none", ""}
+
+def parse_weight(text: Optional[str]) -> tuple:
+    """Parse "50kg", "110 lbs", "bodyweight"... into (value, unit, kg); unparseable weights give (None, None, None)"""
+    cleaned = (text or "").strip().lower()
+    if cleaned in BODYWEIGHT_WORDS:
+        return 0.0, "bodyweight", 0.0
+    match = WEIGHT_PATTERN.match(cleaned)
+    if not match:
+        return None, None, None
+    value = float(match.group("value"))
+    if (match.group("unit") or "kg").startswith(("lb", "pound")):
+        return value, "lb", round(value * LB_TO_KG, 2)
+    return value, "kg", value
+
+def estimate_one_rep_max(weight_kg: float, reps: int) -> float:
+    # Epley formula
+    return round(weight_kg if reps == 1 else weight_kg * (1 + reps / 30), 2)
+
+def iso_week(value: datetime) -> str:
+    year, week, _ = value.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def exercise_key(name: str) -> str:
+    return " ".join(name.lower().split())
+
+def flatten_exercise_sets(progress: dict) -> List[dict]:
+    performed_at = progress.get("completed_at") or progress["scheduled_date"]
+    logs = []
+    for exercise in progress.get("exercises_progress", []):
+        weights = exercise.get("weights_used") or []
+        for set_index, reps in enumerate(exercise.get("completed_reps") or []):
+            if not reps or reps <= 0:
+                continue
+            # Clients often log one weight for every set
+            weight_text = weights[set_index] if set_index < len(weights) else (weights[-1] if weights else None)
+            weight, unit, weight_kg = parse_weight(weight_text)
+            logs.append({
+                "id": str(uuid.uuid4()),
+                "gym_id": progress["gym_id"],
+                "member_id": progress["member_id"],
+                "progress_id": progress["id"],
+                "exercise_name": exercise["exercise_name"].strip(),
+                "exercise_key": exercise_key(exercise["exercise_name"]),
+                "set_number": set_index + 1,
+                "reps": reps,
+                "weight": weight,
+                "unit": unit,
+                "weight_kg": weight_kg,
+                "weight_text": weight_text,
+                "volume_kg": round((weight_kg or 0) * reps, 2),
+                "estimated_1rm_kg": estimate_one_rep_max(weight_kg, reps) if weight_kg else None,
+                "performed_at": performed_at,
+                "week": iso_week(performed_at)
+            })
+    return logs
+
+async def record_exercise_logs(progress_records: List[dict]):
+    """Store the sets of completed workouts and fold them into per-exercise stats"""
+    logs = [
+        log for progress in progress_records if progress.get("status") == "completed"
+        for log in flatten_exercise_sets(progress)
+    ]
+    if not logs:
+        return
+    await db.exercise_logs.insert_many(logs, ordered=False)
+
+    grouped = {}
+    for log in logs:
+        grouped.setdefault((log["member_id"], log["exercise_key"]), []).append(log)
+
+    updates = []
+    for (member_id, key), sets in grouped.items():
+        weekly = {}
+        for log in sets:
+            weekly[log["week"]] = weekly.get(log["week"], 0) + log["volume_kg"]
+        updates.append(UpdateOne(
+            {"member_id": member_id, "exercise_key": key},
+            {
+                "$setOnInsert": {"gym_id": sets[0]["gym_id"]},
+                "$set": {"exercise_name": sets[-1]["exercise_name"]},
+                "$inc": {
+                    "sets": len(sets),
+                    "total_reps": sum(log["reps"] for log in sets),
+                    "total_volume_kg": round(sum(log["volume_kg"] for log in sets), 2),
+                    **{f"weekly_volume_kg.{week}": round(volume, 2) for week, volume in weekly.items()}
+                },
+                "$max": {
+                    "best_weight_kg": max(log["weight_kg"] or 0 for log in sets),
+                    "last_performed_at": max(log["performed_at"] for log in sets)
+                }
+            },
+            upsert=True
+        ))
+        best = max((log for log in sets if log["estimated_1rm_kg"]), key=lambda log: log["estimated_1rm_kg"], default=None)
+        if best:
+            # Only replaces the stored best set when this one is heavier
+            updates.append(UpdateOne(
+                {
+                    "member_id": member_id,
+                    "exercise_key": key,
+                    "$or": [
+                        {"best_set": {"$exists": False}},
+                        {"best_set.estimated_1rm_kg": {"$lt": best["estimated_1rm_kg"]}}
+                    ]
+                },
+                {"$set": {"best_set": {
+                    "weight_kg": best["weight_kg"],
+                    "reps": best["reps"],
+                    "estimated_1rm_kg": best["estimated_1rm_kg"],
+                    "performed_at": best["performed_at"]
+                }}}
+            ))
+    await db.exercise_stats.bulk_write(updates, ordered=True)
+
+def to_exercise_stats(stats: dict, weeks: int) -> ExerciseStats:
+    weekly = stats.get("weekly_volume_kg", {})
+    return ExerciseStats(
+        exercise_name=stats["exercise_name"],
+        sets=stats.get("sets", 0),
+        total_reps=stats.get("total_reps", 0),
+        total_volume_kg=stats.get("total_volume_kg", 0),
+        best_weight_kg=stats.get("best_weight_kg", 0),
+        best_set=stats.get("best_set"),
+        last_performed_at=stats.get("last_performed_at"),
+        weekly_volume=[WeeklyVolume(week=week, volume_kg=weekly.get(week, 0)) for week in recent_iso_weeks(weeks)]
+    )
+
+async def load_exercise_stats(member_id: str, weeks: int) -> List[ExerciseStats]:
+    stats = await db.exercise_stats.find({"member_id": member_id}, {"_id": 0}).sort("last_performed_at", -1).to_list(500)
+    return [to_exercise_stats(entry, weeks) for entry in stats]
+
+@api_router.get("/progress/exercises/my", response_model=List[ExerciseStats])
+async def get_my_exercise_stats(weeks: int = Query(12, ge=1, le=104), current_user: User = Depends(get_current_user)):
+    """Personal records and weekly volume per exercise for the current member"""
+    if current_user.role != UserRole.MEMBER:
+        raise HTTPException(status_code=403, detail="Only members can access this endpoint")
+    
+    member = await db.members.find_one({"email": current_user.email, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member profile not found")
+    
+    return await load_exercise_stats(member["id"], weeks)
+
+@api_router.get("/progress/exercises/member/{member_id}", response_model=List[ExerciseStats])
+async def get_member_exercise_stats(member_id: str, weeks: int = Query(12, ge=1, le=104),
+                                    current_user: User = Depends(get_current_owner_or_staff)):
+    """Personal records and weekly volume per exercise for one member"""
+    member = await db.members.find_one({"id": member_id, "gym_id": current_user.gym_id}, {"id": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    
+    return await load_exercise_stats(member_id, weeks)
+
+@api_router.post("/progress/exercises/rebuild")
+async def rebuild_exercise_stats(current_user: User = Depends(get_current_owner)):
+    """Recreate exercise logs and stats for the gym from stored workout progress"""
+    if not current_user.gym_id:
+        raise HTTPException(status_code=400, detail="No gym associated with user")
+    
+    await asyncio.gather(
+        db.exercise_logs.delete_many({"gym_id": current_user.gym_id}),
+        db.exercise_stats.delete_many({"gym_id": current_user.gym_id})
+    )
+    replayed = 0
+    cursor = db.workout_progress.find(
+        {"gym_id": current_user.gym_id, "status": "completed"}, {"_id": 0}
+    ).sort("scheduled_date", 1)
+    batch = await cursor.to_list(500)
+    while batch:
+        await record_exercise_logs(batch)
+        replayed += len(batch)
+        batch = await cursor.to_list(500)
+    return {"message": "Exercise stats rebuilt", "workouts": replayed}
+
+# Membership Scheduler
+SCHEDULER_INTERVAL_SECONDS = 60
+SCHEDULER_LEASE_SECONDS = 180
+SCHEDULER_BATCH_SIZE = 500
+EXPIRING_SOON_DAYS = 7
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+async def acquire_lease(name: str, ttl_seconds: int = SCHEDULER_LEASE_SECONDS) -> bool:
+    """Take or renew a named lease; only one worker holds it until it expires"""
+    now = datetime.utcnow()
+    try:
+        lease = await db.scheduler_leases.find_one_and_update(
+            {"_id": name, "$or": [{"holder": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"holder": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_seconds), "renewed_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker holds an unexpired lease, so the upsert collided with it
+        return False
+    return lease is not None and lease["holder"] == WORKER_ID
+
+async def run_once(name: str, migrate) -> bool:
+    """Run a one-time backfill under a lease and record it in `migrations`; the backfill must be idempotent"""
+    if await db.migrations.find_one({"_id": name}):
+        return False
+    if not await acquire_lease(name):
+        return False
+    if await db.migrations.find_one({"_id": name}):
+        return False
+    await migrate()
+    await db.migrations.update_one({"_id": name}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True)
+    logging.getLogger(__name__).info(f"Backfill {name} completed")
+    return True
+
+async def process_membership_transitions(now: Optional[datetime] = None) -> dict:
+    """Expire or auto-renew active memberships whose end_date has passed.
+
+    Works through the (membership_status, end_date) index in batches. Each
+    update is conditional on the end_date it read, so a pass that overlaps
+    with another (or with a manual edit) never applies a transition twice.
+    A membership that lapsed several periods ago is moved to the first
+    period end after `now` and billed once, for the current period.
+    """
+    now = now or datetime.utcnow()
+    expired = renewed = billed = 0
+
+    while True:
+        members = await db.members.find(
+            {"membership_status": MembershipStatus.ACTIVE.value, "end_date": {"$lte": now}},
+            {"_id": 0, "id": 1, "gym_id": 1, "name": 1, "plan_id": 1, "end_date": 1, "auto_renewal": 1}
+        ).sort("end_date", 1).limit(SCHEDULER_BATCH_SIZE).to_list(SCHEDULER_BATCH_SIZE)
+        if not members:
+            break
+
+        updates = []
+        renewal_payments = {}  # member_id -> (new end_date, payment)
+        for member in members:
+            plan = await plan_cache.get_plan(member["gym_id"], member["plan_id"])
+            can_renew = (
+                member.get("auto_renewal")
+                and plan
+                and plan.get("is_active", True)
+                and plan.get("auto_renewal", True)
+                and plan["duration_days"] > 0
+            )
+            if can_renew:
+                period = timedelta(days=plan["duration_days"])
+                periods = (now - member["end_date"]) // period + 1
+                new_end_date = member["end_date"] + periods * period
+                period_start = new_end_date - period
+                updates.append(UpdateOne(
+                    {"id": member["id"], "end_date": member["end_date"]},
+                    {"$set": {"end_date": new_end_date}}
+                ))
+                renewal_payments[member["id"]] = (new_end_date, Payment(
+                    gym_id=member["gym_id"],
+                    member_id=member["id"],
+                    member_name=member["name"],
+                    amount=plan["price"],
+                    payment_date=period_start,
+                    payment_method=PaymentMethod.CASH,
+                    status=PaymentStatus.PENDING,
+                    notes="Auto-renewal",
+                    plan_id=plan["id"],
+                    plan_name=plan["name"],
+                    # A renewal period is billed once even if the batch is retried
+                    idempotency_key=f"renewal:{member['id']}:{period_start.isoformat()}"
+                ).dict())
+            else:
+                updates.append(UpdateOne(
+                    {"id": member["id"], "end_date": member["end_date"], "membership_status": MembershipStatus.ACTIVE.value},
+                    {"$set": {"membership_status": MembershipStatus.EXPIRED.value}}
+                ))
+
+        result = await db.members.bulk_write(updates, ordered=False)
+
+        # Bill only the renewals whose conditional update matched, i.e. whose end_date is now the new one
+        applied = []
+        if renewal_payments:
+            applied = await db.members.find(
+                {"$or": [
+                    {"id": member_id, "end_date": new_end_date}
+                    for member_id, (new_end_date, _) in renewal_payments.items()
+                ]},
+                {"_id": 0, "id": 1}
+            ).to_list(None)
+            inserted = await insert_payments([renewal_payments[member["id"]][1] for member in applied])
+            billed += len(inserted)
+        renewed += len(applied)
+        expired += max(0, result.modified_count - len(applied))
+        if result.modified_count == 0:
+            # Nothing in this batch could be applied; avoid spinning on it
+            break
+
+    return {"expired": expired, "renewed": renewed, "billed": billed}
+
+async def refresh_expiring_soon_counters(now: Optional[datetime] = None):
+    """Precompute per-gym counts of active memberships ending within EXPIRING_SOON_DAYS"""
+    now = now or datetime.utcnow()
+    counts = await db.members.aggregate([
+        {"$match": {
+            "membership_status": MembershipStatus.ACTIVE.value,
+            "end_date": {"$lte": now + timedelta(days=EXPIRING_SOON_DAYS)}
+        }},
+        {"$group": {"_id": "$gym_id", "count": {"$sum": 1}}}
+    ]).to_list(None)
+
+    updates = [
+        UpdateOne({"gym_id": row["_id"]}, {"$set": {"expiring_soon": row["count"], "expiring_soon_at": now}}, upsert=True)
+        for row in counts
+    ]
+    if updates:
+        await db.gym_stats.bulk_write(updates, ordered=False)
+    await db.gym_stats.update_many(
+        {"gym_id": {"$nin": [row["_id"] for row in counts]}},
+        {"$set": {"expiring_soon": 0, "expiring_soon_at": now}}
+    )
+
+async def get_expiring_soon_count(gym_id: str) -> int:
+    """Read the precomputed counter, falling back to a live count when it is stale"""
+    stats = await db.gym_stats.find_one({"gym_id": gym_id}, {"expiring_soon": 1, "expiring_soon_at": 1})
+    if stats and stats.get("expiring_soon_at") and \
+            datetime.utcnow() - stats["expiring_soon_at"] < timedelta(seconds=SCHEDULER_LEASE_SECONDS):
+        return stats["expiring_soon"]
+
+    return await db.members.count_documents({
+        "gym_id": gym_id,
+        "end_date": {"$lte": datetime.utcnow() + timedelta(days=EXPIRING_SOON_DAYS)},
+        "membership_status": "active"
+    })
+
+async def run_membership_scheduler():
+    while True:
+        try:
+            if await acquire_lease("membership_scheduler"):
+                result = await process_membership_transitions()
+                if result["expired"] or result["renewed"]:
+                    logging.getLogger(__name__).info(
+                        f"Membership scheduler expired {result['expired']} and renewed {result['renewed']} memberships "
+                        f"({result['billed']} renewal payments)"
+                    )
+                await refresh_expiring_soon_counters()
+        except Exception:
+            logging.getLogger(__name__).exception("Membership scheduler pass failed")
+        await asyncio.sleep(SCHEDULER_INTERVAL_SECONDS)
+
+# Diagnostics Routes
+@api_router.get("/admin/diagnostics/event-loop")
+async def get_event_loop_diagnostics(reset: bool = False, current_user: User = Depends(get_current_admin)):
+    """Blocking events and loop lag seen by this worker (requires GYMBLE_DIAGNOSTICS=1)"""
+    if not event_loop_monitor.enabled:
+        raise HTTPException(status_code=404, detail="Diagnostics mode is disabled")
+    
+    snapshot = event_loop_monitor.snapshot()
+    snapshot["worker"] = WORKER_ID
+    if reset:
+        event_loop_monitor.reset()
+    return snapshot
+
+profiler_lock = asyncio.Lock()
+
+@api_router.get("/admin/diagnostics/profile", response_class=PlainTextResponse)
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=60),
+    interval_ms: float = Query(5, ge=1, le=100),
+    include_idle: bool = False,
+    current_user: User = Depends(get_current_admin)
+):
+    """Sample this worker's event loop thread for `seconds` and return collapsed stacks for flamegraphs"""
+    if profiler_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    
+    async with profiler_lock:
+        if not event_loop_monitor.route_handlers:
+            event_loop_monitor.register_routes(app.routes)
+        sampler = StackSampler(
+            thread_id=threading.get_ident(),
+            route_handlers=event_loop_monitor.route_handlers,
+            interval_ms=interval_ms,
+            include_idle=include_idle
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    
+    return PlainTextResponse(
+        sampler.collapsed(),
+        headers={
+            "X-Profile-Worker": WORKER_ID,
+            "X-Profile-Samples": str(sampler.samples),
+            "X-Profile-Idle-Samples": str(sampler.idle_samples)
+        }
+    )
 
 # Include the routers in the main app
 app.include_router(api_router)
@@ -1981,8 +5496,13 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "ETag", "X-QR-Data", "X-QR-Expires-At"],
 )
 
+if DIAGNOSTICS_ENABLED:
+    # Lets slow-callback reports name the route whose request task blocked the loop
+    app.add_middleware(RequestScopeMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -1990,6 +5510,111 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks: List[asyncio.Task] = []
+
+async def ensure_indexes():
+    """Create the indexes the hot query paths rely on (no-op when they already exist)"""
+    await db.announcements.create_index(
+        [("gym_id", ASCENDING), ("is_active", ASCENDING), ("created_at", DESCENDING)]
+    )
+    await db.announcements.create_index("expires_at")
+    await db.announcements_archive.create_index("id", unique=True)
+    await db.members.create_index([("membership_status", ASCENDING), ("end_date", ASCENDING)])
+    await db.members.create_index([("gym_id", ASCENDING), ("membership_status", ASCENDING), ("end_date", ASCENDING)])
+    await db.gym_stats.create_index("gym_id", unique=True)
+    await db.attendance_buckets.create_index([("member_id", ASCENDING), ("month", ASCENDING)], unique=True)
+    await db.attendance_buckets.create_index([("gym_id", ASCENDING), ("month", ASCENDING)])
+    await db.attendance_summaries.create_index("member_id", unique=True)
+    await db.gym_occupancy.create_index("gym_id", unique=True)
+    await db.revenue_monthly.create_index([("gym_id", ASCENDING), ("month", ASCENDING)], unique=True)
+    await db.payments.create_index([("gym_id", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)])
+    await db.payments.create_index(
+        [("member_id", ASCENDING), ("gym_id", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)]
+    )
+    await db.payments.create_index(
+        [("gym_id", ASCENDING), ("status", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)]
+    )
+    await db.payments.create_index(
+        [("gym_id", ASCENDING), ("idempotency_key", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$type": "string"}}
+    )
+    await db.member_balances.create_index("member_id", unique=True)
+    await db.analytics_reports.create_index([("gym_id", ASCENDING), ("day", ASCENDING)], unique=True)
+    await db.analytics_reports.create_index("generated_at", expireAfterSeconds=ANALYTICS_REPORT_TTL_SECONDS)
+    await db.template_versions.create_index("id", unique=True)
+    await db.template_versions.create_index([("template_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.template_version_history.create_index([("template_id", ASCENDING), ("saved_at", DESCENDING)])
+    for collection in (db.workout_progress, db.diet_progress):
+        await collection.create_index(
+            [("member_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}}
+        )
+    await db.diet_adherence_weekly.create_index(
+        [("member_id", ASCENDING), ("diet_template_id", ASCENDING), ("week", ASCENDING)], unique=True
+    )
+    await db.diet_adherence_weekly.create_index([("diet_template_id", ASCENDING), ("week", ASCENDING)])
+    await db.exercise_logs.create_index([("member_id", ASCENDING), ("exercise_key", ASCENDING), ("performed_at", DESCENDING)])
+    await db.exercise_logs.create_index("gym_id")
+    await db.exercise_stats.create_index([("member_id", ASCENDING), ("exercise_key", ASCENDING)], unique=True)
+    await db.exercise_stats.create_index([("member_id", ASCENDING), ("last_performed_at", DESCENDING)])
+    await db.workout_progress.create_index(
+        [("member_id", ASCENDING), ("gym_id", ASCENDING), ("scheduled_date", DESCENDING), ("id", DESCENDING)]
+    )
+    await db.diet_progress.create_index(
+        [("member_id", ASCENDING), ("gym_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)]
+    )
+    await db.workout_progress.create_index([("gym_id", ASCENDING), ("scheduled_date", ASCENDING)])
+    await db.occupancy_hourly.create_index([("gym_id", ASCENDING), ("date", ASCENDING)], unique=True)
+    await db.attendance.create_index([("gym_id", ASCENDING), ("check_in_time", DESCENDING)])
+    await db.attendance.create_index([("member_id", ASCENDING), ("check_in_time", DESCENDING)])
+    await db.attendance.create_index([("check_out_time", ASCENDING), ("check_in_time", ASCENDING)])
+    try:
+        await db.attendance.create_index("id", unique=True)
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict: replace the earlier non-unique id index
+        if e.code not in (85, 86):
+            raise
+        await db.attendance.drop_index("id_1")
+        await db.attendance.create_index("id", unique=True)
+    await db.kiosk_scans.create_index([("gym_id", ASCENDING), ("scan_id", ASCENDING)], unique=True)
+    await db.kiosk_scans.create_index("ingested_at", expireAfterSeconds=KIOSK_SCAN_TTL_SECONDS)
+    email_indexes = [
+        (db.users, [("email", ASCENDING)]),
+        (db.members, [("gym_id", ASCENDING), ("email", ASCENDING)]),
+    ]
+    for collection, keys in email_indexes:
+        try:
+            await collection.create_index(keys, unique=True, collation=EMAIL_COLLATION)
+        except OperationFailure as e:
+            # DuplicateKey: emails already stored in two cases must be merged by hand first
+            if e.code != 11000:
+                raise
+            logger.warning("Unique email index on %s not created: %s", collection.name, e)
+
+@app.on_event("startup")
+async def startup_background_work():
+    try:
+        await ensure_indexes()
+    except Exception:
+        logger.exception("Index creation failed")
+    background_tasks.append(asyncio.create_task(run_announcement_archiver()))
+    background_tasks.append(asyncio.create_task(run_membership_scheduler()))
+    background_tasks.append(asyncio.create_task(run_occupancy_sweeper()))
+    background_tasks.append(asyncio.create_task(run_checkins_migration()))
+    background_tasks.append(asyncio.create_task(run_revenue_backfill()))
+    get_analytics_executor()
+    if DIAGNOSTICS_ENABLED:
+        event_loop_monitor.register_routes(app.routes)
+        event_loop_monitor.start()
+        logger.info("Event loop diagnostics enabled")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    event_loop_monitor.stop()
+    if analytics_executor is not None:
+        analytics_executor.shutdown(wait=False, cancel_futures=True)
     client.close()
@@ -0,0 +1,209 @@
+"""Benchmark the GYMBLE API routes in-process against a local Mongo stand-in.
+
+Seeds N gyms x M members x D days of history with generate_dataset.py, then drives the real
+FastAPI app through httpx's ASGI transport and reports p50/p95/p99 latency
+and successful requests per second per route. Only 2xx responses count
+towards latency and throughput; 4xx, 429 and 5xx responses are reported
+separately.
+
+    python benchmark_api.py --gyms 2 --members 200 --days 30
+    python benchmark_api.py --mongo-url mongodb://localhost:27017 --save-baseline
+    python benchmark_api.py --baseline benchmark_baseline.json --threshold 0.2
+
+Without --mongo-url the run uses mongomock-motor (pip install mongomock-motor)
+and skips building the derived stores, which need $merge.
+Per-user and per-gym rate limits are multiplied by --rate-limit-scale
+(default 1000) so rate-limited routes such as qr_code are measured rather
+than throttled; pass 1 to benchmark the production limits.
+The process exits non-zero when a route regresses past the threshold
+relative to the baseline file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import generate_dataset
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+BENCH_PASSWORD = "password123"
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def load_server(mongo_url, db_name):
+    """Import backend/server.py pointed at the benchmark database"""
+    os.environ["MONGO_URL"] = mongo_url or "mongodb://localhost:27017"
+    os.environ["DB_NAME"] = db_name
+    import server
+
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[db_name]
+    return server
+
+async def seed(server, gyms, members_per_gym, days, derived=True):
+    """Write a synthetic dataset straight into Mongo and return per-gym fixtures"""
+    fixtures, _ = await generate_dataset.generate(
+        server.db, gyms=gyms, members_per_gym=members_per_gym, days=days, password=BENCH_PASSWORD
+    )
+    if derived:
+        await generate_dataset.build_derived_stores(server)
+    return fixtures
+
+def build_scenarios(server, fixtures):
+    """(route name, request factory) pairs; each factory returns (method, path, headers, json)"""
+    now = datetime.utcnow()
+
+    def owner_headers(fixture):
+        return {"Authorization": f"Bearer {server.create_access_token({'sub': fixture['owner_email']})}"}
+
+    def member_headers(fixture):
+        email = random.choice(fixture["member_emails"])
+        return {"Authorization": f"Bearer {server.create_access_token({'sub': email})}"}
+
+    def current_qr_code(fixture):
+        # Mint the token for the current slot; one fetched at start-up expires after the grace slots
+        return server.create_qr_token(fixture["gym_id"], server.current_qr_slot())
+
+    return [
+        ("login", lambda f: ("POST", "/api/auth/login", {}, {"email": random.choice(f["member_emails"]), "password": BENCH_PASSWORD})),
+        ("qr_code", lambda f: ("GET", "/api/attendance/qr-code", owner_headers(f), None)),
+        ("attendance_mark", lambda f: ("POST", "/api/attendance/mark", member_headers(f), {"qr_code_data": current_qr_code(f)})),
+        ("dashboard_stats", lambda f: ("GET", "/api/dashboard/stats", owner_headers(f), None)),
+        ("member_list", lambda f: ("GET", "/api/members", owner_headers(f), None)),
+        ("member_search", lambda f: ("GET", f"/api/members/search/{random.choice(generate_dataset.FIRST_NAMES)}", owner_headers(f), None)),
+        ("attendance_calendar", lambda f: ("GET", f"/api/attendance/calendar/{now.year}/{now.month}", owner_headers(f), None)),
+    ]
+
+async def run_route(http, factory, fixtures, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, throttled, client_errors = [], 0, 0, 0
+
+    async def one_request():
+        nonlocal errors, throttled, client_errors
+        method, path, headers, body = factory(random.choice(fixtures))
+        async with semaphore:
+            started = time.perf_counter()
+            response = await http.request(method, path, headers=headers, json=body)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        if response.status_code >= 500:
+            errors += 1
+        elif response.status_code == 429:
+            throttled += 1
+        elif response.status_code >= 400:
+            client_errors += 1
+        else:
+            latencies.append(elapsed_ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one_request() for _ in range(total)])
+    wall_seconds = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "throttled": throttled,
+        "client_errors": client_errors,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "rps": round(len(latencies) / wall_seconds, 1) if wall_seconds else 0.0
+    }
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for route, current in results.items():
+        previous = baseline.get(route)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {current['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - threshold):
+            regressions.append(f"{route}: {current['rps']} req/s vs baseline {previous['rps']} req/s")
+    return regressions
+
+async def main(args):
+    import httpx
+
+    random.seed(args.seed)
+    server = load_server(args.mongo_url, args.db_name)
+    server.rate_limiter.scale = args.rate_limit_scale
+    if args.mongo_url:
+        await server.client.drop_database(args.db_name)
+        await server.ensure_indexes()
+
+    print(f"Seeding {args.gyms} gyms x {args.members} members x {args.days} days...")
+    started = time.perf_counter()
+    # mongomock-motor has no $merge, so the derived stores are only built against a real mongod
+    fixtures = await seed(server, args.gyms, args.members, args.days, derived=bool(args.mongo_url))
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    scenarios = build_scenarios(server, fixtures)
+    results = {}
+    # An unhandled route exception comes back as a 500 and counts as an error instead of ending the run
+    transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        for route, factory in scenarios:
+            if args.routes and route not in args.routes:
+                continue
+            results[route] = await run_route(http, factory, fixtures, args.requests, args.concurrency)
+            r = results[route]
+            print(f"{route:<22} p50 {r['p50_ms']:>8.2f}ms  p95 {r['p95_ms']:>8.2f}ms  "
+                  f"p99 {r['p99_ms']:>8.2f}ms  {r['rps']:>8.1f} req/s  errors {r['errors']}  "
+                  f"4xx {r['client_errors']}  throttled {r['throttled']}")
+
+    if args.mongo_url:
+        await server.client.drop_database(args.db_name)
+
+    failing = [route for route, r in results.items() if r["errors"]]
+    if failing:
+        # Latency of a route that errors measures the error path, so it is neither a baseline nor a pass
+        print(f"\nRoutes returning 5xx: {', '.join(failing)}")
+        return 1
+
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if Path(args.baseline).exists():
+        regressions = find_regressions(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+        if regressions:
+            print("\nRegressions beyond threshold:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against baseline")
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gyms", type=int, default=2)
+    parser.add_argument("--members", type=int, default=200, help="Members per gym")
+    parser.add_argument("--days", type=int, default=30, help="Days of attendance history")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--routes", nargs="*", help="Only run these routes")
+    parser.add_argument("--mongo-url", help="Local mongod to use instead of mongomock-motor")
+    parser.add_argument("--db-name", default="gymble_benchmark")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed fractional regression (0.2 = 20%%)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rate-limit-scale", type=float, default=1000,
+                        help="Multiplier for per-user and per-gym rate limits (1 = production limits)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
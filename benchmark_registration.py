@@ -0,0 +1,73 @@
+import requests
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Base URL for the API
+API_URL = "http://localhost:8000/api"
+
+# Read credentials from the file written by create_owner.py
+def read_credentials():
+    try:
+        credentials = {}
+        with open("owner_credentials.txt", "r") as f:
+            for line in f:
+                key, value = line.strip().split(": ", 1)
+                credentials[key] = value
+        return credentials
+    except Exception as e:
+        print(f"Error reading credentials: {e}")
+        return None
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def register_once(gym_id, plan_id, run_id, index):
+    payload = {
+        "name": f"Bench Member {index}",
+        "email": f"bench-{run_id}-{index}@example.com",
+        "password": "password123",
+        "phone": "1234567890",
+        "gym_id": gym_id,
+        "plan_id": plan_id
+    }
+    started = time.perf_counter()
+    response = requests.post(f"{API_URL}/auth/register-member", json=payload)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return response.status_code, elapsed_ms
+
+def benchmark_registration(total=200, concurrency=10):
+    """Register `total` members with `concurrency` parallel clients and report latency"""
+    credentials = read_credentials()
+    if not credentials:
+        print("Could not read credentials. Please run create_owner.py first.")
+        return False
+
+    run_id = uuid.uuid4().hex[:8]
+    print(f"Registering {total} members with {concurrency} concurrent clients...")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda i: register_once(credentials["Gym ID"], credentials["Plan ID"], run_id, i),
+            range(total)
+        ))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(elapsed for status_code, elapsed in results if status_code == 200)
+    failures = sum(1 for status_code, _ in results if status_code != 200)
+
+    print(f"Succeeded: {len(latencies)}  Failed: {failures}")
+    print(f"Throughput: {len(latencies) / wall_seconds:.1f} registrations/s")
+    print(f"p50: {percentile(latencies, 50):.1f} ms")
+    print(f"p99: {percentile(latencies, 99):.1f} ms")
+    return failures == 0
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    sys.exit(0 if benchmark_registration(total, concurrency) else 1)
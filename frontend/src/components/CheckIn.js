@@ -1,8 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || '';
 const API = BACKEND_URL ? `${BACKEND_URL}/api` : '/api';
+const QR_RETRY_MS = 5000;
 
 const CheckIn = ({ onNavigate }) => {
   const [searchQuery, setSearchQuery] = useState('');
@@ -16,45 +17,53 @@ const CheckIn = ({ onNavigate }) => {
   const [qrCodeData, setQrCodeData] = useState(null);
   const [qrCodeLoading, setQrCodeLoading] = useState(false);
   const [qrCodeError, setQrCodeError] = useState(null);
+  const qrTimeoutRef = useRef(null);
+  const qrRotationMsRef = useRef(300 * 1000);
+  const mountedRef = useRef(true);
 
   useEffect(() => {
+    mountedRef.current = true;
     fetchTodayCheckins();
     fetchQRCode();
-    
-    // Refresh QR code every 5 minutes
-    const qrInterval = setInterval(fetchQRCode, 5 * 60 * 1000);
-    
-    return () => clearInterval(qrInterval);
+
+    return () => {
+      mountedRef.current = false;
+      clearTimeout(qrTimeoutRef.current);
+    };
   }, []);
 
   const fetchQRCode = async () => {
+    clearTimeout(qrTimeoutRef.current);
     setQrCodeLoading(true);
     setQrCodeError(null);
+    let failed = false;
     try {
       const response = await axios.get(`${API}/attendance/qr-code`);
+      qrRotationMsRef.current = (response.data.rotation_seconds || 300) * 1000;
       setQrCodeData(response.data);
     } catch (error) {
+      failed = true;
       console.error('Error fetching QR code:', error);
       setQrCodeError('Failed to generate QR code');
     } finally {
       setQrCodeLoading(false);
+      if (mountedRef.current) {
+        // Tokens rotate on fixed wall-clock slots; fetch again just after the next boundary, or soon after a failure
+        const rotationMs = qrRotationMsRef.current;
+        const delay = failed ? QR_RETRY_MS : rotationMs - (Date.now() % rotationMs) + 500;
+        clearTimeout(qrTimeoutRef.current);
+        qrTimeoutRef.current = setTimeout(fetchQRCode, delay);
+      }
     }
   };
 
   const fetchTodayCheckins = async () => {
     try {
-      // Use new attendance endpoint
+      // Staff and QR check-ins share one session store
       const response = await axios.get(`${API}/attendance/today`);
       setTodayCheckins(response.data);
     } catch (error) {
       console.error('Error fetching check-ins:', error);
-      // Fallback to old endpoint if new one fails
-      try {
-        const fallbackResponse = await axios.get(`${API}/checkins/today`);
-        setTodayCheckins(fallbackResponse.data);
-      } catch (fallbackError) {
-        console.error('Error fetching check-ins (fallback):', fallbackError);
-      }
     }
   };
 
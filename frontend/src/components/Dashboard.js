@@ -50,9 +50,7 @@ const Dashboard = ({ onNavigate }) => {
     try {
       const [statsResponse, checkinsResponse] = await Promise.all([
         axios.get(`${API}/dashboard/stats`),
-        axios.get(`${API}/attendance/today`).catch(() => 
-          axios.get(`${API}/checkins/today`)
-        )
+        axios.get(`${API}/attendance/today`)
       ]);
 
       setStats(statsResponse.data);
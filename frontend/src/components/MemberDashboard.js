@@ -29,11 +29,15 @@ const MemberDashboard = ({ onNavigate }) => {
       setPlanAssignments(assignmentsResponse.data);
 
       // Fetch workout progress
-      const workoutProgressResponse = await axios.get(`${API}/workout-progress/my`);
+      const workoutProgressResponse = await axios.get(`${API}/workout-progress/my`, {
+        params: { limit: 5, summary: true }
+      });
       setWorkoutProgress(workoutProgressResponse.data);
 
       // Fetch diet progress
-      const dietProgressResponse = await axios.get(`${API}/diet-progress/my`);
+      const dietProgressResponse = await axios.get(`${API}/diet-progress/my`, {
+        params: { limit: 5, summary: true }
+      });
       setDietProgress(dietProgressResponse.data);
 
       // Fetch announcements
@@ -40,28 +40,42 @@ const MemberPlanTracker = ({ onNavigate }) => {
       const response = await axios.get(`${API}/plan-assignments/my`);
       setPlanAssignments(response.data);
 
-      // Fetch workout and diet templates
-      const workoutIds = response.data.filter(a => a.plan_type === 'workout').map(a => a.plan_id);
-      const dietIds = response.data.filter(a => a.plan_type === 'diet').map(a => a.plan_id);
+      // Load the template version each assignment was made against (templates keyed by assignment id)
+      const assignments = response.data;
+      const versionIds = [...new Set(assignments.filter(a => a.plan_version).map(a => a.plan_version))];
+      // Assignments made before template versioning have no plan_version; use the current template
+      const legacyIds = [...new Set(assignments.filter(a => !a.plan_version).map(a => a.plan_id))];
 
-      const workoutData = {};
-      const dietData = {};
+      let workoutData = {};
+      let dietData = {};
 
-      for (const id of workoutIds) {
+      if (assignments.length > 0) {
         try {
-          const res = await axios.get(`${API}/workout-templates/${id}`);
-          workoutData[id] = res.data;
+          const [versions, legacy] = await Promise.all([
+            versionIds.length > 0
+              ? axios.get(`${API}/template-versions`, { params: { ids: versionIds.join(',') } }).then(res => res.data)
+              : [],
+            legacyIds.length > 0
+              ? axios.get(`${API}/templates/batch`, { params: { ids: legacyIds.join(',') } }).then(res => res.data)
+              : { workout_templates: {}, diet_templates: {} }
+          ]);
+          const versionContent = Object.fromEntries(versions.map(version => [version.id, version.content]));
+
+          assignments.forEach(assignment => {
+            const isWorkout = assignment.plan_type === 'workout';
+            const template = assignment.plan_version
+              ? versionContent[assignment.plan_version]
+              : (isWorkout ? legacy.workout_templates : legacy.diet_templates)[assignment.plan_id];
+            if (!template) {
+              console.error('Template not found for assignment:', assignment.id);
+            } else if (isWorkout) {
+              workoutData[assignment.id] = template;
+            } else {
+              dietData[assignment.id] = template;
+            }
+          });
         } catch (error) {
-          console.error(`Error fetching workout template ${id}:`, error);
-        }
-      }
-
-      for (const id of dietIds) {
-        try {
-          const res = await axios.get(`${API}/diet-templates/${id}`);
-          dietData[id] = res.data;
-        } catch (error) {
-          console.error(`Error fetching diet template ${id}:`, error);
+          console.error('Error fetching templates:', error);
         }
       }
 
@@ -76,7 +90,7 @@ const MemberPlanTracker = ({ onNavigate }) => {
 
   const handleWorkoutProgress = (assignment) => {
     setSelectedAssignment(assignment);
-    const template = workoutTemplates[assignment.plan_id];
+    const template = workoutTemplates[assignment.id];
     
     if (template) {
       setWorkoutProgressForm({
@@ -100,7 +114,7 @@ const MemberPlanTracker = ({ onNavigate }) => {
 
   const handleDietProgress = (assignment) => {
     setSelectedAssignment(assignment);
-    const template = dietTemplates[assignment.plan_id];
+    const template = dietTemplates[assignment.id];
     
     if (template) {
       setDietProgressForm({
@@ -227,8 +241,8 @@ const MemberPlanTracker = ({ onNavigate }) => {
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
           {planAssignments.map((assignment) => {
             const template = assignment.plan_type === 'workout' 
-              ? workoutTemplates[assignment.plan_id] 
-              : dietTemplates[assignment.plan_id];
+              ? workoutTemplates[assignment.id] 
+              : dietTemplates[assignment.id];
 
             return (
               <div key={assignment.id} className="bg-white rounded-lg shadow-sm border border-gray-200 p-6">
@@ -334,7 +348,7 @@ const MemberPlanTracker = ({ onNavigate }) => {
 
               <div className="mb-4 p-4 bg-blue-50 rounded-lg">
                 <h3 className="font-semibold text-blue-900">{selectedAssignment.plan_name}</h3>
-                <p className="text-blue-700">{workoutTemplates[selectedAssignment.plan_id]?.description}</p>
+                <p className="text-blue-700">{workoutTemplates[selectedAssignment.id]?.description}</p>
               </div>
 
               <form onSubmit={handleWorkoutSubmit} className="space-y-6">
@@ -495,7 +509,7 @@ const MemberPlanTracker = ({ onNavigate }) => {
 
               <div className="mb-4 p-4 bg-green-50 rounded-lg">
                 <h3 className="font-semibold text-green-900">{selectedAssignment.plan_name}</h3>
-                <p className="text-green-700">{dietTemplates[selectedAssignment.plan_id]?.description}</p>
+                <p className="text-green-700">{dietTemplates[selectedAssignment.id]?.description}</p>
               </div>
 
               <form onSubmit={handleDietSubmit} className="space-y-6">
@@ -208,7 +208,7 @@ const MobileQRScanner = ({ onNavigate }) => {
                   type="text"
                   value={manualCode}
                   onChange={(e) => setManualCode(e.target.value)}
-                  placeholder="Enter QR code (e.g., GYMBLE_ATTENDANCE:...)"
+                  placeholder="Enter QR code (e.g., G1.mx3k2a.Zk7vQ2...)"
                   className="w-full px-4 py-3 border border-gray-300 rounded-xl focus:outline-none focus:ring-2 focus:ring-blue-500"
                 />
                 <button
@@ -0,0 +1,394 @@
+"""Generate a production-scale synthetic GYMBLE dataset directly through Motor.
+
+Writes gyms, owners, plans, members (with a realistic status mix), years of
+attendance with morning/evening peaks, payments, workout and diet templates,
+plan assignments and progress logs. Documents are plain dicts shaped like the
+models in backend/server.py and are written with unordered insert_many
+batches, several in flight at once. The derived stores the API reads
+(attendance buckets and summaries, hourly occupancy, revenue and balance
+aggregates, exercise stats, diet adherence) are then built with the
+server's own rebuild functions.
+
+    python generate_dataset.py --gyms 20 --members 2000 --days 730 --drop
+
+Uses MONGO_URL from the environment (or backend/.env) unless --mongo-url is
+given. The database is always --db-name (default gymble_synthetic), never
+the app's DB_NAME, so --drop cannot wipe the real database by accident.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import bcrypt
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / "backend" / ".env")
+
+DEFAULT_PASSWORD = "password123"
+DEFAULT_DB_NAME = "gymble_synthetic"
+DERIVED_BATCH_SIZE = 1000
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Arjun", "Rohan", "Ishaan", "Kabir", "Priya", "Ananya", "Diya",
+               "Saanvi", "Meera", "Kavya", "Riya", "Neha", "Rahul", "Vikram", "Sneha", "Pooja", "Karan"]
+LAST_NAMES = ["Sharma", "Verma", "Patel", "Reddy", "Iyer", "Nair", "Gupta", "Singh", "Khan", "Das",
+              "Mehta", "Joshi", "Rao", "Kapoor", "Bose"]
+
+PLAN_SHAPES = [
+    ("Monthly Basic", "basic", 1500, 30),
+    ("Quarterly Premium", "premium", 4000, 90),
+    ("Half-Yearly Premium", "premium", 7500, 180),
+    ("Annual VIP", "vip", 14000, 365),
+    ("Family Monthly", "family", 3500, 30),
+]
+STATUS_MIX = [("active", 0.70), ("expired", 0.20), ("suspended", 0.05), ("pending", 0.05)]
+PAYMENT_METHODS = ["cash", "upi", "google_pay", "phone_pe", "paytm", "card"]
+
+# Relative check-in volume per hour of day: morning and evening peaks
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 2, 9, 12, 10, 6, 4, 3, 3, 2, 2, 3, 5, 9, 12, 10, 6, 3, 1, 0]
+HOURS = list(range(24))
+
+EXERCISES = ["Bench Press", "Squat", "Deadlift", "Overhead Press", "Barbell Row", "Pull Up",
+             "Lunge", "Leg Press", "Bicep Curl", "Tricep Dip", "Plank", "Lat Pulldown"]
+WORKOUT_CATEGORIES = ["Strength", "Cardio", "HIIT", "Yoga"]
+DIFFICULTIES = ["Beginner", "Intermediate", "Advanced"]
+DIET_GOALS = ["Weight Loss", "Muscle Gain", "Maintenance", "Cutting"]
+FOODS = [("Oats", 150, 5, 27, 3), ("Eggs", 140, 12, 1, 10), ("Chicken Breast", 165, 31, 0, 4),
+         ("Brown Rice", 215, 5, 45, 2), ("Dal", 180, 12, 30, 1), ("Paneer", 265, 18, 4, 20),
+         ("Banana", 105, 1, 27, 0), ("Greek Yogurt", 100, 17, 6, 0), ("Roti", 120, 3, 20, 3)]
+
+def new_id():
+    return str(uuid.uuid4())
+
+class BatchWriter:
+    """Buffers documents per collection and flushes them with concurrent insert_many calls"""
+
+    def __init__(self, db, batch_size=5000, concurrency=8):
+        self.db = db
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.buffers = {}
+        self.counts = {}
+        self.tasks = set()
+
+    async def add(self, collection, document):
+        buffer = self.buffers.setdefault(collection, [])
+        buffer.append(document)
+        if len(buffer) >= self.batch_size:
+            await self.flush(collection)
+
+    async def flush(self, collection):
+        documents = self.buffers.pop(collection, [])
+        if not documents:
+            return
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._insert(collection, documents))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _insert(self, collection, documents):
+        try:
+            await self.db[collection].insert_many(documents, ordered=False)
+            self.counts[collection] = self.counts.get(collection, 0) + len(documents)
+        finally:
+            self.semaphore.release()
+
+    async def close(self):
+        for collection in list(self.buffers):
+            await self.flush(collection)
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+
+def make_workout_template(gym_id, owner_name, now):
+    exercises = random.sample(EXERCISES, random.randint(4, 7))
+    return {
+        "id": new_id(), "gym_id": gym_id,
+        "name": f"{random.choice(WORKOUT_CATEGORIES)} Block {random.randint(1, 99)}",
+        "description": "Generated workout template",
+        "category": random.choice(WORKOUT_CATEGORIES),
+        "target_muscle_groups": random.sample(["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"], 2),
+        "estimated_duration": random.choice([30, 45, 60, 75]),
+        "difficulty_level": random.choice(DIFFICULTIES),
+        "exercises": [{
+            "exercise_name": name, "sets": random.randint(3, 5), "reps": random.choice(["8", "10", "12", "8-12", "15+"]),
+            "weight": f"{random.randint(5, 40) * 2.5:g}kg", "rest_time": "60 seconds", "notes": None
+        } for name in exercises],
+        "created_by": owner_name, "created_at": now, "is_active": True
+    }
+
+def make_diet_template(gym_id, owner_name, now):
+    meals = []
+    for meal_type, meal_time in [("Breakfast", "7:00 AM"), ("Lunch", "1:00 PM"), ("Snack", "5:00 PM"), ("Dinner", "8:30 PM")]:
+        items = []
+        for food, calories, protein, carbs, fat in random.sample(FOODS, 2):
+            items.append({"food_name": food, "quantity": "1 serving", "calories": calories,
+                          "protein": protein, "carbs": carbs, "fat": fat, "notes": None})
+        meals.append({"meal_type": meal_type, "time": meal_time, "items": items})
+    return {
+        "id": new_id(), "gym_id": gym_id,
+        "name": f"{random.choice(DIET_GOALS)} Plan {random.randint(1, 99)}",
+        "description": "Generated diet template",
+        "goal": random.choice(DIET_GOALS),
+        "total_calories": sum(item["calories"] for meal in meals for item in meal["items"]),
+        "protein_target": float(sum(item["protein"] for meal in meals for item in meal["items"])),
+        "carbs_target": float(sum(item["carbs"] for meal in meals for item in meal["items"])),
+        "fat_target": float(sum(item["fat"] for meal in meals for item in meal["items"])),
+        "meals": meals, "created_by": owner_name, "created_at": now, "is_active": True
+    }
+
+def membership_dates(status, plan, history_start, now):
+    """Pick start/end dates consistent with the member's status"""
+    duration = timedelta(days=plan["duration_days"])
+    if status == "expired":
+        end_date = now - timedelta(days=random.randint(1, 180))
+        start_date = max(history_start, end_date - duration * random.randint(1, 6))
+    else:
+        end_date = now + timedelta(days=random.randint(1, plan["duration_days"]))
+        periods = random.randint(1, max(1, (now - history_start).days // plan["duration_days"]))
+        start_date = max(history_start, end_date - duration * periods)
+    return start_date, end_date
+
+async def generate(db, gyms=5, members_per_gym=500, days=365, workout_templates=8, diet_templates=6,
+                   assignment_rate=0.5, batch_size=5000, concurrency=8, seed=42, password=DEFAULT_PASSWORD,
+                   fixture_limit=1000):
+    """Write the dataset and return per-gym fixtures (gym id, owner email, active member emails)"""
+    random.seed(seed)
+    writer = BatchWriter(db, batch_size=batch_size, concurrency=concurrency)
+    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    now = datetime.utcnow()
+    history_start = now - timedelta(days=days)
+    statuses, status_weights = zip(*STATUS_MIX)
+    fixtures = []
+
+    for g in range(gyms):
+        gym_id, owner_id = new_id(), new_id()
+        owner_email = f"owner{g}-{gym_id[:6]}@example.com"
+        owner_name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+        await writer.add("users", {
+            "id": owner_id, "email": owner_email, "password_hash": password_hash, "name": owner_name,
+            "phone": "9876543210", "role": "owner", "gym_id": gym_id, "created_at": history_start, "is_active": True
+        })
+        await writer.add("gyms", {
+            "id": gym_id, "name": f"{random.choice(LAST_NAMES)} Fitness {g}", "owner_id": owner_id,
+            "address": f"{g + 1} MG Road", "phone": "9876543210", "email": f"gym{g}-{gym_id[:6]}@example.com",
+            "description": "Generated gym", "qr_code_data": None, "created_at": history_start, "is_active": True,
+            "latitude": 12.97 + random.uniform(-0.1, 0.1), "longitude": 77.59 + random.uniform(-0.1, 0.1)
+        })
+
+        plans = []
+        for name, plan_type, price, duration_days in PLAN_SHAPES:
+            plan = {
+                "id": new_id(), "gym_id": gym_id, "name": name, "description": f"{name} membership",
+                "price": float(price), "duration_days": duration_days, "plan_type": plan_type,
+                "features": ["Gym floor access"], "auto_renewal": True, "created_at": history_start, "is_active": True
+            }
+            plans.append(plan)
+            await writer.add("plans", plan)
+
+        workouts = [make_workout_template(gym_id, owner_name, history_start) for _ in range(workout_templates)]
+        diets = [make_diet_template(gym_id, owner_name, history_start) for _ in range(diet_templates)]
+        for template in workouts:
+            await writer.add("workout_templates", template)
+        for template in diets:
+            await writer.add("diet_templates", template)
+
+        active_emails = []
+        for m in range(members_per_gym):
+            member_id = new_id()
+            name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}"
+            email = f"m{g}-{m}-{member_id[:6]}@example.com"
+            phone = f"9{random.randint(100000000, 999999999)}"
+            plan = random.choice(plans)
+            status = random.choices(statuses, status_weights)[0]
+            start_date, end_date = membership_dates(status, plan, history_start, now)
+            visit_rate = random.betavariate(2, 4)  # Most members visit a couple of times a week
+            last_day = min(end_date, now)
+
+            visits = 0
+            last_visit = None
+            workout_assignment = diet_assignment = None
+            workout = diet = None
+            if random.random() < assignment_rate:
+                workout = random.choice(workouts)
+                workout_assignment = {
+                    "id": new_id(), "gym_id": gym_id, "member_id": member_id, "member_name": name,
+                    "plan_type": "workout", "plan_id": workout["id"], "plan_name": workout["name"],
+                    "assigned_by": owner_name, "assigned_at": start_date, "start_date": start_date,
+                    "end_date": None, "is_active": True, "notes": None
+                }
+                await writer.add("plan_assignments", workout_assignment)
+            if random.random() < assignment_rate:
+                diet = random.choice(diets)
+                diet_assignment = {
+                    "id": new_id(), "gym_id": gym_id, "member_id": member_id, "member_name": name,
+                    "plan_type": "diet", "plan_id": diet["id"], "plan_name": diet["name"],
+                    "assigned_by": owner_name, "assigned_at": start_date, "start_date": start_date,
+                    "end_date": None, "is_active": True, "notes": None
+                }
+                await writer.add("plan_assignments", diet_assignment)
+
+            day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+            while day < last_day:
+                rate = visit_rate * (0.6 if day.weekday() >= 5 else 1.0)
+                if status != "pending" and random.random() < rate:
+                    hour = random.choices(HOURS, HOUR_WEIGHTS)[0]
+                    check_in = day + timedelta(hours=hour, minutes=random.randint(0, 59))
+                    duration = max(15, int(random.gauss(65, 20)))
+                    await writer.add("attendance", {
+                        "id": new_id(), "gym_id": gym_id, "member_id": member_id, "member_name": name,
+                        "check_in_time": check_in, "check_out_time": check_in + timedelta(minutes=duration),
+                        "duration_minutes": duration, "qr_code_data": "generated",
+                        "ip_address": None, "device_info": None
+                    })
+                    visits += 1
+                    last_visit = check_in
+                    if workout_assignment:
+                        template = workout
+                        await writer.add("workout_progress", {
+                            "id": new_id(), "gym_id": gym_id, "member_id": member_id,
+                            "assignment_id": workout_assignment["id"], "workout_template_id": template["id"],
+                            "workout_name": template["name"], "scheduled_date": day,
+                            "completed_at": check_in + timedelta(minutes=duration), "duration_minutes": duration,
+                            "exercises_progress": [{
+                                "exercise_name": exercise["exercise_name"], "completed_sets": exercise["sets"],
+                                "completed_reps": [random.randint(6, 12) for _ in range(exercise["sets"])],
+                                "weights_used": [exercise["weight"]] * exercise["sets"], "notes": None
+                            } for exercise in template["exercises"]],
+                            "overall_rating": random.randint(3, 5), "notes": None, "status": "completed"
+                        })
+                if diet_assignment and random.random() < 0.3:
+                    template = diet
+                    meals_progress = [{
+                        "meal_type": meal["meal_type"],
+                        "items_consumed": [item["food_name"] for item in meal["items"]],
+                        "total_calories": sum(item["calories"] for item in meal["items"]), "notes": None
+                    } for meal in template["meals"] if random.random() < 0.85]
+                    await writer.add("diet_progress", {
+                        "id": new_id(), "gym_id": gym_id, "member_id": member_id,
+                        "assignment_id": diet_assignment["id"], "diet_template_id": template["id"],
+                        "diet_name": template["name"], "date": day, "meals_progress": meals_progress,
+                        "total_calories_consumed": sum(meal["total_calories"] for meal in meals_progress),
+                        "water_intake_liters": round(random.uniform(1.5, 4.0), 1),
+                        "overall_rating": random.randint(2, 5), "notes": None, "status": "completed"
+                    })
+                day += timedelta(days=1)
+
+            # One payment per membership period
+            period_start = start_date
+            method = random.choice(PAYMENT_METHODS)
+            while period_start < end_date and period_start <= now:
+                await writer.add("payments", {
+                    "id": new_id(), "gym_id": gym_id, "member_id": member_id, "member_name": name,
+                    "amount": plan["price"], "payment_date": period_start, "payment_method": method,
+                    "status": "paid", "transaction_id": None, "notes": None,
+                    "plan_id": plan["id"], "plan_name": plan["name"]
+                })
+                period_start += timedelta(days=plan["duration_days"])
+
+            await writer.add("users", {
+                "id": new_id(), "email": email, "password_hash": password_hash, "name": name, "phone": phone,
+                "role": "member", "gym_id": gym_id, "created_at": start_date, "is_active": True
+            })
+            await writer.add("members", {
+                "id": member_id, "gym_id": gym_id, "name": name, "email": email, "password_hash": password_hash,
+                "phone": phone, "address": None, "date_of_birth": None, "emergency_contact": None,
+                "plan_id": plan["id"], "membership_status": status, "start_date": start_date, "end_date": end_date,
+                "created_at": start_date, "last_visit": last_visit, "total_visits": visits,
+                "auto_renewal": random.random() < 0.6
+            })
+            if status == "active" and len(active_emails) < fixture_limit:
+                active_emails.append(email)
+
+        # Every generated visit is checked out, so nobody is in the gym right now
+        await writer.add("gym_occupancy", {"gym_id": gym_id, "current": 0, "updated_at": now})
+        fixtures.append({"gym_id": gym_id, "owner_email": owner_email, "member_emails": active_emails})
+
+    await writer.close()
+    return fixtures, writer.counts
+
+async def build_derived_stores(server):
+    """Fill the stores the API maintains on write, using server.py's rebuild and replay functions on server.db"""
+    db = server.db
+    gym_ids = await db.gyms.distinct("id")
+    for gym_id in gym_ids:
+        await server.rebuild_attendance_history(gym_id)
+        await server.rebuild_revenue_aggregates(gym_id)  # Also rebuilds member_balances
+    await server.backfill_occupancy_hourly()
+
+    cursor = db.workout_progress.find({"status": "completed"}, {"_id": 0}).sort("scheduled_date", 1)
+    batch = await cursor.to_list(DERIVED_BATCH_SIZE)
+    while batch:
+        await server.record_exercise_logs(batch)
+        batch = await cursor.to_list(DERIVED_BATCH_SIZE)
+
+    # Diet logs are scored against their template the way the log route does it
+    templates = {template["id"]: template for template in await db.diet_templates.find({}, {"_id": 0}).to_list(None)}
+    cursor = db.diet_progress.find({}, {"_id": 0}).sort("date", 1)
+    batch = await cursor.to_list(DERIVED_BATCH_SIZE)
+    while batch:
+        for progress in batch:
+            entry = server.DietProgressCreate(**progress)
+            progress["adherence"] = server.compute_diet_adherence(entry, templates[progress["diet_template_id"]]).dict()
+        await db.diet_progress.bulk_write([
+            server.UpdateOne({"id": progress["id"]}, {"$set": {"adherence": progress["adherence"]}})
+            for progress in batch
+        ], ordered=False)
+        await server.record_diet_adherence(batch)
+        batch = await cursor.to_list(DERIVED_BATCH_SIZE)
+
+def load_server(mongo_url, db_name):
+    """Import backend/server.py pointed at the generated database"""
+    os.environ["MONGO_URL"] = mongo_url
+    os.environ["DB_NAME"] = db_name
+    sys.path.insert(0, str(ROOT_DIR / "backend"))
+    import server
+    return server
+
+async def main(args):
+    server = load_server(args.mongo_url, args.db_name)
+    client, db = server.client, server.db
+    if args.drop:
+        print(f"Dropping database {args.db_name}...")
+        await client.drop_database(args.db_name)
+
+    print(f"Generating {args.gyms} gyms x {args.members} members x {args.days} days into {args.db_name}...")
+    started = time.perf_counter()
+    fixtures, counts = await generate(
+        db, gyms=args.gyms, members_per_gym=args.members, days=args.days,
+        workout_templates=args.workout_templates, diet_templates=args.diet_templates,
+        assignment_rate=args.assignment_rate, batch_size=args.batch_size,
+        concurrency=args.concurrency, seed=args.seed
+    )
+    print("Building derived stores...")
+    await server.ensure_indexes()
+    await build_derived_stores(server)
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for collection, count in sorted(counts.items()):
+        print(f"  {collection:<20} {count:>12,}")
+    print(f"Wrote {total:,} documents in {elapsed:.1f}s ({total / elapsed:,.0f} docs/s)")
+    print(f"Sample owner login: {fixtures[0]['owner_email']} / {DEFAULT_PASSWORD}")
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=DEFAULT_DB_NAME, help="Not read from DB_NAME, so --drop stays off the app database")
+    parser.add_argument("--gyms", type=int, default=5)
+    parser.add_argument("--members", type=int, default=500, help="Members per gym")
+    parser.add_argument("--days", type=int, default=365, help="Days of history")
+    parser.add_argument("--workout-templates", type=int, default=8, help="Workout templates per gym")
+    parser.add_argument("--diet-templates", type=int, default=6, help="Diet templates per gym")
+    parser.add_argument("--assignment-rate", type=float, default=0.5, help="Share of members with each plan type assigned")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8, help="insert_many calls in flight")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help="Drop the database first")
+    asyncio.run(main(parser.parse_args()))
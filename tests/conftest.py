@@ -0,0 +1,21 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "gymble_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """server.db swapped for an in-memory mongomock-motor database"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    database = AsyncMongoMockClient()["gymble_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from server import recent_month_keys, streaks_from_days
+
+
+def test_no_days():
+    assert streaks_from_days([]) == (0, 0)
+
+
+def test_current_streak_is_the_run_ending_on_the_last_day():
+    days = ["2026-03-01", "2026-03-02", "2026-03-03", "2026-03-05", "2026-03-06"]
+    assert streaks_from_days(days) == (2, 3)
+
+
+def test_order_and_repeats_do_not_matter():
+    days = ["2026-03-03", "2026-03-01", "2026-03-02", "2026-03-02"]
+    assert streaks_from_days(days) == (3, 3)
+
+
+def test_runs_cross_month_boundaries():
+    assert streaks_from_days(["2026-02-27", "2026-02-28", "2026-03-01"]) == (3, 3)
+
+
+def test_recent_month_keys_are_newest_first_across_a_year_boundary():
+    assert recent_month_keys(3, datetime(2026, 2, 15)) == ["2026-02", "2026-01", "2025-12"]
+    assert recent_month_keys(1, datetime(2026, 12, 31)) == ["2026-12"]
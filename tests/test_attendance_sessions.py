@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+
+MEMBER = {"id": "member-1", "name": "Asha Rao"}
+
+
+def test_check_in_then_check_out_updates_the_bucket(db):
+    async def scenario():
+        await db.members.insert_one({"id": "member-1", "gym_id": "gym-1", "name": "Asha Rao", "total_visits": 0})
+        session = await server.sessions.open("gym-1", MEMBER, source="qr")
+        check_out_time = session.check_in_time + timedelta(minutes=75)
+        closed = await server.sessions.close(session.dict(), check_out_time)
+        bucket = await db.attendance_buckets.find_one({"member_id": "member-1"})
+        summary = await db.attendance_summaries.find_one({"member_id": "member-1"})
+        occupancy = await db.gym_occupancy.find_one({"gym_id": "gym-1"})
+        return session, closed, bucket, summary, occupancy
+
+    session, closed, bucket, summary, occupancy = asyncio.run(scenario())
+    assert closed["duration_minutes"] == 75
+    visit = bucket["sessions"][session.id]
+    assert visit["duration_minutes"] == 75
+    assert abs(visit["check_out_time"] - (session.check_in_time + timedelta(minutes=75))) < timedelta(seconds=1)
+    assert bucket["visits"] == 1
+    assert bucket["completed_visits"] == 1
+    assert bucket["total_minutes"] == 75
+    assert summary["completed_visits"] == 1
+    assert summary["total_minutes"] == 75
+    assert occupancy["current"] == 0
+
+
+def test_legacy_session_arrays_are_keyed_by_visit_id(db):
+    check_in = datetime(2026, 3, 10, 7, 0)
+
+    async def scenario():
+        await db.attendance_buckets.insert_one({
+            "member_id": "member-1", "month": "2026-03", "gym_id": "gym-1",
+            "sessions": [
+                {"id": "v1", "check_in_time": check_in, "duration_minutes": 60},
+                {"id": "v2", "check_in_time": check_in + timedelta(days=1), "duration_minutes": None}
+            ]
+        })
+        await server.key_bucket_sessions_by_id()
+        return await db.attendance_buckets.find_one({"member_id": "member-1"})
+
+    sessions = asyncio.run(scenario())["sessions"]
+    assert sessions["v1"] == {"check_in_time": check_in, "check_out_time": check_in + timedelta(minutes=60), "duration_minutes": 60}
+    assert sessions["v2"] == {"check_in_time": check_in + timedelta(days=1), "check_out_time": None, "duration_minutes": None}
+
+
+def test_sweep_corrects_drifted_counters(db):
+    now = datetime(2026, 3, 10, 18, 0)
+
+    async def scenario():
+        await db.attendance.insert_many([
+            {"id": "v1", "gym_id": "gym-1", "member_id": "m1", "check_in_time": now - timedelta(hours=1), "check_out_time": None},
+            {"id": "v2", "gym_id": "gym-1", "member_id": "m2", "check_in_time": now - timedelta(hours=2), "check_out_time": None},
+            {"id": "v3", "gym_id": "gym-3", "member_id": "m3", "check_in_time": now - timedelta(hours=1), "check_out_time": None},
+        ])
+        await db.gym_occupancy.insert_many([{"gym_id": "gym-1", "current": 5}, {"gym_id": "gym-2", "current": 2}])
+        await server.sweep_stale_sessions(now)
+        return {doc["gym_id"]: doc["current"] for doc in await db.gym_occupancy.find().to_list(None)}
+
+    assert asyncio.run(scenario()) == {"gym-1": 2, "gym-2": 0, "gym-3": 1}
+
+
+def test_sweep_leaves_a_counter_that_moved_during_the_recount(db, monkeypatch):
+    now = datetime(2026, 3, 10, 18, 0)
+
+    class CheckInDuringRecount:
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        async def to_list(self, length):
+            rows = await self.cursor.to_list(length)
+            await db.gym_occupancy.update_one({"gym_id": "gym-1"}, {"$inc": {"current": 1}})
+            return rows
+
+    class Attendance:
+        def aggregate(self, pipeline):
+            return CheckInDuringRecount(db.attendance.aggregate(pipeline))
+
+        def __getattr__(self, name):
+            return getattr(db.attendance, name)
+
+    monkeypatch.setattr(server.SessionStore, "collection", property(lambda self: Attendance()))
+
+    async def scenario():
+        await db.gym_occupancy.insert_one({"gym_id": "gym-1", "current": 3})
+        await server.sweep_stale_sessions(now)
+        return (await db.gym_occupancy.find_one({"gym_id": "gym-1"}))["current"]
+
+    assert asyncio.run(scenario()) == 4
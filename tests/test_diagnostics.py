@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from diagnostics import EventLoopMonitor, RequestScopeMiddleware
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.get("/blocking/{item_id}")
+    async def blocking_endpoint(item_id: str):
+        time.sleep(0.2)
+        return {"id": item_id}
+
+    app.add_middleware(RequestScopeMiddleware)
+    return app
+
+
+def test_slow_callback_is_attributed_to_the_blocking_route():
+    app = make_app()
+    monitor = EventLoopMonitor(slow_callback_ms=50)
+    monitor.register_routes(app.routes)
+
+    async def scenario():
+        monitor.start()
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                # Its own task, as the server runs each request
+                response = await asyncio.create_task(client.get("/blocking/42"))
+            assert response.status_code == 200
+        finally:
+            monitor.stop()
+
+    asyncio.run(scenario())
+    routes = [event["route"] for event in monitor.events if event["kind"] == "slow_callback"]
+    assert routes
+    assert set(routes) == {"GET /blocking/{item_id}"}
@@ -0,0 +1,14 @@
+from server import UNPAGED_HISTORY_LIMIT, history_page_size
+
+
+def test_explicit_limit_wins():
+    assert history_page_size(25, None, 100) == 25
+    assert history_page_size(25, "cursor", 100) == 25
+
+
+def test_unpaged_request_keeps_the_pre_paging_size():
+    assert history_page_size(None, None, 100) == UNPAGED_HISTORY_LIMIT
+
+
+def test_following_a_cursor_uses_the_default_page():
+    assert history_page_size(None, "cursor", 100) == 100
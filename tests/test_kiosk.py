@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from server import create_day_pass, resolve_kiosk_scan, verify_day_pass
+
+DAY = datetime(2026, 3, 10)
+MEMBER = {"id": "member-1", "name": "Asha Rao"}
+
+
+def make_pass(gym_id="gym-1", day=DAY):
+    return create_day_pass(gym_id, MEMBER, day, day + timedelta(days=1))
+
+
+def test_day_pass_verifies_within_its_day():
+    info = verify_day_pass(make_pass(), "gym-1", at=DAY + timedelta(hours=9))
+    assert info["member_id"] == "member-1"
+    assert info["member_name"] == "Asha Rao"
+    assert info["valid_on"] == "2026-03-10"
+
+
+def test_day_pass_is_rejected_outside_its_day():
+    assert verify_day_pass(make_pass(), "gym-1", at=DAY - timedelta(seconds=1)) is None
+    assert verify_day_pass(make_pass(), "gym-1", at=DAY + timedelta(days=1)) is None
+
+
+def test_day_pass_is_bound_to_its_gym():
+    assert verify_day_pass(make_pass(), "gym-2", at=DAY + timedelta(hours=9)) is None
+
+
+def test_tampered_or_malformed_day_pass_is_rejected():
+    prefix, payload, signature = make_pass().split(".")
+    other_payload = make_pass(gym_id="gym-2").split(".")[1]
+    at = DAY + timedelta(hours=9)
+    assert verify_day_pass(f"{prefix}.{other_payload}.{signature}", "gym-2", at=at) is None
+    for token in ("", "P1.abc", f"P2.{payload}.{signature}", f"P1.{payload}.!!", "P1." + "a" * 2000 + ".b"):
+        assert verify_day_pass(token, "gym-1", at=at) is None
+
+
+def visit(hour, minute=0, out=None):
+    check_in = DAY + timedelta(hours=hour, minutes=minute)
+    return {"id": f"v{hour}", "check_in_time": check_in, "check_out_time": check_in + timedelta(minutes=out) if out else None}
+
+
+def test_scan_outside_any_visit_checks_in():
+    assert resolve_kiosk_scan([], DAY + timedelta(hours=7)) == ("check_in", None)
+    assert resolve_kiosk_scan([visit(7, out=60)], DAY + timedelta(hours=18)) == ("check_in", None)
+
+
+def test_scan_inside_open_visit_checks_it_out():
+    open_visit = visit(7)
+    assert resolve_kiosk_scan([open_visit], DAY + timedelta(hours=8)) == ("check_out", open_visit)
+
+
+def test_scan_inside_closed_visit_is_a_conflict():
+    closed_visit = visit(7, out=90)
+    assert resolve_kiosk_scan([closed_visit], DAY + timedelta(hours=8)) == ("conflict", closed_visit)
+
+
+def test_repeat_taps_are_duplicates():
+    closed_visit = visit(7, out=60)
+    within = timedelta(seconds=server.KIOSK_DEBOUNCE_SECONDS)
+    assert resolve_kiosk_scan([closed_visit], closed_visit["check_in_time"] + within)[0] == "duplicate"
+    assert resolve_kiosk_scan([closed_visit], closed_visit["check_out_time"] - within)[0] == "duplicate"
+
+
+def test_open_visit_that_started_latest_is_checked_out():
+    earlier, later = visit(7), visit(9)
+    assert resolve_kiosk_scan([earlier, later], DAY + timedelta(hours=10)) == ("check_out", later)
+
+
+def test_backdated_open_skips_live_occupancy(db):
+    async def scenario():
+        await db.members.insert_one({"id": "member-1", "gym_id": "gym-1", "name": "Asha Rao", "total_visits": 0})
+        live = await server.sessions.open("gym-1", MEMBER, source="qr")
+        late = await server.sessions.open(
+            "gym-1", MEMBER, source="kiosk", check_in_time=datetime.utcnow() - timedelta(hours=3)
+        )
+        occupancy = await db.gym_occupancy.find_one({"gym_id": "gym-1"})
+        hourly = await db.occupancy_hourly.find_one({"date": late.check_in_time.strftime("%Y-%m-%d")})
+        member = await db.members.find_one({"id": "member-1"})
+        return live, late, occupancy, hourly, member
+
+    live, late, occupancy, hourly, member = asyncio.run(scenario())
+    assert not live.backdated and late.backdated
+    assert occupancy["current"] == 1
+    late_hour = hourly["hours"][f"{late.check_in_time.hour:02d}"]
+    assert late_hour["checkins"] == 1
+    assert "peak" not in late_hour
+    assert member["total_visits"] == 2
+    assert abs(member["last_visit"] - live.check_in_time) < timedelta(seconds=1)
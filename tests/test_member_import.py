@@ -0,0 +1,29 @@
+import io
+import json
+
+import pytest
+
+from server import iter_json_array
+
+
+def parse(text, chunk_size=4):
+    stream = io.StringIO(text)
+    assert stream.read(1) == "["
+    return list(iter_json_array(stream, chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 4096])
+def test_items_are_parsed_across_chunk_boundaries(chunk_size):
+    rows = [{"name": "Asha", "phone": "+91 98765 43210"}, 12345, "text, with ] and [", [1, 2], None, 1.5e3]
+    assert parse(json.dumps(rows), chunk_size) == rows
+
+
+def test_whitespace_and_empty_array():
+    assert parse("[ \n ]") == []
+    assert parse('[  \n {"a": 1}  ,\n {"b": 2}\n ]  ') == [{"a": 1}, {"b": 2}]
+
+
+@pytest.mark.parametrize("text", ['[{"a": 1}', '[{"a": 1} {"b": 2}]', '[{"a": 1},]', '[,{"a": 1}]', '[{"a": }]'])
+def test_malformed_arrays_raise(text):
+    with pytest.raises(json.JSONDecodeError):
+        parse(text)
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+import server
+
+
+def payment(payment_id, status="paid", amount=1500.0, key=None, day=1):
+    return {
+        "id": payment_id, "gym_id": "gym-1", "member_id": "member-1", "member_name": "Asha Rao",
+        "amount": amount, "payment_date": datetime(2026, 3, day), "payment_method": "upi",
+        "status": status, "plan_id": "plan-1", "plan_name": "Monthly Basic", "idempotency_key": key
+    }
+
+
+def test_failed_payments_do_not_count_towards_the_balance(db):
+    async def scenario():
+        await server.update_member_balances([
+            payment("p1", day=1), payment("p2", status="failed", day=2), payment("p3", status="pending", day=3)
+        ])
+        return await db.member_balances.find_one({"member_id": "member-1"})
+
+    balance = asyncio.run(scenario())
+    assert balance["total_paid"] == 1500.0
+    assert balance["outstanding"] == 1500.0
+    assert balance["payments"] == 2
+    assert balance["last_payment_at"] == datetime(2026, 3, 1)
+
+
+def test_only_failed_payments_leave_no_balance(db):
+    asyncio.run(server.update_member_balances([payment("p1", status="failed")]))
+    assert asyncio.run(db.member_balances.find_one({"member_id": "member-1"})) is None
+
+
+def test_insert_payments_skips_stored_idempotency_keys(db):
+    async def scenario():
+        await db.payments.create_index(
+            [("gym_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}}
+        )
+        first = await server.insert_payments([payment("p1", key="renewal:1")])
+        retried = await server.insert_payments([payment("p2", key="renewal:1"), payment("p3", key="renewal:2")])
+        balance = await db.member_balances.find_one({"member_id": "member-1"})
+        month = await db.revenue_monthly.find_one({"gym_id": "gym-1", "month": "2026-03"})
+        return first, retried, balance, month
+
+    first, retried, balance, month = asyncio.run(scenario())
+    assert [p["id"] for p in first] == ["p1"]
+    assert [p["id"] for p in retried] == ["p3"]
+    assert balance["payments"] == 2
+    assert balance["total_paid"] == 3000.0
+    assert month["revenue"] == 3000.0
+    assert month["payments"] == 2
+
+
+def test_settling_keeps_the_payment_in_its_billing_month(db):
+    owner = server.User(email="owner@example.com", password_hash="x", name="Owner", phone="1", role="owner", gym_id="gym-1")
+
+    async def scenario():
+        await server.insert_payments([payment("p1", status="pending", day=5)])
+        settled = await server.mark_payment_paid("p1", server.PaymentSettle(), owner)
+        stored = await db.payments.find_one({"id": "p1"})
+        month = await db.revenue_monthly.find_one({"gym_id": "gym-1", "month": "2026-03"})
+        return settled, stored, month
+
+    settled, stored, month = asyncio.run(scenario())
+    assert settled.status == "paid"
+    assert stored["payment_date"] == datetime(2026, 3, 5)
+    assert stored["paid_at"] > datetime(2026, 3, 5)
+    assert month["revenue"] == 1500.0
+    assert month["payments"] == 1
+    assert month["outstanding"] == 0
+    assert month["outstanding_payments"] == 0
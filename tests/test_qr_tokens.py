@@ -0,0 +1,40 @@
+from server import QR_GRACE_SLOTS, QR_ROTATION_SECONDS, create_qr_token, current_qr_slot, validate_qr_code
+
+# A fixed clock in the middle of a slot, so no test straddles a rotation
+NOW = 1_770_000_000 // QR_ROTATION_SECONDS * QR_ROTATION_SECONDS + QR_ROTATION_SECONDS // 2
+SLOT = current_qr_slot(NOW)
+
+
+def test_current_token_is_valid():
+    assert validate_qr_code(create_qr_token("gym-1", SLOT), "gym-1", now=NOW)
+
+
+def test_grace_slots_are_accepted_and_older_slots_are_not():
+    assert validate_qr_code(create_qr_token("gym-1", SLOT - QR_GRACE_SLOTS), "gym-1", now=NOW)
+    assert not validate_qr_code(create_qr_token("gym-1", SLOT - QR_GRACE_SLOTS - 1), "gym-1", now=NOW)
+
+
+def test_future_slot_is_rejected():
+    assert not validate_qr_code(create_qr_token("gym-1", SLOT + 1), "gym-1", now=NOW)
+
+
+def test_token_expires_once_its_grace_slots_have_passed():
+    token = create_qr_token("gym-1", SLOT)
+    assert validate_qr_code(token, "gym-1", now=NOW + QR_GRACE_SLOTS * QR_ROTATION_SECONDS)
+    assert not validate_qr_code(token, "gym-1", now=NOW + (QR_GRACE_SLOTS + 1) * QR_ROTATION_SECONDS)
+
+
+def test_token_is_bound_to_its_gym():
+    assert not validate_qr_code(create_qr_token("gym-1", SLOT), "gym-2", now=NOW)
+
+
+def test_tampered_and_malformed_tokens_are_rejected():
+    prefix, slot, signature = create_qr_token("gym-1", SLOT).split(".")
+    forged = "A" if signature[0] != "A" else "B"
+    assert not validate_qr_code(f"{prefix}.{slot}.{forged}{signature[1:]}", "gym-1", now=NOW)
+    for token in ("", "G1", "G1.abc", "X1.abc.def", f"G1.!!.{signature}", f"G1.{'z' * 13}.{signature}"):
+        assert not validate_qr_code(token, "gym-1", now=NOW)
+
+
+def test_surrounding_whitespace_is_ignored():
+    assert validate_qr_code(f" {create_qr_token('gym-1', SLOT)}\n", "gym-1", now=NOW)